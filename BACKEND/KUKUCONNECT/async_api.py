@@ -0,0 +1,132 @@
+"""
+Async read endpoints next to the DRF views.
+
+DRF views are synchronous, so under ASGI every request to them holds a
+worker thread. For the hot read paths we mount async twins (under
+``/api/async/``) that reuse the DRF view classes for everything that does
+not touch the database -- permissions, querysets, filtering, serializers --
+and only run the queries through Django's async ORM API. Responses are
+rendered with DRF's JSONRenderer, so the bodies match the sync endpoints
+byte for byte.
+
+JWT authentication is done here as well, since simplejwt only ships a
+synchronous authentication class: the token is checked in-process and the
+user is loaded by simplejwt's own ``get_user`` in a worker thread, so its
+checks (inactive users, revoked tokens) apply unchanged.
+
+Every async ORM call runs in a per-request worker thread with its own
+database connection, so an event loop with hundreds of requests in flight
+would open hundreds of connections. At most ``ASYNC_DB_CONCURRENCY``
+endpoints per process run at once; the rest wait on the event loop, which
+costs nothing, instead of on Postgres' connection limit.
+"""
+import asyncio
+import weakref
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from django.contrib.auth.models import AnonymousUser
+from django.core.exceptions import ObjectDoesNotExist
+from django.http import Http404, HttpResponse, HttpResponseNotAllowed
+from django.http.response import HttpResponseBase
+from rest_framework import exceptions
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.views import exception_handler
+from rest_framework_simplejwt.authentication import JWTAuthentication
+
+jwt_authentication = JWTAuthentication()
+_limits = weakref.WeakKeyDictionary()
+
+
+def db_slots():
+    """
+    The semaphore bounding concurrent endpoints on the running event loop.
+    """
+    loop = asyncio.get_running_loop()
+    if loop not in _limits:
+        _limits[loop] = asyncio.Semaphore(settings.ASYNC_DB_CONCURRENCY)
+    return _limits[loop]
+
+
+async def idle(seconds):
+    """
+    Sleep inside an endpoint without holding its database slot, so
+    long-polling clients do not starve other requests.
+    """
+    slots = db_slots()
+    slots.release()
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        await slots.acquire()
+
+
+async def aauthenticate(request):
+    """
+    Return the user a request's ``Authorization: Bearer`` token belongs to,
+    or None when no token was sent. Bad tokens raise AuthenticationFailed,
+    exactly as simplejwt's JWTAuthentication does.
+    """
+    header = jwt_authentication.get_header(request)
+    if header is None:
+        return None
+    raw_token = jwt_authentication.get_raw_token(header)
+    if raw_token is None:
+        return None
+    token = jwt_authentication.get_validated_token(raw_token)
+    return await sync_to_async(jwt_authentication.get_user)(token)
+
+
+def render_json(data, status=200):
+    return HttpResponse(JSONRenderer().render(data), status=status, content_type='application/json')
+
+
+def error_response(exc, view):
+    response = exception_handler(exc, {'view': view, 'request': view.request})
+    rendered = render_json(response.data, status=response.status_code)
+    for name, value in response.items():
+        rendered[name] = value
+    if isinstance(exc, (exceptions.NotAuthenticated, exceptions.AuthenticationFailed)):
+        rendered['WWW-Authenticate'] = jwt_authentication.authenticate_header(view.request)
+    return rendered
+
+
+def async_endpoint(view_class):
+    """
+    Turn ``async def handler(view, request, **kwargs)`` into an async
+    Django GET view that behaves like ``view_class``.
+
+    The handler receives a set-up ``view_class`` instance, whose
+    ``request.user`` is authenticated and whose permissions have been
+    checked. It returns data to render as JSON or a ready response.
+    """
+    def decorator(handler):
+        @wraps(handler)
+        async def endpoint(request, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return HttpResponseNotAllowed(['GET', 'HEAD'])
+            view = view_class()
+            view.setup(Request(request), **kwargs)
+            view.format_kwarg = None
+            try:
+                async with db_slots():
+                    user = await aauthenticate(request)
+                    view.request.user = user or AnonymousUser()
+                    for permission in view.get_permissions():
+                        if not permission.has_permission(view.request, view):
+                            if user is None:
+                                raise exceptions.NotAuthenticated()
+                            raise exceptions.PermissionDenied(getattr(permission, 'message', None))
+                    result = await handler(view, view.request, **kwargs)
+            except (Http404, ObjectDoesNotExist):
+                return error_response(exceptions.NotFound(), view)
+            except exceptions.APIException as exc:
+                return error_response(exc, view)
+            if isinstance(result, HttpResponseBase):
+                return result
+            return render_json(result)
+        return endpoint
+    return decorator
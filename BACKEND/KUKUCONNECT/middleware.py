@@ -0,0 +1,160 @@
+import os
+import time
+from contextlib import ExitStack
+from urllib.parse import urlparse
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+from whitenoise.middleware import WhiteNoiseMiddleware
+from whitenoise.responders import IsDirectoryError, MissingFileError
+from whitenoise.string_utils import ensure_leading_trailing_slash
+
+
+class QueryStats:
+    """
+    ``execute_wrapper`` hook counting queries and the time spent in them.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.duration += time.perf_counter() - start
+
+
+class QueryTimingMiddleware:
+    """
+    Report the ORM query count and database time of each request in a
+    ``Server-Timing`` header, e.g.::
+
+        Server-Timing: db;dur=3.2;desc="4 queries", app;dur=11.8
+
+    Browsers show it in the network panel. Queries run while a streaming
+    response is consumed happen after this point and are not counted. Only
+    active with DEBUG or SERVER_TIMING on; otherwise requests pass through
+    untouched.
+
+    Under ASGI the async ORM runs queries in the request's thread-sensitive
+    worker thread, whose connections are separate objects; the hooks are
+    installed in that thread so async views are measured the same way.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not self.enabled():
+            return self.get_response(request)
+        stats = QueryStats()
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            self.install(stack, stats)
+            response = self.get_response(request)
+        return self.add_header(response, stats, time.perf_counter() - start)
+
+    async def __acall__(self, request):
+        if not self.enabled():
+            return await self.get_response(request)
+        stats = QueryStats()
+        start = time.perf_counter()
+        stack = ExitStack()
+        await sync_to_async(self.install)(stack, stats)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(stack.close)()
+        return self.add_header(response, stats, time.perf_counter() - start)
+
+    def enabled(self):
+        return settings.DEBUG or settings.SERVER_TIMING
+
+    def install(self, stack, stats):
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(stats))
+
+    def add_header(self, response, stats, elapsed):
+        timing = f'db;dur={stats.duration * 1000:.1f};desc="{stats.count} queries", app;dur={elapsed * 1000:.1f}'
+        if response.has_header('Server-Timing'):
+            timing = f"{response['Server-Timing']}, {timing}"
+        response['Server-Timing'] = timing
+        return response
+
+
+class AsyncWhiteNoiseMiddleware(WhiteNoiseMiddleware):
+    """
+    WhiteNoise that can sit in an async middleware chain.
+
+    WhiteNoise's middleware is sync-only, which would make Django run every
+    async view of an ASGI deployment through a thread. Static files are
+    still served by WhiteNoise (in a thread); everything else passes
+    straight through to the async handler.
+
+    With SERVE_MEDIA on, uploads under MEDIA_URL are served from MEDIA_ROOT
+    too. They are looked up on disk per request, as uploads arrive after
+    startup, and get an immutable Cache-Control since their names are
+    content hashes (see products/images.py).
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response=None, *args, **kwargs):
+        # Set first: WhiteNoise calls immutable_file_test while scanning.
+        self.media_prefix = None
+        if settings.SERVE_MEDIA and not urlparse(settings.MEDIA_URL).netloc:
+            self.media_prefix = ensure_leading_trailing_slash(urlparse(settings.MEDIA_URL).path)
+            self.media_root = os.path.realpath(settings.MEDIA_ROOT)
+        super().__init__(get_response, *args, **kwargs)
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        media_file = self.find_media(request.path_info)
+        if media_file is not None:
+            return self.serve(media_file, request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        if self.autorefresh:
+            static_file = await sync_to_async(self.find_file)(request.path_info)
+        else:
+            static_file = self.files.get(request.path_info)
+        if static_file is None and self.is_media(request.path_info):
+            static_file = await sync_to_async(self.find_media)(request.path_info)
+        if static_file is not None:
+            return await sync_to_async(self.serve)(static_file, request)
+        return await self.get_response(request)
+
+    def is_media(self, url):
+        return self.media_prefix is not None and url.startswith(self.media_prefix)
+
+    def find_media(self, url):
+        """
+        The uploaded file ``url`` points to, or None.
+        """
+        if not self.is_media(url) or not self.url_is_canonical(url):
+            return None
+        path = os.path.join(self.media_root, url[len(self.media_prefix):])
+        if os.path.commonpath((self.media_root, path)) != self.media_root:
+            return None
+        try:
+            return self.get_static_file(path, url)
+        except (MissingFileError, IsDirectoryError):
+            return None
+
+    def immutable_file_test(self, path, url):
+        return self.is_media(url) or super().immutable_file_test(path, url)
@@ -38,6 +38,10 @@ DEBUG = os.environ.get('DEBUG', 'False') == 'True'
 # FIXED (A05): Now reads from environment variable.
 ALLOWED_HOSTS = os.environ.get('ALLOWED_HOSTS', 'localhost,127.0.0.1').split(',')
 
+# Send query counts and timings in a Server-Timing header. Always on with
+# DEBUG; otherwise off, as it tells every client how the backend performs.
+SERVER_TIMING = os.environ.get('SERVER_TIMING', 'False') == 'True'
+
 
 # Application definition
 
@@ -48,6 +52,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'corsheaders',
     'rest_framework',
     'rest_framework_simplejwt',
@@ -68,9 +73,10 @@ INSTALLED_APPS = [
 # the 301 redirects on your OPTIONS requests.
 # ---
 MIDDLEWARE = [
+    'KUKUCONNECT.middleware.QueryTimingMiddleware',  # Outermost, so it sees every query
     'django.middleware.security.SecurityMiddleware',
     'corsheaders.middleware.CorsMiddleware',  # <-- MOVED HERE
-    "whitenoise.middleware.WhiteNoiseMiddleware",
+    'KUKUCONNECT.middleware.AsyncWhiteNoiseMiddleware',  # WhiteNoise, usable under ASGI
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -132,6 +138,64 @@ else:
         }
     }
 
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+
+# Local memory by default so the app runs without outside services. Point
+# CACHE_BACKEND/CACHE_LOCATION at Redis or Memcached to share it between workers.
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', 'kukuconnect'),
+    }
+}
+
+# Seconds a cached marketplace page lives. Catalog writes invalidate
+# earlier than this by bumping the catalog version.
+MARKETPLACE_CACHE_TIMEOUT = int(os.environ.get('MARKETPLACE_CACHE_TIMEOUT', 300))
+# Seconds each worker reuses the catalog version before reading it again,
+# i.e. how long other workers may serve pages from before an edit.
+CATALOG_VERSION_TTL = float(os.environ.get('CATALOG_VERSION_TTL', 1))
+
+# Matches ranked per product search, newest first (products/views.py).
+SEARCH_CANDIDATE_LIMIT = int(os.environ.get('SEARCH_CANDIDATE_LIMIT', 1000))
+
+# Minutes an unpaid order holds its stock before it goes back on sale.
+STOCK_RESERVATION_MINUTES = int(os.environ.get('STOCK_RESERVATION_MINUTES', 30))
+
+# Trending feed (products/trending.py): hours for a sale's weight to halve,
+# days without a sale before a product drops out, products kept per
+# category and seconds that list is cached.
+TRENDING_HALF_LIFE_HOURS = float(os.environ.get('TRENDING_HALF_LIFE_HOURS', 48))
+TRENDING_WINDOW_DAYS = int(os.environ.get('TRENDING_WINDOW_DAYS', 7))
+TRENDING_TOP_K = int(os.environ.get('TRENDING_TOP_K', 20))
+TRENDING_CACHE_TIMEOUT = int(os.environ.get('TRENDING_CACHE_TIMEOUT', 60))
+
+# Products stored per buyer by refresh_recommendations, and seconds a
+# process reuses its loaded product index for single-buyer refreshes.
+RECOMMENDATIONS_PER_BUYER = int(os.environ.get('RECOMMENDATIONS_PER_BUYER', 20))
+RECOMMENDATION_INDEX_TTL = int(os.environ.get('RECOMMENDATION_INDEX_TTL', 300))
+
+# Threads in the shared background pool (KUKUCONNECT/workers.py) and how
+# many tasks may wait for one. 0 workers runs every task inline.
+BACKGROUND_WORKERS = int(os.environ.get('BACKGROUND_WORKERS', 2))
+BACKGROUND_QUEUE_SIZE = int(os.environ.get('BACKGROUND_QUEUE_SIZE', 64))
+
+# Async endpoints (KUKUCONNECT/async_api.py) running at once per process,
+# and so database connections they may hold. Keep workers x this under
+# Postgres' max_connections.
+ASYNC_DB_CONCURRENCY = int(os.environ.get('ASYNC_DB_CONCURRENCY', 20))
+
+# Product photo thumbnails: label -> longest side in pixels.
+THUMBNAIL_SIZES = {
+    'small': 160,
+    'medium': 480,
+    'large': 960,
+}
+THUMBNAIL_QUALITY = 80
+# Largest accepted upload, in bytes.
+PRODUCT_IMAGE_MAX_SIZE = int(os.environ.get('PRODUCT_IMAGE_MAX_SIZE', 10 * 1024 * 1024))
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -183,6 +247,16 @@ STATIC_URL = 'static/'
 STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 
+# Uploaded media. Names are content hashes, so files never change and are
+# served with immutable cache headers. In production MEDIA_URL should point
+# at the CDN or object store in front of the storage backend (whose uploads
+# should carry the same header); SERVE_MEDIA=True instead has WhiteNoise
+# serve MEDIA_ROOT from the app (see KUKUCONNECT/middleware.py). It is on
+# with DEBUG.
+MEDIA_URL = os.environ.get('MEDIA_URL', '/media/')
+MEDIA_ROOT = os.environ.get('MEDIA_ROOT', os.path.join(BASE_DIR, 'media'))
+SERVE_MEDIA = os.environ.get('SERVE_MEDIA', str(DEBUG)) == 'True'
+
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
@@ -301,6 +375,28 @@ MPESA_PASSKEY = os.environ.get('MPESA_PASSKEY')
 MPESA_INITIATOR_USERNAME = os.environ.get('MPESA_INITIATOR_NAME')
 MPESA_INITIATOR_SECURITY_CREDENTIAL = os.environ.get('MPESA_INITIATOR_PASSWORD')
 MPESA_PHONE_NUMBER = os.environ.get('MPESA_PHONE_NUMBER')
+# Overrides the environment's Daraja URL, e.g. with a local stub server.
+MPESA_API_BASE_URL = os.environ.get('MPESA_API_BASE_URL')
+# HTTP transport to Daraja: kept-alive connections per process, connect and
+# read timeouts in seconds, and retries (with backoff) per request.
+MPESA_POOL_SIZE = int(os.environ.get('MPESA_POOL_SIZE', 10))
+MPESA_CONNECT_TIMEOUT = float(os.environ.get('MPESA_CONNECT_TIMEOUT', 3.05))
+MPESA_READ_TIMEOUT = float(os.environ.get('MPESA_READ_TIMEOUT', 30))
+MPESA_RETRIES = int(os.environ.get('MPESA_RETRIES', 3))
+# Where Daraja posts STK push results: this site's /api/payments/callback/,
+# with ?token=MPESA_CALLBACK_TOKEN. Unless DEBUG is on, callbacks are
+# refused while no token is set.
+MPESA_CALLBACK_URL = os.environ.get('MPESA_CALLBACK_URL')
+MPESA_CALLBACK_TOKEN = os.environ.get('MPESA_CALLBACK_TOKEN')
+
+# Threads sending STK pushes (payments/dispatch.py), and how many payments
+# may wait for one before the rest are left to the dispatch_payments
+# command. Each thread holds a database connection while it works.
+STK_PUSH_WORKERS = int(os.environ.get('STK_PUSH_WORKERS', 10))
+STK_PUSH_QUEUE_SIZE = int(os.environ.get('STK_PUSH_QUEUE_SIZE', 500))
+# Seconds after which a payment still SENDING is taken to have lost its
+# dispatcher (a push takes at most the connect plus read timeouts).
+STK_PUSH_SENDING_TIMEOUT = int(os.environ.get('STK_PUSH_SENDING_TIMEOUT', 120))
 
 # ---
 # FIXED: A02: CRYPTOGRAPHIC FAILURES
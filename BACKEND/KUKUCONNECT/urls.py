@@ -24,6 +24,10 @@ urlpatterns = [
     path('api/products/', include('products.urls')),  # Your products app
     path('api/payments/', include('payments.urls')),  # Your payments app
     path('api/', include('chatbot.urls')),  # Your chatbot app
+    # Async twins of the hot read endpoints, for ASGI deployments
+    path('api/async/users/', include('users.async_urls')),
+    path('api/async/products/', include('products.async_urls')),
+    path('api/async/payments/', include('payments.async_urls')),
     # Swagger URLs
     re_path(r'^swagger(?P<format>\.json|\.yaml)$', schema_view.without_ui(cache_timeout=0), name='schema-json'),
     path('', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
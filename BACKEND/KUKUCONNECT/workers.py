@@ -0,0 +1,129 @@
+"""
+Small, bounded background pools for work that should not hold up a request
+(image thumbnailing, calls to slow outside services, ...).
+
+Pools are per process. The default pool is shared by every app: at most
+``BACKGROUND_WORKERS`` tasks run at once and at most
+``BACKGROUND_QUEUE_SIZE`` more may wait; when the queue is full the task runs
+in the submitting thread instead, so a burst slows its own requests down
+rather than piling up unbounded work in memory. With
+``BACKGROUND_WORKERS = 0`` every task runs inline, which is what tests use.
+
+Work that must never run in a request thread (such as waiting on a payment
+provider) gets its own :class:`BackgroundPool` and uses :meth:`try_submit`,
+which reports a full queue instead of running the task inline.
+
+Tasks must only take ids and plain values; they read what they need from
+the database themselves. Submit them with :func:`submit_on_commit` from
+inside a transaction so they never see uncommitted or rolled-back rows.
+"""
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+logger = logging.getLogger(__name__)
+
+
+def _run(fn, args, kwargs):
+    try:
+        return fn(*args, **kwargs)
+    except Exception:
+        logger.exception('Background task %s failed', getattr(fn, '__qualname__', fn))
+        raise
+
+
+def _run_inline(fn, args, kwargs):
+    future = Future()
+    try:
+        future.set_result(_run(fn, args, kwargs))
+    except Exception as exc:
+        future.set_exception(exc)
+    return future
+
+
+class BackgroundPool:
+    """
+    A thread pool sized by the ``workers_setting`` and ``queue_setting``
+    settings, started on first use.
+    """
+
+    def __init__(self, name, workers_setting, queue_setting):
+        self.name = name
+        self.workers_setting = workers_setting
+        self.queue_setting = queue_setting
+        self._executor = None
+        self._slots = None
+        self._lock = threading.Lock()
+
+    @property
+    def workers(self):
+        return getattr(settings, self.workers_setting)
+
+    def _get_executor(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._slots = threading.BoundedSemaphore(self.workers + getattr(settings, self.queue_setting))
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=self.name)
+        return self._executor
+
+    def _run_in_worker(self, fn, args, kwargs):
+        # Worker threads keep their own database connections; drop broken or
+        # expired ones around each task as the request cycle would.
+        close_old_connections()
+        try:
+            return _run(fn, args, kwargs)
+        finally:
+            close_old_connections()
+            self._slots.release()
+
+    def try_submit(self, fn, *args, **kwargs):
+        """
+        Queue ``fn(*args, **kwargs)`` and return a Future, or return None
+        when the queue is full. Runs inline when the pool has no workers.
+        """
+        if self.workers <= 0:
+            return _run_inline(fn, args, kwargs)
+        executor = self._get_executor()
+        if not self._slots.acquire(blocking=False):
+            return None
+        try:
+            return executor.submit(self._run_in_worker, fn, args, kwargs)
+        except RuntimeError:
+            # The executor is shutting down with the process.
+            self._slots.release()
+            return None
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Run ``fn(*args, **kwargs)`` in the pool, or inline when its queue is
+        full, and return a Future. Failures are logged; they never propagate
+        to the caller.
+        """
+        future = self.try_submit(fn, *args, **kwargs)
+        if future is None:
+            logger.warning('%s queue full, running %s inline', self.name, getattr(fn, '__qualname__', fn))
+            future = _run_inline(fn, args, kwargs)
+        return future
+
+
+default_pool = BackgroundPool('background', 'BACKGROUND_WORKERS', 'BACKGROUND_QUEUE_SIZE')
+
+
+def submit(fn, *args, **kwargs):
+    """
+    Run ``fn(*args, **kwargs)`` in the default pool and return a Future.
+    Failures are logged; they never propagate to the caller.
+    """
+    return default_pool.submit(fn, *args, **kwargs)
+
+
+def submit_on_commit(fn, *args, **kwargs):
+    """
+    Submit the task once the current transaction commits (immediately when
+    there is none).
+    """
+    transaction.on_commit(lambda: submit(fn, *args, **kwargs))
@@ -0,0 +1,159 @@
+"""
+Compare catalog read throughput of the sync and async deployments.
+
+Starts the app twice with gunicorn -- sync workers on KUKUCONNECT.wsgi, then
+uvicorn workers on KUKUCONNECT.asgi -- and hits each with the same burst of
+concurrent reads: product detail (authenticated) and marketplace pages with
+varying filters so most requests miss the response cache. The sync run uses
+the DRF endpoints, the async run their /api/async/ twins. Needs a real,
+migrated database and uvicorn-worker; the rows it creates are removed
+afterwards.
+
+With ``--slow-path`` some extra clients keep calling a slow endpoint (e.g.
+the chatbot) for the whole burst, to show how much it starves the reads.
+
+    python benchmarks/async_reads.py --concurrency 200 --requests 4000 --workers 2
+"""
+import argparse
+import asyncio
+import os
+import random
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'KUKUCONNECT.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+import httpx  # noqa: E402
+from django.contrib.auth import get_user_model  # noqa: E402
+from rest_framework_simplejwt.tokens import AccessToken  # noqa: E402
+
+from products.models import Product  # noqa: E402
+
+MODES = {
+    'sync': (['KUKUCONNECT.wsgi'], '/api/'),
+    'async': (['-k', 'uvicorn_worker.UvicornWorker', 'KUKUCONNECT.asgi:application'], '/api/async/'),
+}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(mode, port, workers):
+    args, _ = MODES[mode]
+    command = [sys.executable, '-m', 'gunicorn', '--bind', f'127.0.0.1:{port}', '--workers', str(workers), '--log-level', 'warning', *args]
+    server = subprocess.Popen(command, cwd=BASE_DIR, env={**os.environ, 'BACKGROUND_WORKERS': '0'})
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.2):
+                return server
+        except OSError:
+            time.sleep(0.2)
+    server.kill()
+    raise RuntimeError(f'{mode} server did not start')
+
+
+async def burst(base_url, prefix, product_ids, token, args):
+    latencies, errors = [], 0
+    queue = asyncio.Queue()
+    for index in range(args.requests):
+        if index % 2:
+            queue.put_nowait((f'{prefix}products/{random.choice(product_ids)}/', {'Authorization': f'Bearer {token}'}))
+        else:
+            queue.put_nowait((f'{prefix}products/marketplace/?min_price={random.randint(0, 5000)}', {}))
+
+    # The app runs with production settings unless DEBUG is set, so look
+    # like a request that came through the TLS-terminating proxy.
+    headers = {'X-Forwarded-Proto': 'https'}
+    connections = args.concurrency + args.slow_clients
+    limits = httpx.Limits(max_connections=connections, max_keepalive_connections=connections)
+    async with httpx.AsyncClient(base_url=base_url, headers=headers, limits=limits, timeout=60) as client:
+        async def worker():
+            nonlocal errors
+            while not queue.empty():
+                path, extra = queue.get_nowait()
+                start = time.perf_counter()
+                try:
+                    response = await client.get(path, headers=extra)
+                    failed = response.status_code != 200
+                except httpx.HTTPError:
+                    failed = True
+                latencies.append(time.perf_counter() - start)
+                errors += failed
+
+        async def slow_client():
+            while not queue.empty():
+                try:
+                    await client.get(args.slow_path, headers={'Authorization': f'Bearer {token}'})
+                except httpx.HTTPError:
+                    await asyncio.sleep(0.1)
+
+        start = time.perf_counter()
+        slow = [asyncio.create_task(slow_client()) for _ in range(args.slow_clients if args.slow_path else 0)]
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+        wall = time.perf_counter() - start
+        for task in slow:
+            task.cancel()
+        await asyncio.gather(*slow, return_exceptions=True)
+
+    latencies.sort()
+    return {
+        'req/s': len(latencies) / wall,
+        'p50 ms': statistics.median(latencies) * 1000,
+        'p99 ms': latencies[int(len(latencies) * 0.99) - 1] * 1000,
+        'errors': errors,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--concurrency', type=int, default=200)
+    parser.add_argument('--requests', type=int, default=4000)
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn worker processes')
+    parser.add_argument('--products', type=int, default=500)
+    parser.add_argument('--slow-path', help='slow endpoint to keep busy during the burst')
+    parser.add_argument('--slow-clients', type=int, default=8)
+    args = parser.parse_args()
+
+    User = get_user_model()
+    farmer = User.objects.create_user(username='bench-async-farmer', email='bench-async-farmer@example.com', password=None)
+    buyer = User.objects.create_user(username='bench-async-buyer', email='bench-async-buyer@example.com', password=None)
+    try:
+        products = Product.objects.bulk_create(
+            Product(farmer=farmer, title=f'Bench flock {i}', description='Benchmark product', category='number', price=random.randint(100, 6000), stock=10)
+            for i in range(args.products)
+        )
+        product_ids = [product.id for product in products]
+        token = str(AccessToken.for_user(buyer))
+        for mode, (_, prefix) in MODES.items():
+            port = free_port()
+            server = start_server(mode, port, args.workers)
+            try:
+                result = asyncio.run(burst(f'http://127.0.0.1:{port}', prefix, product_ids, token, args))
+            finally:
+                server.send_signal(signal.SIGTERM)
+                server.wait(timeout=30)
+            print(f'{mode:>5}: ' + ', '.join(
+                f'{key} {value:.1f}' if isinstance(value, float) else f'{key} {value}'
+                for key, value in result.items()
+            ))
+    finally:
+        buyer.delete()
+        farmer.delete()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,172 @@
+"""
+Compare STK push throughput with and without connection pooling.
+
+Starts a local HTTPS stub of the Daraja API (self-signed certificate,
+optional artificial latency) and sends the same burst of STK pushes twice:
+once the way the client used to, with a module-level ``requests.post`` and
+so a new TCP+TLS connection per call, then through ``MpesaClient``'s pooled
+keep-alive session. Needs a migrated database for the access token row.
+
+    python benchmarks/mpesa_transport.py --requests 1000 --concurrency 16 --latency 20
+"""
+import argparse
+import ipaddress
+import json
+import os
+import ssl
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'KUKUCONNECT.settings')
+for key, value in {
+    'MPESA_ENVIRONMENT': 'sandbox',
+    'MPESA_CONSUMER_KEY': 'stub-key',
+    'MPESA_CONSUMER_SECRET': 'stub-secret',
+    'MPESA_EXPRESS_SHORTCODE': '174379',
+    'MPESA_PASSKEY': 'stub-passkey',
+}.items():
+    os.environ.setdefault(key, value)
+
+
+def self_signed_certificate(directory):
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, '127.0.0.1')])
+    now = datetime.utcnow()
+    certificate = (
+        x509.CertificateBuilder()
+        .subject_name(name).issuer_name(name).public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - timedelta(minutes=1)).not_valid_after(now + timedelta(days=1))
+        .add_extension(x509.SubjectAlternativeName([x509.IPAddress(ipaddress.ip_address('127.0.0.1'))]), critical=False)
+        .sign(key, hashes.SHA256())
+    )
+    cert_path, key_path = os.path.join(directory, 'stub.pem'), os.path.join(directory, 'stub.key')
+    with open(cert_path, 'wb') as handle:
+        handle.write(certificate.public_bytes(serialization.Encoding.PEM))
+    with open(key_path, 'wb') as handle:
+        handle.write(key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()))
+    return cert_path, key_path
+
+
+class StubDaraja(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    latency = 0
+
+    def reply(self, payload):
+        time.sleep(self.latency)
+        body = json.dumps(payload).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self.reply({'access_token': 'stub-token', 'expires_in': '3599'})
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.reply({
+            'MerchantRequestID': 'stub-merchant', 'CheckoutRequestID': 'ws_CO_stub',
+            'ResponseCode': '0', 'ResponseDescription': 'Success. Request accepted for processing',
+            'CustomerMessage': 'Success. Request accepted for processing',
+        })
+
+    def log_message(self, *args):
+        pass
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+
+def start_stub(cert_path, key_path, latency):
+    StubDaraja.latency = latency
+    server = StubServer(('127.0.0.1', 0), StubDaraja)
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(cert_path, key_path)
+    # Handshake in the handler threads, not the accepting one.
+    server.socket = context.wrap_socket(server.socket, server_side=True, do_handshake_on_connect=False)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def burst(call, args):
+    latencies = []
+
+    def timed(_):
+        start = time.perf_counter()
+        call()
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(timed, range(args.requests)))
+    wall = time.perf_counter() - start
+    latencies.sort()
+    return {
+        'req/s': len(latencies) / wall,
+        'p50 ms': statistics.median(latencies) * 1000,
+        'p99 ms': latencies[int(len(latencies) * 0.99) - 1] * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--latency', type=float, default=20, help='stub response delay in ms')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        cert_path, key_path = self_signed_certificate(directory)
+        server = start_stub(cert_path, key_path, args.latency / 1000)
+        base_url = f'https://127.0.0.1:{server.server_address[1]}/'
+        os.environ['MPESA_API_BASE_URL'] = base_url
+        os.environ['REQUESTS_CA_BUNDLE'] = cert_path
+        os.environ.setdefault('MPESA_POOL_SIZE', str(args.concurrency))
+
+        import django
+        django.setup()
+        import requests
+        from payments.models import AccessToken
+        from payments.mpesa.core import MpesaClient
+        from payments.mpesa.utils import mpesa_access_token
+
+        client = MpesaClient()
+        token = mpesa_access_token()
+        url = base_url + 'mpesa/stkpush/v1/processrequest'
+
+        def per_call():
+            # What stk_push did before: no session, no timeouts.
+            requests.post(url, json={'Amount': 1}, headers={'Authorization': 'Bearer ' + token})
+
+        def pooled():
+            client.stk_push('0712345678', 1, 'BENCH', 'Benchmark', 'https://example.com/callback')
+
+        try:
+            for mode, call in (('per-call', per_call), ('pooled', pooled)):
+                result = burst(call, args)
+                print(f'{mode:>8}: ' + ', '.join(f'{key} {value:.1f}' for key, value in result.items()))
+        finally:
+            server.shutdown()
+            # Don't leave the stub's token for the app to adopt.
+            AccessToken.objects.filter(token='stub-token').delete()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""
+Time /api/products/search/ with and without the candidate cap.
+
+Inserts a temporary catalog (rolled back afterwards) in which one term
+matches every product and another only a handful, then requests the first
+page of each ``--repeat`` times, once ranking every match and once with
+SEARCH_CANDIDATE_LIMIT, and reports p50/p99 latency.
+
+    python benchmarks/product_search.py --rows 300000
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'KUKUCONNECT.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.conf import settings  # noqa: E402
+from django.contrib.auth import get_user_model  # noqa: E402
+from django.db import connection, transaction  # noqa: E402
+from django.test import override_settings  # noqa: E402
+from rest_framework.test import APIClient  # noqa: E402
+
+from products.models import Product  # noqa: E402
+
+
+class Rollback(Exception):
+    pass
+
+
+def latencies(client, term, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        response = client.get('/api/products/search/', {'q': term})
+        timings.append(time.perf_counter() - start)
+        assert response.status_code == 200, response.content
+    timings.sort()
+    return statistics.median(timings), timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--rows', type=int, default=300000)
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    client = APIClient()
+    results = []
+    try:
+        with transaction.atomic():
+            farmer = get_user_model().objects.create_user(username='bench-farmer', email='bench@example.com', password=None)
+            batch = 10000
+            for start in range(0, args.rows, batch):
+                Product.objects.bulk_create(
+                    Product(
+                        farmer=farmer, title=f'Broilers batch {i}' if i % 5000 else f'Kienyeji broilers {i}',
+                        description='Six week old broilers, vaccinated.', category='number',
+                        price=450 + i % 100, stock=i % 40,
+                    )
+                    for i in range(start, min(start + batch, args.rows))
+                )
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE products_product')
+            with override_settings(ALLOWED_HOSTS=['testserver']):
+                for label, limit in (('all matches', args.rows), (f'capped at {settings.SEARCH_CANDIDATE_LIMIT}', settings.SEARCH_CANDIDATE_LIMIT)):
+                    with override_settings(SEARCH_CANDIDATE_LIMIT=limit):
+                        for term in ('broilers', 'kienyeji'):
+                            results.append((label, term, *latencies(client, term, args.repeat)))
+            raise Rollback
+    except Rollback:
+        pass
+
+    print(f'products: {args.rows}')
+    for label, term, p50, p99 in results:
+        print(f'{label:>16}  q={term:<9}  p50 {p50 * 1000:7.1f} ms  p99 {p99 * 1000:7.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
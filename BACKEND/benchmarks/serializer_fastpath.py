@@ -0,0 +1,81 @@
+"""
+Compare ProductSerializer with the ProductRowSerializer fast path.
+
+Inserts a temporary catalog (rolled back afterwards), then times fetching
+and rendering one response of ``--rows`` products both ways and checks the
+two JSON bodies are byte-identical.
+
+    python benchmarks/serializer_fastpath.py --rows 10000
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'KUKUCONNECT.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.contrib.auth import get_user_model  # noqa: E402
+from django.db import transaction  # noqa: E402
+from rest_framework.renderers import JSONRenderer  # noqa: E402
+
+from products.models import Product  # noqa: E402
+from products.serializers import ProductSerializer, ProductRowSerializer  # noqa: E402
+
+
+class Rollback(Exception):
+    pass
+
+
+def best_of(repeat, func):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        body = func()
+        timings.append(time.perf_counter() - start)
+    return min(timings), body
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    renderer = JSONRenderer()
+    try:
+        with transaction.atomic():
+            farmers = [
+                get_user_model().objects.create_user(username=f'bench-farmer-{i}', email=f'bench{i}@example.com', password=None)
+                for i in range(50)
+            ]
+            Product.objects.bulk_create(
+                Product(
+                    farmer=farmers[i % len(farmers)], title=f'Broilers batch {i}',
+                    description='Six week old broilers, vaccinated.', category='number',
+                    price=450 + i % 100, stock=i % 40,
+                )
+                for i in range(args.rows)
+            )
+            queryset = Product.objects.filter(farmer__in=farmers).order_by('-created_at', '-id')
+
+            slow_time, slow_body = best_of(args.repeat, lambda: renderer.render(
+                ProductSerializer(queryset.select_related('farmer'), many=True).data))
+            fast_time, fast_body = best_of(args.repeat, lambda: renderer.render(
+                ProductRowSerializer(ProductRowSerializer.rows(queryset), many=True).data))
+            raise Rollback
+    except Rollback:
+        pass
+
+    print(f'rows per response:   {args.rows}')
+    print(f'ProductSerializer:    {slow_time * 1000:8.1f} ms')
+    print(f'ProductRowSerializer: {fast_time * 1000:8.1f} ms  ({slow_time / fast_time:.1f}x faster)')
+    print(f'byte-identical:       {slow_body == fast_body}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+"""
+Hammer one hot product with concurrent orders.
+
+Runs the same burst twice through ``place_order``, which does all the
+order's other work (items, rollups, popularity, trending) both times; only
+the stock step differs: the conditional, batched decrements of
+``reserve_stock``, or a SELECT ... FOR UPDATE read-check-write of the same
+rows. Reports throughput, latency and whether stock was oversold. Needs a
+real, migrated database; the rows it creates are removed afterwards.
+
+    python benchmarks/stock_contention.py --threads 32 --orders 50 --stock 1000
+"""
+import argparse
+import os
+import statistics
+import sys
+import threading
+import time
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'KUKUCONNECT.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.contrib.auth import get_user_model  # noqa: E402
+from django.db import connection  # noqa: E402
+
+from products import services  # noqa: E402
+from products.models import Order, Product  # noqa: E402
+from products.reservations import InsufficientStock, reserve_stock  # noqa: E402
+
+
+def locking_reserve_stock(quantities):
+    """
+    Drop-in for ``reserve_stock`` that locks and re-reads the rows first.
+    """
+    products = Product.objects.select_for_update().filter(pk__in=quantities).order_by('pk').in_bulk()
+    short = [product_id for product_id, quantity in quantities.items() if products[product_id].stock < quantity]
+    if short:
+        raise InsufficientStock(sorted(short))
+    for product_id, quantity in sorted(quantities.items()):
+        product = products[product_id]
+        product.stock -= quantity
+        product.save(update_fields=['stock', 'updated_at'])
+
+
+def order_one(buyer, product):
+    services.place_order(buyer, [{'product': product, 'quantity': 1}])
+
+
+def run(strategy, buyer, farmer, args):
+    product = Product.objects.create(
+        farmer=farmer, title='Hot flock', description='Benchmark product',
+        category='number', price=500, stock=args.stock,
+    )
+    latencies, sold, refused = [], [0], [0]
+    lock = threading.Lock()
+    barrier = threading.Barrier(args.threads)
+
+    def worker():
+        barrier.wait()
+        for _ in range(args.orders):
+            start = time.perf_counter()
+            try:
+                strategy(buyer, product)
+                outcome = sold
+            except InsufficientStock:
+                outcome = refused
+            elapsed = time.perf_counter() - start
+            with lock:
+                outcome[0] += 1
+                latencies.append(elapsed)
+        connection.close()
+
+    threads = [threading.Thread(target=worker) for _ in range(args.threads)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - start
+
+    product.refresh_from_db()
+    latencies.sort()
+    result = {
+        'orders/s': len(latencies) / wall,
+        'p50 ms': statistics.median(latencies) * 1000,
+        'p99 ms': latencies[int(len(latencies) * 0.99) - 1] * 1000,
+        'sold': sold[0],
+        'refused': refused[0],
+        'oversold': sold[0] > args.stock or product.stock != args.stock - sold[0],
+    }
+    Order.objects.filter(buyer=buyer).delete()
+    product.delete()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--orders', type=int, default=50, help='orders per thread')
+    parser.add_argument('--stock', type=int, default=1000)
+    args = parser.parse_args()
+
+    User = get_user_model()
+    farmer = User.objects.create_user(username='bench-hot-farmer', email='bench-hot-farmer@example.com', password=None)
+    buyer = User.objects.create_user(username='bench-hot-buyer', email='bench-hot-buyer@example.com', password=None)
+    try:
+        for name, reserve in [('conditional UPDATE', reserve_stock), ('SELECT FOR UPDATE', locking_reserve_stock)]:
+            with mock.patch.object(services, 'reserve_stock', reserve):
+                result = run(order_one, buyer, farmer, args)
+            print(f'{name:>18}: ' + ', '.join(
+                f'{key} {value:.1f}' if isinstance(value, float) else f'{key} {value}'
+                for key, value in result.items()
+            ))
+    finally:
+        buyer.delete()
+        farmer.delete()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,29 @@
+import pytest
+from django.core.cache import cache
+
+from products.cache import forget_catalog_version
+from products.recommendations import forget_index
+
+
+@pytest.fixture(autouse=True)
+def inline_background_tasks(settings):
+    # Run background pool tasks in the submitting thread, so tests see their
+    # effects deterministically and they share the test transaction.
+    settings.BACKGROUND_WORKERS = 0
+    settings.STK_PUSH_WORKERS = 0
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    # The test database is rolled back between tests but the local-memory
+    # cache is not, so cached marketplace pages would leak across tests.
+    # The catalog version lives in the database and rolls back with it;
+    # only this process' copy of it needs dropping, as does the loaded
+    # recommendation index.
+    cache.clear()
+    forget_catalog_version()
+    forget_index()
+    yield
+    cache.clear()
+    forget_catalog_version()
+    forget_index()
@@ -0,0 +1,7 @@
+from django.urls import path
+
+from .async_views import payment_detail
+
+urlpatterns = [
+    path('<int:pk>/', payment_detail, name='async-payment-detail'),
+]
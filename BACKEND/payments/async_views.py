@@ -0,0 +1,38 @@
+"""
+Long-polling payment status for the async deployment; see
+KUKUCONNECT/async_api.py.
+"""
+
+import asyncio
+
+from rest_framework import serializers
+
+from KUKUCONNECT.async_api import async_endpoint, idle
+from .models import Payment
+from .views import PaymentDetailView
+
+MAX_WAIT = 25
+POLL_INTERVAL = 0.5
+
+
+class WaitSerializer(serializers.Serializer):
+	wait = serializers.FloatField(min_value=0, max_value=MAX_WAIT, default=0)
+
+
+@async_endpoint(PaymentDetailView)
+async def payment_detail(view, request, pk):
+	"""
+	The payment, like PaymentDetailView. With ``?wait=<seconds>`` (at most 25)
+	the response is held until the payment stops being pending or the time
+	is up, checking every half second without holding a database slot.
+	"""
+
+	params = WaitSerializer(data=request.query_params)
+	params.is_valid(raise_exception=True)
+	queryset = view.get_queryset()
+	payment = await queryset.aget(pk=pk)
+	deadline = asyncio.get_running_loop().time() + params.validated_data['wait']
+	while payment.status in Payment.PENDING and asyncio.get_running_loop().time() < deadline:
+		await idle(POLL_INTERVAL)
+		payment = await queryset.aget(pk=pk)
+	return view.get_serializer(payment).data
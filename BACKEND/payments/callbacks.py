@@ -0,0 +1,162 @@
+"""
+STK push callback processing
+
+The receiver view appends each callback to StkCallback untouched and
+answers at once, so a month-end burst costs one INSERT per callback and
+Safaricom never times out and retries. Parsing and settling happen here, in
+batches: rows are claimed with SELECT ... FOR UPDATE SKIP LOCKED, so any
+number of processes can drain the table side by side, and each batch
+settles its payments with one UPDATE keyed by CheckoutRequestID.
+
+Settling is idempotent: only pending payments change, so a callback Daraja
+delivers twice (or a payment the reconciliation already settled) is a no-op.
+A success whose Amount differs from the payment's is not applied; the
+payment stays pending and the reconciliation reports it for review.
+"""
+
+import logging
+import threading
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from KUKUCONNECT.workers import default_pool
+from products.models import Order
+from products.reservations import commit_order_reservations
+from .models import Payment, StkCallback
+from .mpesa.core import MpesaClient
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 500
+_scheduled = threading.Event()
+
+
+def parse_callback(callback):
+	"""
+	Parse a stored callback and record its ids and result on it
+
+	Returns:
+		dict: The parsed result, or None when the payload is malformed
+	"""
+
+	try:
+		data = MpesaClient.parse_stk_result(callback.payload)
+		callback.merchant_request_id = str(data['MerchantRequestID'])[:64]
+		callback.checkout_request_id = str(data['CheckoutRequestID'])[:64]
+		callback.result_code = int(data['ResultCode'])
+		if data.get('Amount') is not None:
+			callback.amount = int(float(data['Amount']))
+		callback.mpesa_receipt_number = str(data.get('MpesaReceiptNumber') or '')[:32]
+	except (ValueError, KeyError, TypeError, AttributeError):
+		callback.error = 'Malformed payload'
+		return None
+	return data
+
+
+def settle_payments(results):
+	"""
+	Apply parsed STK results to their pending payments and mark the orders of
+	successful ones paid. Successes carrying an Amount other than the
+	payment's are skipped.
+
+	Arguments:
+		results (list) -- Parsed results, at most one per CheckoutRequestID
+
+	Returns:
+		int: The number of payments settled
+	"""
+
+	if not results:
+		return 0
+	rows = []
+	for data in results:
+		paid = int(data['ResultCode']) == 0
+		rows.append((
+			str(data['CheckoutRequestID']),
+			Payment.PAID if paid else Payment.FAILED,
+			int(data['ResultCode']),
+			str(data.get('ResultDesc', ''))[:255],
+			str(data.get('MpesaReceiptNumber') or '')[:32],
+			int(float(data['Amount'])) if data.get('Amount') is not None else None,
+		))
+	table = connection.ops.quote_name(Payment._meta.db_table)
+	placeholders = ', '.join(['(%s, %s, %s::integer, %s, %s, %s::integer)'] * len(rows))
+	pending = ', '.join(['%s'] * len(Payment.PENDING))
+	sql = f"""
+		UPDATE {table} AS p SET
+			status = v.status,
+			result_code = v.result_code,
+			result_desc = v.result_desc,
+			mpesa_receipt_number = v.receipt,
+			updated_at = %s
+		FROM (VALUES {placeholders}) AS v(checkout_request_id, status, result_code, result_desc, receipt, amount)
+		WHERE p.checkout_request_id = v.checkout_request_id AND p.status IN ({pending})
+			AND (v.status <> %s OR v.amount IS NULL OR v.amount = p.amount)
+		RETURNING p.order_id, p.status
+	"""
+	now = timezone.now()
+	with connection.cursor() as cursor:
+		cursor.execute(sql, [now, *[value for row in rows for value in row], *Payment.PENDING, Payment.PAID])
+		settled = cursor.fetchall()
+
+	paid_orders = [order_id for order_id, status in settled if status == Payment.PAID]
+	if paid_orders:
+		Order.objects.filter(pk__in=paid_orders, paid_at__isnull=True).update(paid_at=now)
+		commit_order_reservations(paid_orders)
+	return len(settled)
+
+
+def process_stk_callbacks(batch_size=DEFAULT_BATCH_SIZE):
+	"""
+	Parse and settle every unprocessed callback, batch_size at a time
+
+	Returns:
+		int: The number of callbacks processed
+	"""
+
+	processed = 0
+	while True:
+		with transaction.atomic():
+			callbacks = list(
+				StkCallback.objects.select_for_update(skip_locked=True)
+				.filter(processed_at__isnull=True).order_by('id')[:batch_size]
+			)
+			if not callbacks:
+				return processed
+			results = {}
+			for callback in callbacks:
+				data = parse_callback(callback)
+				if data is not None:
+					# Daraja's retries repeat the same result; settle it once.
+					results.setdefault(callback.checkout_request_id, data)
+			settle_payments(list(results.values()))
+			now = timezone.now()
+			for callback in callbacks:
+				callback.processed_at = now
+			StkCallback.objects.bulk_update(
+				callbacks,
+				['processed_at', 'merchant_request_id', 'checkout_request_id', 'result_code', 'amount', 'mpesa_receipt_number', 'error'],
+			)
+		processed += len(callbacks)
+
+
+def drain_callbacks():
+	# Cleared first, so callbacks stored while this runs schedule another run.
+	_scheduled.clear()
+	process_stk_callbacks()
+
+
+def schedule_processing():
+	"""
+	Have the background pool process stored callbacks, unless a run is
+	already queued in this process. With the pool's queue full the callbacks
+	wait for the next run or the process_stk_callbacks command.
+	"""
+
+	if _scheduled.is_set():
+		return
+	_scheduled.set()
+	if default_pool.try_submit(drain_callbacks) is None:
+		_scheduled.clear()
+		logger.warning('Background queue full, STK callbacks left for process_stk_callbacks')
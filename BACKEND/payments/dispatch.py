@@ -0,0 +1,176 @@
+"""
+Asynchronous STK push dispatch
+
+Checkout only records a QUEUED payment; the call to Daraja happens in the
+STK push pool once the transaction commits, so a web worker is never held
+for Safaricom's round trip. When the pool's queue is full the payment simply
+stays QUEUED and the dispatch_payments command sends it later, rather than
+the request thread making the call itself. The same command fails payments
+a dispatcher left SENDING when it died mid-call.
+"""
+
+import logging
+import math
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from KUKUCONNECT.workers import BackgroundPool
+from products.models import Order
+from products.reservations import renew_order_reservations
+from .models import Payment
+from .mpesa.core import MpesaClient
+from .mpesa.exceptions import MpesaConfigurationException, MpesaConnectionError, MpesaError, MpesaInvalidParameterException, IllegalPhoneNumberException
+from .mpesa.utils import mpesa_config
+
+logger = logging.getLogger(__name__)
+
+stk_push_pool = BackgroundPool('stk-push', 'STK_PUSH_WORKERS', 'STK_PUSH_QUEUE_SIZE')
+client = MpesaClient()
+
+ACCOUNT_REFERENCE = 'ORDER{}'
+TRANSACTION_DESC = 'KukuConnect'
+
+
+class CheckoutRefused(Exception):
+	"""
+	Raised when an order cannot be paid for (again).
+	"""
+
+
+def start_checkout(buyer, order, phone_number):
+	"""
+	Queue an STK push for the order, unless one is already under way
+
+	Arguments:
+		buyer (User) -- The paying buyer
+		order (Order) -- The order to pay for
+		phone_number (str) -- The phone number, as 2547XXXXXXXX
+
+	Returns:
+		tuple: (Payment, bool created)
+
+	Raises:
+		CheckoutRefused: The order is already paid, or its stock is no longer held
+	"""
+
+	with transaction.atomic():
+		# Serializes concurrent checkouts of the same order.
+		locked = Order.objects.select_for_update().only('pk', 'paid_at').get(pk=order.pk)
+		payment = order.payments.filter(status__in=Payment.PENDING).first()
+		if payment is not None:
+			return payment, False
+		if locked.paid_at is not None or order.payments.filter(status=Payment.PAID).exists():
+			raise CheckoutRefused('This order has already been paid for.')
+		if not renew_order_reservations(order.pk):
+			raise CheckoutRefused('The stock held for this order has been released, please order again.')
+		payment = Payment.objects.create(
+			order=order,
+			buyer=buyer,
+			phone_number=phone_number,
+			amount=math.ceil(order.total_price),
+		)
+		transaction.on_commit(lambda: enqueue(payment.pk))
+	return payment, True
+
+
+def enqueue(payment_id):
+	if stk_push_pool.try_submit(send_stk_push, payment_id) is None:
+		logger.warning('STK push queue full, payment %s left for dispatch_payments', payment_id)
+
+
+def fail(payment_id, description):
+	Payment.objects.filter(pk=payment_id).update(
+		status=Payment.FAILED, result_desc=description[:255], updated_at=timezone.now(),
+	)
+
+
+def send_stk_push(payment_id):
+	"""
+	Send a queued payment's STK push and record Daraja's answer. Payments
+	another dispatcher already claimed are left alone.
+
+	Arguments:
+		payment_id (int) -- The payment to send
+	"""
+
+	claimed = Payment.objects.filter(pk=payment_id, status=Payment.QUEUED).update(
+		status=Payment.SENDING, updated_at=timezone.now(),
+	)
+	if not claimed:
+		return
+	payment = Payment.objects.get(pk=payment_id)
+
+	try:
+		r = client.stk_push(
+			payment.phone_number,
+			payment.amount,
+			ACCOUNT_REFERENCE.format(payment.order_id),
+			TRANSACTION_DESC,
+			mpesa_config('MPESA_CALLBACK_URL'),
+		)
+	except MpesaConnectionError as ex:
+		logger.warning('STK push for payment %s failed: %s', payment_id, ex)
+		fail(payment_id, 'Could not reach M-Pesa, please try again')
+		return
+	except (MpesaError, MpesaConfigurationException, MpesaInvalidParameterException, IllegalPhoneNumberException) as ex:
+		logger.error('STK push for payment %s rejected: %s', payment_id, ex)
+		fail(payment_id, str(ex))
+		return
+
+	if r.response_code == '0':
+		Payment.objects.filter(pk=payment_id, status=Payment.SENDING).update(
+			status=Payment.SENT,
+			merchant_request_id=r.merchant_request_id,
+			checkout_request_id=r.checkout_request_id,
+			result_desc=r.customer_message or r.response_description,
+			updated_at=timezone.now(),
+		)
+	else:
+		fail(payment_id, r.error_message or r.response_description or 'STK push rejected')
+
+
+def fail_interrupted_payments(older_than=None):
+	"""
+	Fail payments left SENDING, by a dispatcher that crashed or was killed
+	mid-call. Whether Daraja prompted the customer is unknown, so they are
+	not sent again; the buyer can check out afresh, and a result that does
+	arrive for one is reported by the reconciliation as unmatched.
+
+	Arguments:
+		older_than (timedelta) -- Claimed at least this long ago, STK_PUSH_SENDING_TIMEOUT seconds by default
+
+	Returns:
+		int: The number of payments failed
+	"""
+
+	if older_than is None:
+		older_than = timedelta(seconds=settings.STK_PUSH_SENDING_TIMEOUT)
+	return Payment.objects.filter(status=Payment.SENDING, updated_at__lt=timezone.now() - older_than).update(
+		status=Payment.FAILED, result_desc='Interrupted, please try again', updated_at=timezone.now(),
+	)
+
+
+def dispatch_queued_payments(older_than=timedelta(seconds=30), limit=1000):
+	"""
+	Send payments that stayed QUEUED, because the pool's queue was full or the
+	process stopped before sending them
+
+	Arguments:
+		older_than (timedelta) -- Skip payments younger than this, which are likely still in a queue
+		limit (int) -- The most payments to send
+
+	Returns:
+		int: The number of payments handed to the pool
+	"""
+
+	payment_ids = list(
+		Payment.objects.filter(status=Payment.QUEUED, created_at__lt=timezone.now() - older_than)
+		.order_by('created_at').values_list('pk', flat=True)[:limit]
+	)
+	futures = [stk_push_pool.submit(send_stk_push, payment_id) for payment_id in payment_ids]
+	for future in futures:
+		future.exception()
+	return len(payment_ids)
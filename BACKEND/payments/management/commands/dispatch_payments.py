@@ -0,0 +1,20 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from payments.dispatch import dispatch_queued_payments, fail_interrupted_payments
+
+
+class Command(BaseCommand):
+    help = "Send STK pushes for payments left queued, e.g. because the dispatch queue was full, and fail those whose dispatcher died mid-send."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than', type=int, default=30, help='Only payments queued at least this many seconds ago.')
+        parser.add_argument('--limit', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        failed = fail_interrupted_payments()
+        if failed:
+            self.stdout.write(self.style.WARNING(f"Failed {failed} payment(s) interrupted while sending."))
+        sent = dispatch_queued_payments(older_than=timedelta(seconds=options['older_than']), limit=options['limit'])
+        self.stdout.write(self.style.SUCCESS(f"Dispatched {sent} queued payment(s)."))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from payments.callbacks import DEFAULT_BATCH_SIZE, process_stk_callbacks
+
+
+class Command(BaseCommand):
+    help = "Parse stored STK push callbacks and settle their payments."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        processed = process_stk_callbacks(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Processed {processed} callback(s)."))
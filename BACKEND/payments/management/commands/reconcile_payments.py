@@ -0,0 +1,38 @@
+import json
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from payments.reconciliation import DEFAULT_BATCH_SIZE, reconcile
+
+
+class Command(BaseCommand):
+    help = "Match stored STK results against payments and orders, and query Daraja for payments stuck pending."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since-hours', type=float, default=48, help="Match callbacks received in the last N hours.")
+        parser.add_argument('--deadline-minutes', type=float, default=5, help="Query payments still pending after N minutes.")
+        parser.add_argument('--concurrency', type=int, default=8, help="Daraja queries in flight at once.")
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+        parser.add_argument('--report', help="Write each mismatch to this file as a line of JSON.")
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        report = reconcile(
+            since=now - timedelta(hours=options['since_hours']),
+            deadline=now - timedelta(minutes=options['deadline_minutes']),
+            concurrency=options['concurrency'],
+            batch_size=options['batch_size'],
+        )
+        if options['report']:
+            with open(options['report'], 'w') as f:
+                for mismatch in report['mismatches']:
+                    f.write(json.dumps(mismatch) + '\n')
+        for mismatch in report['mismatches']:
+            self.stderr.write(f"{mismatch['kind']}: {mismatch['checkout_request_id']} payment={mismatch['payment']} order={mismatch['order']} {mismatch['detail']}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Checked {report['callbacks']} callback(s) and queried {report['queried']} payment(s): "
+            f"settled {report['settled']}, repaired {report['orders_repaired']} order(s), "
+            f"{report['still_pending']} still pending, {len(report['mismatches'])} mismatch(es)."
+        ))
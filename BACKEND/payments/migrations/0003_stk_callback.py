@@ -0,0 +1,34 @@
+# Generated by Django 5.2.7 on 2026-10-18 15:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0002_payment'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='payment',
+            name='mpesa_receipt_number',
+            field=models.CharField(blank=True, default='', max_length=32),
+        ),
+        migrations.CreateModel(
+            name='StkCallback',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('payload', models.TextField()),
+                ('received_at', models.DateTimeField(auto_now_add=True)),
+                ('processed_at', models.DateTimeField(blank=True, null=True)),
+                ('merchant_request_id', models.CharField(blank=True, default='', max_length=64)),
+                ('checkout_request_id', models.CharField(blank=True, default='', max_length=64)),
+                ('result_code', models.IntegerField(blank=True, null=True)),
+                ('error', models.CharField(blank=True, default='', max_length=255)),
+            ],
+            options={
+                'indexes': [models.Index(condition=models.Q(('processed_at__isnull', True)), fields=['id'], name='stkcallback_unprocessed_idx'), models.Index(fields=['checkout_request_id'], name='stkcallback_checkout_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.7 on 2026-10-18 16:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0003_stk_callback'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stkcallback',
+            name='amount',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='stkcallback',
+            name='mpesa_receipt_number',
+            field=models.CharField(blank=True, default='', max_length=32),
+        ),
+        migrations.AddIndex(
+            model_name='stkcallback',
+            index=models.Index(fields=['received_at'], name='stkcallback_received_idx'),
+        ),
+    ]
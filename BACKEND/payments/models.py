@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
+from django.conf import settings
 from django.db import models
 
 
@@ -12,4 +13,78 @@ class AccessToken(models.Model):
 		get_latest_by = 'created_at'
 
 	def __str__(self):
-		return self.token
\ No newline at end of file
+		return self.token
+
+class Payment(models.Model):
+	"""
+	An M-Pesa Express (STK push) payment for an order.
+
+	Created as QUEUED by the checkout API and sent to Daraja from a background
+	pool (see dispatch.py); SENDING marks the one dispatcher that claimed it.
+	"""
+	QUEUED = 'queued'
+	SENDING = 'sending'
+	SENT = 'sent'
+	PAID = 'paid'
+	FAILED = 'failed'
+	STATUS_CHOICES = [
+		(QUEUED, 'Queued'),
+		(SENDING, 'Sending'),
+		(SENT, 'Awaiting customer'),
+		(PAID, 'Paid'),
+		(FAILED, 'Failed'),
+	]
+	# Statuses that may still change without the customer starting over.
+	PENDING = (QUEUED, SENDING, SENT)
+
+	order = models.ForeignKey('products.Order', on_delete=models.CASCADE, related_name='payments')
+	buyer = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='payments')
+	phone_number = models.CharField(max_length=12)
+	amount = models.PositiveIntegerField()
+	status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+	merchant_request_id = models.CharField(max_length=64, blank=True, default='')
+	checkout_request_id = models.CharField(max_length=64, null=True, blank=True, unique=True)
+	result_code = models.IntegerField(null=True, blank=True)
+	result_desc = models.CharField(max_length=255, blank=True, default='')
+	mpesa_receipt_number = models.CharField(max_length=32, blank=True, default='')
+	created_at = models.DateTimeField(auto_now_add=True)
+	updated_at = models.DateTimeField(auto_now=True)
+
+	class Meta:
+		indexes = [
+			# Dispatch and reconciliation sweeps over pending payments.
+			models.Index(fields=['status', 'created_at'], name='payment_status_created_idx'),
+		]
+
+	def __str__(self):
+		return f'Payment {self.id} for order {self.order_id} ({self.status})'
+
+
+class StkCallback(models.Model):
+	"""
+	An STK push result as Daraja posted it.
+
+	The receiver only stores the raw payload; callbacks.py parses batches of
+	unprocessed rows later and fills in the request ids and result.
+	"""
+	payload = models.TextField()
+	received_at = models.DateTimeField(auto_now_add=True)
+	processed_at = models.DateTimeField(null=True, blank=True)
+	merchant_request_id = models.CharField(max_length=64, blank=True, default='')
+	checkout_request_id = models.CharField(max_length=64, blank=True, default='')
+	result_code = models.IntegerField(null=True, blank=True)
+	amount = models.IntegerField(null=True, blank=True)
+	mpesa_receipt_number = models.CharField(max_length=32, blank=True, default='')
+	error = models.CharField(max_length=255, blank=True, default='')
+
+	class Meta:
+		indexes = [
+			# The processing queue: small, as rows leave it once processed.
+			models.Index(fields=['id'], condition=models.Q(processed_at__isnull=True), name='stkcallback_unprocessed_idx'),
+			models.Index(fields=['checkout_request_id'], name='stkcallback_checkout_idx'),
+			# Where a reconciliation window starts.
+			models.Index(fields=['received_at'], name='stkcallback_received_idx'),
+		]
+
+	def __str__(self):
+		return f'STK callback {self.id} ({self.checkout_request_id or "unparsed"})'
@@ -3,8 +3,10 @@ from requests.auth import HTTPDigestAuth
 import base64
 from datetime import datetime
 import json
+from django.conf import settings
+from django.utils.functional import cached_property
 from .exceptions import MpesaInvalidParameterException, MpesaConnectionError
-from .utils import encrypt_security_credential, mpesa_access_token, format_phone_number, api_base_url, mpesa_config, mpesa_response
+from .utils import encrypt_security_credential, mpesa_access_token, format_phone_number, api_base_url, mpesa_config, mpesa_response, http_session
 from decouple import config
 
 class MpesaClient:
@@ -16,11 +18,56 @@ class MpesaClient:
 
 	auth_token = ''
 
-	def __init__(self):
+	def __init__(self, pool_size=None, connect_timeout=None, read_timeout=None, retries=None):
 		"""
 		The constructor for MpesaClient class
+
+		Each client keeps a pool of connections to Daraja alive, so requests
+		after the first skip the TCP and TLS handshakes. Share one client
+		rather than creating one per request.
+
+		Args:
+			pool_size (int) -- (Optional) Connections kept open, MPESA_POOL_SIZE by default
+			connect_timeout (float) -- (Optional) Seconds to connect, MPESA_CONNECT_TIMEOUT by default
+			read_timeout (float) -- (Optional) Seconds to wait for a response, MPESA_READ_TIMEOUT by default
+			retries (int) -- (Optional) Retries with backoff, MPESA_RETRIES by default. Requests
+				that are not idempotent (such as STK push) are only retried when the connection failed.
 		"""
 
+		self.session = http_session(pool_size, retries)
+		self.timeout = (
+			connect_timeout or settings.MPESA_CONNECT_TIMEOUT,
+			read_timeout or settings.MPESA_READ_TIMEOUT,
+		)
+
+	# Configuration is resolved once per client, on first use rather than in
+	# the constructor, so importing a module that creates a client does not
+	# fail where M-Pesa is not configured.
+
+	@cached_property
+	def base_url(self):
+		return api_base_url()
+
+	@cached_property
+	def passkey(self):
+		return mpesa_config('MPESA_PASSKEY')
+
+	@cached_property
+	def business_short_code(self):
+		if mpesa_config('MPESA_ENVIRONMENT') == 'sandbox':
+			return mpesa_config('MPESA_EXPRESS_SHORTCODE')
+		return mpesa_config('MPESA_SHORTCODE')
+
+	def stk_password(self):
+		"""
+		Returns:
+			tuple: The timestamp and password for a Lipa na MPESA Online request
+		"""
+
+		timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
+		password = base64.b64encode((self.business_short_code + self.passkey + timestamp).encode('ascii')).decode('utf-8')
+		return timestamp, password
+
 	def access_token(self):
 		"""
 		Generate an OAuth access token.
@@ -31,7 +78,8 @@ class MpesaClient:
 		
 		return mpesa_access_token()
 
-	def parse_stk_result(self, result):
+	@staticmethod
+	def parse_stk_result(result):
 		"""
 		Parse the result of Lipa na MPESA Online Payment (STK Push)
 
@@ -82,17 +130,10 @@ class MpesaClient:
 
 
 		phone_number = format_phone_number(phone_number)
-		url = api_base_url() + 'mpesa/stkpush/v1/processrequest'
-		passkey = mpesa_config('MPESA_PASSKEY')
-		
-		mpesa_environment = mpesa_config('MPESA_ENVIRONMENT')
-		if mpesa_environment == 'sandbox':
-			business_short_code = mpesa_config('MPESA_EXPRESS_SHORTCODE')
-		else:
-			business_short_code = mpesa_config('MPESA_SHORTCODE')
+		url = self.base_url + 'mpesa/stkpush/v1/processrequest'
+		business_short_code = self.business_short_code
 
-		timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
-		password = base64.b64encode((business_short_code + passkey + timestamp).encode('ascii')).decode('utf-8') 
+		timestamp, password = self.stk_password()
 		transaction_type = 'CustomerPayBillOnline'
 		party_a = phone_number
 		party_b = business_short_code
@@ -117,10 +158,52 @@ class MpesaClient:
 		}
 
 		try:
-			r = requests.post(url, json=data, headers=headers)
+			r = self.session.post(url, json=data, headers=headers, timeout=self.timeout)
 			response = mpesa_response(r)
 			return response
 		except requests.exceptions.ConnectionError:
 			raise MpesaConnectionError('Connection failed')
+		except requests.exceptions.Timeout:
+			raise MpesaConnectionError('Connection timed out')
+		except Exception as ex:
+			raise MpesaConnectionError(str(ex))
+
+	def stk_push_query(self, checkout_request_id):
+		"""
+		Query the status of an STK push
+
+		Args:
+			checkout_request_id (str) -- The CheckoutRequestID Daraja returned for the push
+
+		Returns:
+			MpesaResponse: MpesaResponse object containing the details of the API response. A
+				final result carries result_code and result_desc; a push the customer has not
+				answered yet comes back as error_code 500.001.1001.
+
+		Raises:
+			MpesaConnectionError: Connection error
+		"""
+
+		url = self.base_url + 'mpesa/stkpushquery/v1/query'
+		timestamp, password = self.stk_password()
+		data = {
+			'BusinessShortCode': self.business_short_code,
+			'Password': password,
+			'Timestamp': timestamp,
+			'CheckoutRequestID': checkout_request_id,
+		}
+
+		headers = {
+			'Authorization': 'Bearer ' + mpesa_access_token(),
+			'Content-type': 'application/json'
+		}
+
+		try:
+			r = self.session.post(url, json=data, headers=headers, timeout=self.timeout)
+			return mpesa_response(r)
+		except requests.exceptions.ConnectionError:
+			raise MpesaConnectionError('Connection failed')
+		except requests.exceptions.Timeout:
+			raise MpesaConnectionError('Connection timed out')
 		except Exception as ex:
-			raise MpesaConnectionError(str(ex))
\ No newline at end of file
+			raise MpesaConnectionError(str(ex))
@@ -0,0 +1,148 @@
+"""
+Process-wide cache of the Daraja OAuth access token
+"""
+
+import threading
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from KUKUCONNECT.workers import submit
+from ..models import AccessToken
+
+# Tokens are treated as expired after TOKEN_LIFETIME (Daraja's last an hour)
+# and refreshed in the background once they are older than REFRESH_AFTER.
+TOKEN_LIFETIME = timedelta(minutes=50)
+REFRESH_AFTER = timedelta(minutes=45)
+# Key of the Postgres advisory lock serializing refreshes across workers.
+ADVISORY_LOCK_ID = 0x6d70657361
+
+
+class AccessTokenManager:
+	"""
+	Hands out the current access token from memory.
+
+	The token and its issue time are kept per process, so a valid token costs
+	no queries. Between REFRESH_AFTER and TOKEN_LIFETIME callers still get the
+	cached token while one background task fetches the next; only past
+	TOKEN_LIFETIME do they wait for the refresh.
+
+	Refreshes are single-flight: within a process a lock lets one thread
+	refresh while the others wait for its result, and across workers the
+	refreshing process holds a Postgres advisory lock (which exists whether
+	or not a token is stored yet) while it calls the OAuth API, outside any
+	transaction. Whoever gets the lock next finds the new token stored and
+	adopts it instead of asking Daraja again. Background refreshes do not
+	wait for the lock at all: if another worker is already refreshing, the
+	cached token is still valid and its successor is adopted later.
+	"""
+
+	def __init__(self, fetch_token):
+		self.fetch_token = fetch_token
+		self.lock = threading.Lock()
+		self.token = None
+		self.issued_at = None
+		self.refreshing = False
+
+	def age(self, now=None):
+		if self.issued_at is None:
+			return None
+		return (now or timezone.now()) - self.issued_at
+
+	def get(self):
+		"""
+		Returns:
+			str: A valid access token
+		"""
+
+		token, age = self.token, self.age()
+		if age is not None and age < TOKEN_LIFETIME:
+			if age >= REFRESH_AFTER:
+				self.refresh_in_background()
+			return token
+		with self.lock:
+			# Another thread may have refreshed while this one waited.
+			age = self.age()
+			if age is None or age >= TOKEN_LIFETIME:
+				self.load(max_age=REFRESH_AFTER)
+			return self.token
+
+	def refresh_in_background(self):
+		# A racing caller may queue a second task; it finds the token fresh.
+		if not self.refreshing:
+			self.refreshing = True
+			submit(self.refresh_if_stale)
+
+	def refresh_if_stale(self):
+		try:
+			with self.lock:
+				age = self.age()
+				if age is None or age >= REFRESH_AFTER:
+					self.load(max_age=REFRESH_AFTER, wait=age is None or age >= TOKEN_LIFETIME)
+		finally:
+			self.refreshing = False
+
+	def refresh(self):
+		"""
+		Fetch a new token unconditionally.
+
+		Returns:
+			AccessToken: The AccessToken object from the database
+		"""
+
+		with self.lock:
+			return self.load(max_age=timedelta(0))
+
+	def stored(self, max_age):
+		access_token = AccessToken.objects.order_by('-created_at', '-id').first()
+		if access_token is not None and timezone.now() - access_token.created_at < max_age:
+			return access_token
+		return None
+
+	def adopt(self, access_token):
+		self.token = access_token.token
+		self.issued_at = access_token.created_at
+		return access_token
+
+	def load(self, max_age, wait=True):
+		"""
+		Adopt the stored token if it is younger than max_age, otherwise fetch a
+		new one and store it. Call with self.lock held.
+
+		Arguments:
+			max_age (timedelta) -- The oldest stored token to adopt
+			wait (bool) -- Wait for a refresh another worker has under way; without it that refresh is left to finish and None returned
+
+		Returns:
+			AccessToken: The adopted token, or None
+		"""
+
+		access_token = self.stored(max_age)
+		if access_token is not None:
+			return self.adopt(access_token)
+		with connection.cursor() as cursor:
+			cursor.execute(f"SELECT {'pg_advisory_lock' if wait else 'pg_try_advisory_lock'}(%s)", [ADVISORY_LOCK_ID])
+			if not wait and not cursor.fetchone()[0]:
+				return None
+		try:
+			# The worker holding the lock before may have stored a token.
+			access_token = self.stored(max_age)
+			if access_token is None:
+				token = self.fetch_token()
+				with transaction.atomic():
+					AccessToken.objects.all().delete()
+					access_token = AccessToken.objects.create(token=token)
+		finally:
+			with connection.cursor() as cursor:
+				cursor.execute('SELECT pg_advisory_unlock(%s)', [ADVISORY_LOCK_ID])
+		return self.adopt(access_token)
+
+	def clear(self):
+		"""
+		Forget the cached token, e.g. after Daraja rejected it.
+		"""
+
+		with self.lock:
+			self.token = None
+			self.issued_at = None
@@ -4,8 +4,11 @@ General utilities for the MPESA functions
 
 from __future__ import print_function
 from .exceptions import MpesaConfigurationException, IllegalPhoneNumberException, MpesaConnectionError, MpesaError
-from ..models import AccessToken
+from .tokens import AccessTokenManager
 import requests
+import threading
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from django.utils import timezone
 from decouple import config, UndefinedValueError
 import os
@@ -30,6 +33,8 @@ class MpesaResponse(Response):
 	error_message = ''
 	merchant_request_id = ''
 	checkout_request_id = ''
+	result_code = ''
+	result_desc = ''
 
 
 def mpesa_response(r):
@@ -52,6 +57,8 @@ def mpesa_response(r):
 	r.error_message = json_response.get('errorMessage', '')
 	r.merchant_request_id = json_response.get('MerchantRequestID', '')
 	r.checkout_request_id = json_response.get('CheckoutRequestID', '')
+	r.result_code = json_response.get('ResultCode', '')
+	r.result_desc = json_response.get('ResultDesc', '')
 	return r
 
 
@@ -80,17 +87,81 @@ def mpesa_config(key):
 	return value
 
 
+# Only these are retried after the request went out; failed connections are
+# retried for every method, since nothing reached Daraja.
+IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD'])
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def http_session(pool_size=None, retries=None):
+	"""
+	Create a requests session that keeps up to pool_size connections to
+	Daraja alive and retries with exponential backoff
+
+	Arguments:
+		pool_size (int) -- (Optional) Connections kept open, MPESA_POOL_SIZE by default
+		retries (int) -- (Optional) Retries per request, MPESA_RETRIES by default
+
+	Returns:
+		requests.Session: The new session
+	"""
+
+	pool_size = pool_size or settings.MPESA_POOL_SIZE
+	retries = settings.MPESA_RETRIES if retries is None else retries
+	retry = Retry(
+		total=retries,
+		backoff_factor=0.5,
+		status_forcelist=RETRY_STATUSES,
+		allowed_methods=IDEMPOTENT_METHODS,
+		raise_on_status=False,
+	)
+	adapter = HTTPAdapter(pool_maxsize=pool_size, max_retries=retry)
+	session = requests.Session()
+	session.mount('https://', adapter)
+	session.mount('http://', adapter)
+	return session
+
+
+def default_session():
+	"""
+	The session shared by calls made outside an MpesaClient (OAuth)
+	"""
+
+	global _session
+	if _session is None:
+		with _session_lock:
+			if _session is None:
+				_session = http_session()
+	return _session
+
+
+def request_timeout():
+	"""
+	Returns:
+		tuple: The (connect, read) timeouts in seconds
+	"""
+
+	return (settings.MPESA_CONNECT_TIMEOUT, settings.MPESA_READ_TIMEOUT)
+
+
 def api_base_url():
 	"""
 	Gets the base URL for making API calls
 
 	Returns:
-		The base URL depending on development environment (sandbox or production)
+		The base URL depending on development environment (sandbox or production),
+		or MPESA_API_BASE_URL when set (e.g. a local stub)
 
 	Raises:
 		MpesaConfigurationException: Environment not sandbox or production
 	"""
 
+	if settings.MPESA_API_BASE_URL:
+		return settings.MPESA_API_BASE_URL
+
 	mpesa_environment = mpesa_config('MPESA_ENVIRONMENT')
 
 	if mpesa_environment == 'development':
@@ -102,13 +173,14 @@ def api_base_url():
 	else:
 		raise MpesaConfigurationException('Mpesa environment not configured properly - MPESA_ENVIRONMENT should be sandbox or production')
 
-def generate_access_token_request(consumer_key = None, consumer_secret = None):
+def generate_access_token_request(consumer_key = None, consumer_secret = None, session = None):
 	"""
 	Make a call to OAuth API to generate access token
 	
 	Arguments:
 		consumer_key (str) -- (Optional) The Consumer Key to use
 		consumer_secret (str) -- (Optional) The Consumer Secret to use
+		session (requests.Session) -- (Optional) The session to send it with
 
 	Returns:
 		requests.Response: Response object with the response details
@@ -121,21 +193,25 @@ def generate_access_token_request(consumer_key = None, consumer_secret = None):
 	consumer_key = consumer_key if consumer_key is not None else mpesa_config('MPESA_CONSUMER_KEY') 
 	consumer_secret = consumer_secret if consumer_secret is not None else mpesa_config('MPESA_CONSUMER_SECRET')
 
+	session = session or default_session()
+
 	try:
-		r = requests.get(url, auth=(consumer_key, consumer_secret))
+		r = session.get(url, auth=(consumer_key, consumer_secret), timeout=request_timeout())
 	except requests.exceptions.ConnectionError:
 		raise MpesaConnectionError('Connection failed')
+	except requests.exceptions.Timeout:
+		raise MpesaConnectionError('Connection timed out')
 	except Exception as ex:
 		return ex.message
 	
 	return r
 
-def generate_access_token():
+def request_access_token():
 	"""
-	Parse generated OAuth access token, then updates database access token value
+	Fetch a new OAuth access token from the API
 
 	Returns:
-		AccessToken: The AccessToken object from the database
+		str: The new access token
 
 	Raises:
 		MpesaError: Error generating access token
@@ -148,34 +224,34 @@ def generate_access_token():
 		if r.status_code != 200:
 			raise MpesaError('Unable to generate access token')
 
-	token = r.json()['access_token']
+	return r.json()['access_token']
+
+token_manager = AccessTokenManager(request_access_token)
+
+def generate_access_token():
+	"""
+	Generate a new OAuth access token and store it in the database and in
+	this process' token cache
+
+	Returns:
+		AccessToken: The AccessToken object from the database
 
-	AccessToken.objects.all().delete()
-	access_token = AccessToken.objects.create(token=token)
+	Raises:
+		MpesaError: Error generating access token
+	"""
 
-	return access_token
+	return token_manager.refresh()
 
 def mpesa_access_token():
 	"""
-	Generate access token if the current one has expired or if token is non-existent
-	Otherwise return existing access token
+	Return the cached access token, generating a new one if it has expired or
+	does not exist yet (see tokens.AccessTokenManager)
 
 	Returns:
 		str: A valid access token
 	"""
 
-	access_token = AccessToken.objects.first()
-	if access_token == None:
-		# No access token found
-		access_token = generate_access_token()
-	else:
-		delta = timezone.now() - access_token.created_at
-		minutes = (delta.total_seconds()//60)
-		if minutes > 50:
-			# Access token expired
-			access_token = generate_access_token()	
-	
-	return access_token.token
+	return token_manager.get()
 
 def format_phone_number(phone_number):
 	"""
@@ -0,0 +1,291 @@
+"""
+Payment reconciliation
+
+Two passes, both batched:
+
+1. Stored STK results are matched against payments and orders one range of
+   StkCallback ids at a time, with a single join per range (CheckoutRequestID
+   is unique on payments). Results whose payment was still pending -- e.g.
+   the callback beat the dispatcher's own update -- are settled; paid
+   payments whose order was never marked paid are repaired; anything that
+   cannot be fixed safely is reported.
+2. Payments still awaiting the customer past the deadline, with no result
+   stored, are looked up with Daraja's STK push query. Queries run on a
+   bounded thread pool and share an adaptive delay that doubles whenever
+   Daraja throttles or fails and halves again on success.
+
+Orders paid after their stock was released and sold on are reported too.
+"""
+
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Exists, Max, Min, OuterRef
+from django.utils import timezone
+
+from products.models import Order, StockReservation
+from products.reservations import commit_order_reservations
+from .callbacks import settle_payments
+from .dispatch import client, fail_interrupted_payments
+from .models import Payment, StkCallback
+from .mpesa.exceptions import MpesaConnectionError
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 5000
+# Daraja's answer while the customer has not responded to the prompt.
+STILL_PROCESSING = '500.001.1001'
+
+UNMATCHED_CALLBACK = 'unmatched_callback'
+MERCHANT_REQUEST_MISMATCH = 'merchant_request_mismatch'
+AMOUNT_MISMATCH = 'amount_mismatch'
+PAID_BUT_FAILED = 'paid_but_failed'
+STOCK_RELEASED = 'stock_released'
+STUCK_SENDING = 'stuck_sending'
+QUERY_FAILED = 'query_failed'
+
+
+def mismatch(kind, checkout_request_id='', payment=None, order=None, detail=''):
+	return {'kind': kind, 'checkout_request_id': checkout_request_id, 'payment': payment, 'order': order, 'detail': detail}
+
+
+def match_callbacks(since, batch_size=DEFAULT_BATCH_SIZE):
+	"""
+	Match the results received since a time against their payments
+
+	Arguments:
+		since (datetime) -- Only callbacks received from then on
+		batch_size (int) -- Callback ids per query
+
+	Returns:
+		dict: 'callbacks' checked, payments 'settled', 'orders_repaired' and the 'mismatches' found
+	"""
+
+	report = {'callbacks': 0, 'settled': 0, 'orders_repaired': 0, 'mismatches': []}
+	bounds = StkCallback.objects.filter(received_at__gte=since).aggregate(first=Min('pk'), last=Max('pk'))
+	if bounds['first'] is None:
+		return report
+
+	callback = connection.ops.quote_name(StkCallback._meta.db_table)
+	payment = connection.ops.quote_name(Payment._meta.db_table)
+	order = connection.ops.quote_name(Order._meta.db_table)
+	sql = f"""
+		SELECT c.checkout_request_id, c.merchant_request_id, c.result_code, c.amount, c.mpesa_receipt_number,
+			p.id, p.status, p.amount, p.merchant_request_id, o.id, o.paid_at
+		FROM {callback} AS c
+		LEFT JOIN {payment} AS p ON p.checkout_request_id = c.checkout_request_id
+		LEFT JOIN {order} AS o ON o.id = p.order_id
+		WHERE c.id >= %s AND c.id < %s AND c.processed_at IS NOT NULL AND c.checkout_request_id <> ''
+		ORDER BY c.id
+	"""
+	for lower in range(bounds['first'], bounds['last'] + 1, batch_size):
+		with connection.cursor() as cursor:
+			cursor.execute(sql, [lower, lower + batch_size])
+			rows = cursor.fetchall()
+		report['callbacks'] += len(rows)
+
+		late_results = {}
+		unmarked_orders = set()
+		for (checkout_request_id, merchant_request_id, result_code, amount, receipt,
+				payment_id, status, payment_amount, payment_merchant_request_id, order_id, paid_at) in rows:
+			if payment_id is None:
+				report['mismatches'].append(mismatch(UNMATCHED_CALLBACK, checkout_request_id, detail=f'result {result_code}'))
+				continue
+			if payment_merchant_request_id and merchant_request_id != payment_merchant_request_id:
+				report['mismatches'].append(mismatch(
+					MERCHANT_REQUEST_MISMATCH, checkout_request_id, payment_id, order_id,
+					f'callback {merchant_request_id}, payment {payment_merchant_request_id}',
+				))
+			if result_code != 0:
+				if status in Payment.PENDING:
+					late_results.setdefault(checkout_request_id, {'CheckoutRequestID': checkout_request_id, 'ResultCode': result_code, 'ResultDesc': ''})
+				continue
+			if amount is not None and amount != payment_amount:
+				# Never settled automatically; left pending for manual review.
+				report['mismatches'].append(mismatch(AMOUNT_MISMATCH, checkout_request_id, payment_id, order_id, f'paid {amount}, expected {payment_amount}'))
+				continue
+			if status in Payment.PENDING:
+				# A success always wins over a failure for the same push.
+				late_results[checkout_request_id] = {
+					'CheckoutRequestID': checkout_request_id, 'ResultCode': 0,
+					'ResultDesc': 'Settled by reconciliation', 'MpesaReceiptNumber': receipt,
+				}
+			elif status == Payment.FAILED:
+				report['mismatches'].append(mismatch(PAID_BUT_FAILED, checkout_request_id, payment_id, order_id, f'receipt {receipt}'))
+			elif paid_at is None:
+				unmarked_orders.add(order_id)
+
+		with transaction.atomic():
+			report['settled'] += settle_payments(list(late_results.values()))
+			if unmarked_orders:
+				report['orders_repaired'] += Order.objects.filter(pk__in=unmarked_orders, paid_at__isnull=True).update(paid_at=timezone.now())
+				commit_order_reservations(unmarked_orders)
+	return report
+
+
+def paid_orders_without_stock(since):
+	"""
+	Report orders paid since a time whose stock was released before the
+	payment landed and could not be taken again (see commit_order_reservations)
+
+	Returns:
+		list: The mismatches found
+	"""
+
+	orders = (
+		Order.objects.filter(paid_at__gte=since, reservations__status=StockReservation.RELEASED)
+		.values_list('pk', 'reservations__product_id').order_by('pk')
+	)
+	return [mismatch(STOCK_RELEASED, order=order_id, detail=f'product {product_id}') for order_id, product_id in orders]
+
+
+class AdaptiveBackoff:
+	"""
+	A delay shared by concurrent callers: doubled (up to maximum) when the
+	remote side throttles or fails, halved on each success.
+	"""
+
+	def __init__(self, minimum=0.25, maximum=30.0):
+		self.minimum = minimum
+		self.maximum = maximum
+		self.delay = 0.0
+		self.lock = threading.Lock()
+
+	def wait(self):
+		with self.lock:
+			delay = self.delay
+		if delay:
+			time.sleep(delay)
+
+	def succeeded(self):
+		with self.lock:
+			self.delay = self.delay / 2 if self.delay / 2 >= self.minimum else 0.0
+
+	def failed(self):
+		with self.lock:
+			self.delay = min(self.maximum, max(self.minimum, self.delay * 2))
+
+
+def query_payment(checkout_request_id, backoff, attempts=4):
+	"""
+	Ask Daraja for the result of an STK push
+
+	Returns:
+		tuple: ('result', parsed result), ('pending', None) or ('error', description)
+	"""
+
+	error = ''
+	for _ in range(attempts):
+		backoff.wait()
+		try:
+			r = client.stk_push_query(checkout_request_id)
+		except MpesaConnectionError as ex:
+			backoff.failed()
+			error = str(ex)
+			continue
+		if r.status_code == 429 or r.status_code >= 500 and r.error_code != STILL_PROCESSING:
+			backoff.failed()
+			error = r.error_message or f'HTTP {r.status_code}'
+			continue
+		backoff.succeeded()
+		if r.error_code == STILL_PROCESSING:
+			return 'pending', None
+		if r.response_code == '0' and r.result_code != '':
+			return 'result', {'CheckoutRequestID': checkout_request_id, 'ResultCode': int(r.result_code), 'ResultDesc': r.result_desc}
+		return 'error', r.error_message or r.response_description or f'HTTP {r.status_code}'
+	return 'error', error
+
+
+def query_in_thread(checkout_request_id, backoff):
+	try:
+		return query_payment(checkout_request_id, backoff)
+	finally:
+		# Only a token refresh touches the database from these threads.
+		connection.close()
+
+
+def query_stale_payments(deadline, concurrency=8, batch_size=500):
+	"""
+	Look up payments sent before the deadline that still have no result
+
+	Arguments:
+		deadline (datetime) -- Only payments created before it
+		concurrency (int) -- Queries in flight at once
+		batch_size (int) -- Payments per batch
+
+	Returns:
+		dict: Payments 'queried', 'settled' and 'still_pending', and the 'mismatches' found
+	"""
+
+	report = {'queried': 0, 'settled': 0, 'still_pending': 0, 'mismatches': []}
+	interrupted = timezone.now() - timedelta(seconds=settings.STK_PUSH_SENDING_TIMEOUT)
+	for payment_id, checkout_request_id, order_id in Payment.objects.filter(
+		status=Payment.SENDING, created_at__lt=deadline, updated_at__lt=interrupted,
+	).values_list('pk', 'checkout_request_id', 'order_id'):
+		# Daraja may or may not have prompted the customer; nothing to query by.
+		report['mismatches'].append(mismatch(STUCK_SENDING, checkout_request_id or '', payment_id, order_id, 'failed as interrupted'))
+	fail_interrupted_payments()
+
+	backoff = AdaptiveBackoff()
+	last_id = 0
+	with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='reconcile') as pool:
+		while True:
+			batch = list(
+				Payment.objects.filter(status=Payment.SENT, created_at__lt=deadline, pk__gt=last_id)
+				.exclude(checkout_request_id=None)
+				# Those with a stored result were held back for review (see match_callbacks).
+				.exclude(Exists(StkCallback.objects.filter(checkout_request_id=OuterRef('checkout_request_id'))))
+				.order_by('pk')
+				.values_list('pk', 'checkout_request_id', 'order_id')[:batch_size]
+			)
+			if not batch:
+				return report
+			last_id = batch[-1][0]
+			outcomes = pool.map(lambda payment: query_in_thread(payment[1], backoff), batch)
+			results = []
+			for (payment_id, checkout_request_id, order_id), (outcome, data) in zip(batch, outcomes):
+				report['queried'] += 1
+				if outcome == 'result':
+					results.append(data)
+				elif outcome == 'pending':
+					report['still_pending'] += 1
+				else:
+					report['mismatches'].append(mismatch(QUERY_FAILED, checkout_request_id, payment_id, order_id, data))
+			with transaction.atomic():
+				report['settled'] += settle_payments(results)
+
+
+def reconcile(since=None, deadline=None, concurrency=8, batch_size=DEFAULT_BATCH_SIZE):
+	"""
+	Run both passes
+
+	Arguments:
+		since (datetime) -- Match callbacks received from then on, a day ago by default
+		deadline (datetime) -- Query payments created before it, five minutes ago by default
+
+	Returns:
+		dict: The merged report of match_callbacks and query_stale_payments
+	"""
+
+	now = timezone.now()
+	since = since or now - timedelta(days=1)
+	matched = match_callbacks(since, batch_size=batch_size)
+	queried = query_stale_payments(deadline or now - timedelta(minutes=5), concurrency=concurrency)
+	matched['mismatches'] += paid_orders_without_stock(since)
+	logger.info(
+		'Reconciliation settled %s payment(s), repaired %s order(s), found %s mismatch(es)',
+		matched['settled'] + queried['settled'], matched['orders_repaired'], len(matched['mismatches']) + len(queried['mismatches']),
+	)
+	return {
+		'callbacks': matched['callbacks'],
+		'orders_repaired': matched['orders_repaired'],
+		'settled': matched['settled'] + queried['settled'],
+		'queried': queried['queried'],
+		'still_pending': queried['still_pending'],
+		'mismatches': matched['mismatches'] + queried['mismatches'],
+	}
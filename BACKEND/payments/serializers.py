@@ -0,0 +1,32 @@
+from rest_framework import serializers
+
+from products.models import Order
+from .models import Payment
+from .mpesa.exceptions import IllegalPhoneNumberException
+from .mpesa.utils import format_phone_number
+
+
+class CheckoutSerializer(serializers.Serializer):
+	order = serializers.PrimaryKeyRelatedField(queryset=Order.objects.all())
+	phone_number = serializers.CharField(max_length=15)
+
+	def validate_order(self, order):
+		if order.buyer_id != self.context['request'].user.id:
+			raise serializers.ValidationError('Invalid pk "{}" - object does not exist.'.format(order.pk))
+		if order.total_price <= 0:
+			raise serializers.ValidationError('Nothing to pay for this order.')
+		return order
+
+	def validate_phone_number(self, phone_number):
+		digits = ''.join(character for character in phone_number if character.isdigit())
+		try:
+			return format_phone_number(digits)
+		except IllegalPhoneNumberException as ex:
+			raise serializers.ValidationError(str(ex))
+
+
+class PaymentSerializer(serializers.ModelSerializer):
+	class Meta:
+		model = Payment
+		fields = ['id', 'order', 'amount', 'phone_number', 'status', 'result_code', 'result_desc', 'created_at', 'updated_at']
+		read_only_fields = fields
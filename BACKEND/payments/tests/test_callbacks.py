@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+Test STK push callback ingestion
+"""
+
+from __future__ import unicode_literals
+import json
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from payments.callbacks import process_stk_callbacks
+from payments.models import Payment, StkCallback
+from products.models import Order, Product, StockReservation
+
+User = get_user_model()
+
+
+def stk_callback(checkout_request_id, result_code=0, receipt='QKT1ABC2DE', amount=451):
+	callback = {
+		'MerchantRequestID': '29115-1',
+		'CheckoutRequestID': checkout_request_id,
+		'ResultCode': result_code,
+		'ResultDesc': 'The service request is processed successfully.' if result_code == 0 else 'Request cancelled by user',
+	}
+	if result_code == 0:
+		callback['CallbackMetadata'] = {'Item': [
+			{'Name': 'Amount', 'Value': amount},
+			{'Name': 'MpesaReceiptNumber', 'Value': receipt},
+			{'Name': 'PhoneNumber', 'Value': 254712345678},
+		]}
+	return json.dumps({'Body': {'stkCallback': callback}})
+
+
+@override_settings(MPESA_CALLBACK_TOKEN='s3cret')
+class StkCallbackTestCase(TestCase):
+
+	def setUp(self):
+		buyer = User.objects.create_user(username='buyer1', email='buyer1@example.com', password='password123')
+		farmer = User.objects.create_user(username='farmer1', email='farmer1@example.com', password='password123')
+		product = Product.objects.create(farmer=farmer, title='Layers', description='Hens', category='number', price=450, stock=5)
+		self.orders = [Order.objects.create(buyer=buyer, total_price='450.50') for _ in range(2)]
+		for number, order in enumerate(self.orders):
+			StockReservation.objects.create(order=order, product=product, quantity=1, expires_at=timezone.now() + timedelta(minutes=30))
+			Payment.objects.create(order=order, buyer=buyer, phone_number='254712345678', amount=451, status=Payment.SENT, checkout_request_id=f'ws_CO_{number}')
+
+	def post(self, payload, **extra):
+		extra.setdefault('QUERY_STRING', 'token=s3cret')
+		with self.captureOnCommitCallbacks(execute=True):
+			return self.client.post('/api/payments/callback/', payload, content_type='application/json', **extra)
+
+	def test_callbacks_settle_payments(self):
+		'''
+		Test that results settle their payments once and mark orders paid
+		'''
+
+		response = self.post(stk_callback('ws_CO_0'))
+		self.assertEqual(response.status_code, 200)
+		self.assertEqual(response.json()['ResultCode'], 0)
+		self.post(stk_callback('ws_CO_1', result_code=1032))
+		self.post('not json')
+
+		paid, cancelled = (Payment.objects.get(checkout_request_id=f'ws_CO_{number}') for number in range(2))
+		self.assertEqual((paid.status, paid.mpesa_receipt_number), (Payment.PAID, 'QKT1ABC2DE'))
+		self.assertEqual((cancelled.status, cancelled.result_code), (Payment.FAILED, 1032))
+		self.assertIsNotNone(Order.objects.get(pk=self.orders[0].pk).paid_at)
+		self.assertIsNone(Order.objects.get(pk=self.orders[1].pk).paid_at)
+		self.assertEqual(
+			dict(StockReservation.objects.values_list('order_id', 'status')),
+			{self.orders[0].pk: StockReservation.COMMITTED, self.orders[1].pk: StockReservation.HELD},
+		)
+		self.assertFalse(StkCallback.objects.filter(processed_at__isnull=True).exists())
+		self.assertEqual(StkCallback.objects.get(error__gt='').payload, 'not json')
+
+		# A retried callback with a different result changes nothing.
+		self.post(stk_callback('ws_CO_1'))
+		self.assertEqual(Payment.objects.get(checkout_request_id='ws_CO_1').status, Payment.FAILED)
+
+	def test_short_payment_not_settled(self):
+		'''
+		Test that a success for another amount leaves the payment pending
+		'''
+
+		self.post(stk_callback('ws_CO_0', amount=1))
+		self.assertEqual(Payment.objects.get(checkout_request_id='ws_CO_0').status, Payment.SENT)
+		self.assertIsNone(Order.objects.get(pk=self.orders[0].pk).paid_at)
+		self.assertEqual(StockReservation.objects.get(order=self.orders[0]).status, StockReservation.HELD)
+
+	def test_callbacks_processed_in_batches(self):
+		'''
+		Test that stored callbacks are drained in batches, duplicates included
+		'''
+
+		StkCallback.objects.bulk_create([
+			StkCallback(payload=stk_callback(f'ws_CO_{number % 2}')) for number in range(5)
+		])
+		# Per batch: claim, settle payments, update callbacks and the
+		# savepoint pair. The first batch also marks both orders paid,
+		# commits their stock and looks for released holds; the rest only
+		# repeat results. Then an empty claim.
+		with self.assertNumQueries(8 + 5 + 5 + 3):
+			self.assertEqual(process_stk_callbacks(batch_size=2), 5)
+		self.assertEqual(Payment.objects.filter(status=Payment.PAID).count(), 2)
+
+	def test_callback_token(self):
+		'''
+		Test that the callback URL's token is checked, and that callbacks are
+		refused outright without one unless DEBUG is on
+		'''
+
+		self.assertEqual(self.post(stk_callback('ws_CO_0'), QUERY_STRING='').status_code, 403)
+		self.assertEqual(self.post(stk_callback('ws_CO_0'), QUERY_STRING='token=wrong').status_code, 403)
+		self.assertEqual(self.post(stk_callback('ws_CO_0')).status_code, 200)
+		with self.settings(MPESA_CALLBACK_TOKEN=None):
+			self.assertEqual(self.post(stk_callback('ws_CO_0'), QUERY_STRING='').status_code, 403)
+			with self.settings(DEBUG=True):
+				self.assertEqual(self.post(stk_callback('ws_CO_0'), QUERY_STRING='').status_code, 200)
+		self.assertEqual(StkCallback.objects.count(), 2)
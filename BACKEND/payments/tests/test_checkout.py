@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""
+Test checkout and STK push dispatch
+"""
+
+from __future__ import unicode_literals
+from datetime import timedelta
+from unittest import mock
+
+import requests
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from payments import dispatch
+from payments.models import Payment
+from products.models import Order, Product, StockReservation
+
+User = get_user_model()
+
+
+def daraja_response(payload):
+	response = requests.Response()
+	response.status_code = 200
+	response._content = payload.encode()
+	return response
+
+
+ACCEPTED = daraja_response('{"MerchantRequestID": "29115-1", "CheckoutRequestID": "ws_CO_1", "ResponseCode": "0", "ResponseDescription": "Success", "CustomerMessage": "Success. Request accepted for processing"}')
+
+
+@override_settings(MPESA_API_BASE_URL='https://daraja.test/', MPESA_ENVIRONMENT='sandbox', MPESA_EXPRESS_SHORTCODE='174379', MPESA_PASSKEY='passkey', MPESA_CALLBACK_URL='https://kukuconnect.test/api/payments/callback/')
+@mock.patch('payments.mpesa.core.mpesa_access_token', mock.Mock(return_value='token'))
+class CheckoutTestCase(TestCase):
+
+	def setUp(self):
+		self.buyer = User.objects.create_user(username='buyer1', email='buyer1@example.com', password='password123')
+		self.order = Order.objects.create(buyer=self.buyer, total_price='450.50')
+		self.api_client = APIClient()
+		self.api_client.force_authenticate(self.buyer)
+
+	def checkout(self, **data):
+		data = {'order': self.order.pk, 'phone_number': '0712 345 678', **data}
+		with self.captureOnCommitCallbacks(execute=True):
+			return self.api_client.post('/api/payments/checkout/', data, format='json')
+
+	def test_checkout_sends_stk_push_in_background(self):
+		'''
+		Test that checkout queues the payment and the STK push is recorded
+		'''
+
+		with mock.patch.object(dispatch.client.session, 'post', return_value=ACCEPTED) as post:
+			response = self.checkout()
+		self.assertEqual(response.status_code, 202)
+		self.assertEqual(response.data['status'], Payment.QUEUED)
+		self.assertTrue(response.data['status_url'].endswith(f"/api/payments/{response.data['id']}/"))
+		sent = post.call_args.kwargs['json']
+		self.assertEqual((sent['Amount'], sent['PhoneNumber'], sent['AccountReference']), (451, '254712345678', f'ORDER{self.order.pk}'))
+
+		payment = Payment.objects.get()
+		self.assertEqual((payment.status, payment.checkout_request_id), (Payment.SENT, 'ws_CO_1'))
+		response = self.api_client.get(response.data['status_url'])
+		self.assertEqual(response.data['status'], Payment.SENT)
+
+		# A second checkout while the first is pending does not prompt again.
+		with mock.patch.object(dispatch.client.session, 'post') as post:
+			self.assertEqual(self.checkout().data['id'], payment.pk)
+		post.assert_not_called()
+
+	def test_failed_push_and_validation(self):
+		'''
+		Test that Daraja errors fail the payment and bad input is rejected
+		'''
+
+		with mock.patch.object(dispatch.client.session, 'post', side_effect=requests.exceptions.ConnectTimeout()):
+			self.checkout()
+		self.assertEqual(Payment.objects.get().status, Payment.FAILED)
+
+		other = User.objects.create_user(username='buyer2', email='buyer2@example.com', password='password123')
+		foreign = Order.objects.create(buyer=other, total_price=100)
+		self.assertEqual(self.checkout(order=foreign.pk).status_code, 400)
+		self.assertEqual(self.checkout(phone_number='0712').status_code, 400)
+		self.api_client.force_authenticate(other)
+		self.assertEqual(self.api_client.get(f'/api/payments/{Payment.objects.get().pk}/').status_code, 404)
+
+	def test_paid_order_refused(self):
+		'''
+		Test that an order already paid for cannot be checked out again
+		'''
+
+		Payment.objects.create(order=self.order, buyer=self.buyer, phone_number='254712345678', amount=451, status=Payment.PAID)
+		response = self.checkout()
+		self.assertEqual(response.status_code, 400)
+		self.assertIn('order', response.data)
+
+		Payment.objects.update(status=Payment.FAILED)
+		Order.objects.filter(pk=self.order.pk).update(paid_at=timezone.now())
+		self.assertEqual(self.checkout().status_code, 400)
+		self.assertEqual(Payment.objects.count(), 1)
+
+	def test_expired_reservation_refused(self):
+		'''
+		Test that checkout renews held stock, and refuses once it was released
+		'''
+
+		farmer = User.objects.create_user(username='farmer1', email='farmer1@example.com', password='password123')
+		product = Product.objects.create(farmer=farmer, title='Layers', description='Hens', category='number', price=450, stock=5)
+		reservation = StockReservation.objects.create(order=self.order, product=product, quantity=1, expires_at=timezone.now() + timedelta(minutes=1))
+		with mock.patch.object(dispatch.client.session, 'post', return_value=ACCEPTED):
+			self.assertEqual(self.checkout().status_code, 202)
+		reservation.refresh_from_db()
+		self.assertGreater(reservation.expires_at, timezone.now() + timedelta(minutes=5))
+
+		Payment.objects.update(status=Payment.FAILED)
+		StockReservation.objects.update(expires_at=timezone.now() - timedelta(minutes=1))
+		response = self.checkout()
+		self.assertEqual(response.status_code, 400)
+		self.assertIn('released', response.data['order'][0])
+
+	def test_interrupted_send_failed_by_dispatch_command(self):
+		'''
+		Test that a payment left SENDING by a dead dispatcher is failed, not resent
+		'''
+
+		payment = Payment.objects.create(order=self.order, buyer=self.buyer, phone_number='254712345678', amount=451, status=Payment.SENDING)
+		with mock.patch.object(dispatch.client.session, 'post') as post:
+			call_command('dispatch_payments', stdout=mock.Mock())
+			self.assertEqual(Payment.objects.get().status, Payment.SENDING)
+			Payment.objects.update(updated_at=timezone.now() - timedelta(minutes=5))
+			call_command('dispatch_payments', stdout=mock.Mock())
+		post.assert_not_called()
+		payment.refresh_from_db()
+		self.assertEqual(payment.status, Payment.FAILED)
+
+		# The buyer can then start over.
+		with mock.patch.object(dispatch.client.session, 'post', return_value=ACCEPTED):
+			self.assertEqual(self.checkout().status_code, 202)
+		self.assertEqual(Payment.objects.filter(status=Payment.SENT).count(), 1)
+
+	def test_full_queue_left_for_dispatch_command(self):
+		'''
+		Test that a full queue never sends from the request thread
+		'''
+
+		with mock.patch.object(dispatch.stk_push_pool, 'try_submit', return_value=None), \
+				mock.patch.object(dispatch.client.session, 'post') as post:
+			self.checkout()
+		post.assert_not_called()
+		self.assertEqual(Payment.objects.get().status, Payment.QUEUED)
+
+		Payment.objects.update(created_at=timezone.now() - timedelta(minutes=1))
+		with mock.patch.object(dispatch.client.session, 'post', return_value=ACCEPTED):
+			call_command('dispatch_payments')
+		self.assertEqual(Payment.objects.get().status, Payment.SENT)
+
+	def test_long_poll(self):
+		'''
+		Test that the async status endpoint waits while the payment is pending
+		'''
+
+		payment = Payment.objects.create(order=self.order, buyer=self.buyer, phone_number='254712345678', amount=451, status=Payment.SENT)
+		response = self.api_client.get(f'/api/async/payments/{payment.pk}/?wait=0.6')
+		self.assertEqual(response.status_code, 401)
+
+		from rest_framework_simplejwt.tokens import AccessToken
+		headers = {'HTTP_AUTHORIZATION': f'Bearer {AccessToken.for_user(self.buyer)}'}
+		started = timezone.now()
+		response = self.client.get(f'/api/async/payments/{payment.pk}/?wait=0.6', **headers)
+		self.assertEqual(response.json()['status'], Payment.SENT)
+		self.assertGreaterEqual((timezone.now() - started).total_seconds(), 0.5)
+
+		Payment.objects.filter(pk=payment.pk).update(status=Payment.FAILED)
+		started = timezone.now()
+		response = self.client.get(f'/api/async/payments/{payment.pk}/?wait=20', **headers)
+		self.assertEqual(response.json()['status'], Payment.FAILED)
+		self.assertLess((timezone.now() - started).total_seconds(), 5)
@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+"""
+Test payment reconciliation
+"""
+
+from __future__ import unicode_literals
+import json
+import os
+import tempfile
+from datetime import timedelta
+from unittest import mock
+
+import requests
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from payments import dispatch
+from payments.models import Payment, StkCallback
+from payments.reconciliation import match_callbacks, query_stale_payments, AdaptiveBackoff
+from products.models import Order, Product, StockReservation
+
+User = get_user_model()
+
+
+def daraja_response(payload, status_code=200):
+	response = requests.Response()
+	response.status_code = status_code
+	response._content = json.dumps(payload).encode()
+	return response
+
+
+@override_settings(MPESA_API_BASE_URL='https://daraja.test/', MPESA_ENVIRONMENT='sandbox', MPESA_EXPRESS_SHORTCODE='174379', MPESA_PASSKEY='passkey')
+@mock.patch('payments.mpesa.core.mpesa_access_token', mock.Mock(return_value='token'))
+@mock.patch('payments.reconciliation.time.sleep', mock.Mock())
+class ReconciliationTestCase(TestCase):
+
+	def setUp(self):
+		self.buyer = User.objects.create_user(username='buyer1', email='buyer1@example.com', password='password123')
+
+	def payment(self, number, status=Payment.SENT, paid_at=None, **fields):
+		order = Order.objects.create(buyer=self.buyer, total_price='450.50', paid_at=paid_at)
+		fields = {'checkout_request_id': f'ws_CO_{number}', 'merchant_request_id': '29115-1', **fields}
+		return Payment.objects.create(order=order, buyer=self.buyer, phone_number='254712345678', amount=451, status=status, **fields)
+
+	def callback(self, number, result_code=0, amount=451, merchant_request_id='29115-1'):
+		return StkCallback(
+			payload='{}', processed_at=timezone.now(), merchant_request_id=merchant_request_id,
+			checkout_request_id=f'ws_CO_{number}', result_code=result_code,
+			amount=amount if result_code == 0 else None, mpesa_receipt_number=f'QKT{number}' if result_code == 0 else '',
+		)
+
+	def test_match_callbacks(self):
+		'''
+		Test that stored results settle, repair or report their payments across batches
+		'''
+
+		late = self.payment(0)
+		unmarked = self.payment(1, status=Payment.PAID)
+		failed = self.payment(2, status=Payment.FAILED)
+		short = self.payment(3, status=Payment.PAID, paid_at=timezone.now())
+		other = self.payment(4, status=Payment.PAID, paid_at=timezone.now())
+		underpaid = self.payment(6)
+		StkCallback.objects.bulk_create([
+			self.callback(0), self.callback(1), self.callback(2), self.callback(3, amount=10),
+			self.callback(4, merchant_request_id='29115-9'), self.callback(5), self.callback(6, amount=10),
+		])
+		StkCallback.objects.create(payload='{}', received_at=timezone.now() - timedelta(days=3))
+
+		report = match_callbacks(timezone.now() - timedelta(hours=1), batch_size=2)
+		self.assertEqual((report['callbacks'], report['settled'], report['orders_repaired']), (7, 1, 1))
+		self.assertEqual(
+			sorted((m['kind'], m['payment']) for m in report['mismatches']),
+			[
+				('amount_mismatch', short.pk), ('amount_mismatch', underpaid.pk), ('merchant_request_mismatch', other.pk),
+				('paid_but_failed', failed.pk), ('unmatched_callback', None),
+			],
+		)
+		# An underpaid push stays pending for review, and is not queried
+		# (and settled in full) behind the reviewer's back.
+		self.assertEqual(Payment.objects.get(pk=underpaid.pk).status, Payment.SENT)
+		self.assertIsNone(Order.objects.get(pk=underpaid.order_id).paid_at)
+		Payment.objects.update(created_at=timezone.now() - timedelta(minutes=10))
+		with mock.patch.object(dispatch.client.session, 'post') as post:
+			self.assertEqual(query_stale_payments(timezone.now() - timedelta(minutes=5))['queried'], 0)
+		post.assert_not_called()
+		late.refresh_from_db()
+		self.assertEqual((late.status, late.mpesa_receipt_number), (Payment.PAID, 'QKT0'))
+		self.assertIsNotNone(Order.objects.get(pk=late.order_id).paid_at)
+		self.assertIsNotNone(Order.objects.get(pk=unmarked.order_id).paid_at)
+
+		# A second run finds nothing left to fix.
+		report = match_callbacks(timezone.now() - timedelta(hours=1))
+		self.assertEqual((report['settled'], report['orders_repaired']), (0, 0))
+
+	def test_query_stale_payments(self):
+		'''
+		Test that stale payments are queried, throttling backs off and results settle
+		'''
+
+		paid, cancelled, waiting, throttled = (self.payment(number) for number in range(4))
+		self.payment(4)
+		stuck = self.payment(5, status=Payment.SENDING, checkout_request_id=None)
+		old = timezone.now() - timedelta(minutes=10)
+		Payment.objects.exclude(checkout_request_id='ws_CO_4').update(created_at=old, updated_at=old)
+		answers = {
+			'ws_CO_0': [daraja_response({'ResponseCode': '0', 'ResultCode': '0', 'ResultDesc': 'The service request is processed successfully.'})],
+			'ws_CO_1': [daraja_response({'ResponseCode': '0', 'ResultCode': '1032', 'ResultDesc': 'Request cancelled by user'})],
+			'ws_CO_2': [daraja_response({'errorCode': '500.001.1001', 'errorMessage': 'The transaction is being processed'}, 500)],
+			'ws_CO_3': [
+				daraja_response({'fault': 'Spike arrest violation'}, 429),
+				requests.exceptions.ConnectTimeout(),
+				daraja_response({'ResponseCode': '0', 'ResultCode': '0', 'ResultDesc': 'The service request is processed successfully.'}),
+			],
+		}
+
+		def post(url, json, **kwargs):
+			self.assertTrue(url.endswith('mpesa/stkpushquery/v1/query'))
+			answer = answers[json['CheckoutRequestID']].pop(0)
+			if isinstance(answer, Exception):
+				raise answer
+			return answer
+
+		with mock.patch.object(dispatch.client.session, 'post', side_effect=post) as session_post:
+			report = query_stale_payments(timezone.now() - timedelta(minutes=5), concurrency=3, batch_size=2)
+		self.assertEqual(session_post.call_count, 6)
+		self.assertEqual((report['queried'], report['settled'], report['still_pending']), (4, 3, 1))
+		self.assertEqual([(m['kind'], m['payment']) for m in report['mismatches']], [('stuck_sending', stuck.pk)])
+		self.assertEqual(Payment.objects.get(pk=stuck.pk).status, Payment.FAILED)
+		self.assertEqual(
+			dict(Payment.objects.filter(pk__in=[paid.pk, cancelled.pk, waiting.pk, throttled.pk]).values_list('pk', 'status')),
+			{paid.pk: Payment.PAID, cancelled.pk: Payment.FAILED, waiting.pk: Payment.SENT, throttled.pk: Payment.PAID},
+		)
+
+	def test_adaptive_backoff(self):
+		'''
+		Test that the delay doubles on failures, is capped, and halves away on success
+		'''
+
+		backoff = AdaptiveBackoff(minimum=1, maximum=4)
+		for _ in range(4):
+			backoff.failed()
+		self.assertEqual(backoff.delay, 4)
+		backoff.succeeded()
+		self.assertEqual(backoff.delay, 2)
+		backoff.succeeded()
+		backoff.succeeded()
+		self.assertEqual(backoff.delay, 0)
+
+	def test_paid_orders_read_by_index(self):
+		'''
+		Test that recently paid orders are found through the partial paid_at index
+		'''
+
+		with connection.cursor() as cursor:
+			cursor.execute('SET LOCAL enable_seqscan = off')
+			plan = Order.objects.filter(paid_at__gte=timezone.now() - timedelta(days=1)).explain()
+		self.assertIn('order_paid_at_idx', plan)
+
+	def test_command_report(self):
+		'''
+		Test that the command writes mismatches as JSON lines
+		'''
+
+		StkCallback.objects.bulk_create([self.callback(7)])
+		# Paid after its hold was released and the stock sold on.
+		resold = self.payment(8, status=Payment.PAID, paid_at=timezone.now())
+		farmer = User.objects.create_user(username='farmer1', email='farmer1@example.com', password='password123')
+		product = Product.objects.create(farmer=farmer, title='Layers', description='Hens', category='number', price=450, stock=0)
+		StockReservation.objects.create(order_id=resold.order_id, product=product, quantity=1, status=StockReservation.RELEASED, expires_at=timezone.now())
+		with tempfile.TemporaryDirectory() as directory:
+			path = os.path.join(directory, 'report.ndjson')
+			call_command('reconcile_payments', report=path, stdout=mock.Mock(), stderr=mock.Mock())
+			with open(path) as f:
+				lines = [json.loads(line) for line in f]
+		self.assertEqual(
+			[(line['kind'], line['checkout_request_id'], line['order']) for line in lines],
+			[('unmatched_callback', 'ws_CO_7', None), ('stock_released', '', resold.order_id)],
+		)
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""
+Test the access token cache
+"""
+
+from __future__ import unicode_literals
+import threading
+from datetime import timedelta
+from unittest import mock
+
+from django.db import connection
+from django.test import TestCase
+from django.utils import timezone
+
+from payments.models import AccessToken
+from payments.mpesa.tokens import ADVISORY_LOCK_ID, AccessTokenManager
+
+
+def hold_refresh_lock(taken, release):
+	# Stands in for another worker that is refreshing, on its own connection.
+	try:
+		with connection.cursor() as cursor:
+			cursor.execute('SELECT pg_advisory_lock(%s)', [ADVISORY_LOCK_ID])
+			taken.set()
+			release.wait(10)
+			cursor.execute('SELECT pg_advisory_unlock(%s)', [ADVISORY_LOCK_ID])
+	finally:
+		connection.close()
+
+
+class AccessTokenManagerTestCase(TestCase):
+
+	def setUp(self):
+		self.fetch = mock.Mock(side_effect=['token-1', 'token-2', 'token-3'])
+		self.manager = AccessTokenManager(self.fetch)
+
+	def age_token(self, minutes):
+		issued_at = timezone.now() - timedelta(minutes=minutes)
+		AccessToken.objects.update(created_at=issued_at)
+		if self.manager.issued_at is not None:
+			self.manager.issued_at = issued_at
+
+	def test_cached_token_costs_no_queries(self):
+		'''
+		Test that a valid token is served from memory
+		'''
+
+		self.assertEqual(self.manager.get(), 'token-1')
+		with self.assertNumQueries(0):
+			self.assertEqual(self.manager.get(), 'token-1')
+		self.assertEqual(self.fetch.call_count, 1)
+		self.assertEqual(AccessToken.objects.get().token, 'token-1')
+
+	def test_token_stored_by_another_worker_is_adopted(self):
+		'''
+		Test that a fresh token in the database is used instead of fetching one
+		'''
+
+		AccessToken.objects.create(token='shared')
+		self.assertEqual(self.manager.get(), 'shared')
+		self.fetch.assert_not_called()
+
+	def test_token_refreshed_before_expiry(self):
+		'''
+		Test that an ageing token is replaced while it is still being served
+		'''
+
+		self.manager.get()
+		self.age_token(46)
+		# Background tasks run inline in tests, so the refresh has finished
+		# by the time get() returns; the caller still got the cached token.
+		self.assertEqual(self.manager.get(), 'token-1')
+		self.assertEqual(self.manager.get(), 'token-2')
+		self.assertEqual(AccessToken.objects.get().token, 'token-2')
+
+	def test_expired_token_replaced(self):
+		'''
+		Test that a token past its lifetime is never handed out
+		'''
+
+		AccessToken.objects.create(token='stale')
+		self.age_token(51)
+		self.assertEqual(self.manager.get(), 'token-1')
+		self.assertEqual(list(AccessToken.objects.values_list('token', flat=True)), ['token-1'])
+
+	def test_fetched_outside_transaction_under_advisory_lock(self):
+		'''
+		Test that the OAuth call holds the advisory lock but no transaction
+		'''
+
+		depth = len(connection.atomic_blocks)
+
+		def fetch():
+			self.assertEqual(len(connection.atomic_blocks), depth)
+			with connection.cursor() as cursor:
+				cursor.execute("SELECT count(*) FROM pg_locks WHERE locktype = 'advisory' AND pid = pg_backend_pid()")
+				self.assertEqual(cursor.fetchone()[0], 1)
+			return 'token-1'
+
+		self.assertEqual(AccessTokenManager(fetch).get(), 'token-1')
+		with connection.cursor() as cursor:
+			cursor.execute("SELECT count(*) FROM pg_locks WHERE locktype = 'advisory' AND pid = pg_backend_pid()")
+			self.assertEqual(cursor.fetchone()[0], 0)
+
+	def test_background_refresh_leaves_busy_lock(self):
+		'''
+		Test that an ageing token is still served, without waiting, while
+		another worker refreshes
+		'''
+
+		self.manager.get()
+		self.age_token(46)
+		taken, release = threading.Event(), threading.Event()
+		holder = threading.Thread(target=hold_refresh_lock, args=(taken, release))
+		holder.start()
+		try:
+			self.assertTrue(taken.wait(10))
+			self.assertEqual(self.manager.get(), 'token-1')
+			self.assertEqual(self.fetch.call_count, 1)
+		finally:
+			release.set()
+			holder.join()
+		self.assertFalse(self.manager.refreshing)
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+"""
+Test the client's HTTP transport
+"""
+
+from __future__ import unicode_literals
+from unittest import mock
+
+import requests
+from django.test import SimpleTestCase, override_settings
+
+from payments.mpesa.core import MpesaClient
+from payments.mpesa.exceptions import MpesaConnectionError
+
+
+@override_settings(MPESA_API_BASE_URL='https://daraja.test/', MPESA_ENVIRONMENT='sandbox', MPESA_EXPRESS_SHORTCODE='174379', MPESA_PASSKEY='passkey')
+class MpesaTransportTestCase(SimpleTestCase):
+
+	def test_session_pooled_with_retries(self):
+		'''
+		Test that the client keeps a configured connection pool
+		'''
+
+		cl = MpesaClient(pool_size=4, connect_timeout=1, read_timeout=5, retries=2)
+		adapter = cl.session.get_adapter('https://daraja.test/')
+		self.assertEqual(adapter._pool_maxsize, 4)
+		self.assertEqual(adapter.max_retries.total, 2)
+		self.assertNotIn('POST', adapter.max_retries.allowed_methods)
+		self.assertEqual(cl.timeout, (1, 5))
+
+	@mock.patch('payments.mpesa.core.mpesa_access_token', return_value='token')
+	def test_stk_push_uses_session(self, access_token):
+		'''
+		Test that STK push goes through the pooled session with timeouts
+		'''
+
+		cl = MpesaClient(connect_timeout=1, read_timeout=5)
+		response = requests.Response()
+		response.status_code = 200
+		response._content = b'{"ResponseCode": "0", "CheckoutRequestID": "ws_CO_1"}'
+		with mock.patch.object(cl.session, 'post', return_value=response) as post:
+			r = cl.stk_push('0712345678', 1, 'ABC001', 'Description', 'https://example.com/callback')
+			cl.stk_push('0712345678', 1, 'ABC001', 'Description', 'https://example.com/callback')
+		self.assertEqual(r.checkout_request_id, 'ws_CO_1')
+		self.assertEqual(post.call_args.args[0], 'https://daraja.test/mpesa/stkpush/v1/processrequest')
+		self.assertEqual(post.call_args.kwargs['timeout'], (1, 5))
+
+		with mock.patch.object(cl.session, 'post', side_effect=requests.exceptions.ReadTimeout()):
+			with self.assertRaises(MpesaConnectionError):
+				cl.stk_push('0712345678', 1, 'ABC001', 'Description', 'https://example.com/callback')
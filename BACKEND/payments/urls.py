@@ -9,5 +9,8 @@ test_patterns = [
 
 urlpatterns = [
     path('', views.index, name='index'),
+    path('checkout/', views.CheckoutView.as_view(), name='payment-checkout'),
+    path('callback/', views.stk_callback, name='stk-callback'),
+    path('<int:pk>/', views.PaymentDetailView.as_view(), name='payment-detail'),
     path('tests/', include(test_patterns)),
 ]
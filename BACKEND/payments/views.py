@@ -2,12 +2,31 @@
 from __future__ import unicode_literals
 from .mpesa import utils
 
-from django.http import HttpResponse, JsonResponse
+import hmac
+import logging
+
+from django.conf import settings
+from django.db import transaction
+from django.http import HttpResponse, HttpResponseForbidden, JsonResponse
+from django.urls import reverse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
 from django.views.generic import View
+from drf_yasg.utils import swagger_auto_schema
+from rest_framework import generics, permissions, status
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+from rest_framework.views import APIView
+from .callbacks import schedule_processing
+from .dispatch import CheckoutRefused, start_checkout
+from .models import Payment, StkCallback
+from .serializers import CheckoutSerializer, PaymentSerializer
 from .mpesa.core import MpesaClient
 from decouple import config
 from datetime import datetime
 
+logger = logging.getLogger(__name__)
+
 cl = MpesaClient()
 stk_push_callback_url = 'https://api.darajambili.com/express-payment'
 b2c_callback_url = 'https://api.darajambili.com/b2c/result'
@@ -27,4 +46,58 @@ def stk_push_success(request):
 	transaction_desc = 'STK Push Description'
 	callback_url = stk_push_callback_url
 	r = cl.stk_push(phone_number, amount, account_reference, transaction_desc, callback_url)
-	return JsonResponse(r.response_description, safe=False)
\ No newline at end of file
+	return JsonResponse(r.response_description, safe=False)
+
+class CheckoutView(APIView):
+	"""
+	Start paying for an order by M-Pesa Express.
+
+	Returns 202 with the payment straight away; the STK push is sent in the
+	background. Follow it at ``status_url`` (which long-polls with ``?wait=``
+	on the async deployment). Checking out an order that already has a
+	payment under way returns that payment instead of prompting again; a
+	paid order is refused.
+	"""
+	permission_classes = [permissions.IsAuthenticated]
+
+	@swagger_auto_schema(request_body=CheckoutSerializer, responses={202: PaymentSerializer}, operation_description="Pay for an order by M-Pesa Express")
+	def post(self, request):
+		serializer = CheckoutSerializer(data=request.data, context={'request': request})
+		serializer.is_valid(raise_exception=True)
+		try:
+			payment, _ = start_checkout(request.user, serializer.validated_data['order'], serializer.validated_data['phone_number'])
+		except CheckoutRefused as ex:
+			raise ValidationError({'order': [str(ex)]})
+		data = PaymentSerializer(payment).data
+		data['status_url'] = request.build_absolute_uri(reverse('payment-detail', args=[payment.pk]))
+		return Response(data, status=status.HTTP_202_ACCEPTED)
+
+class PaymentDetailView(generics.RetrieveAPIView):
+	serializer_class = PaymentSerializer
+	permission_classes = [permissions.IsAuthenticated]
+
+	def get_queryset(self):
+		return Payment.objects.filter(buyer=self.request.user)
+
+@csrf_exempt
+@require_POST
+def stk_callback(request):
+	"""
+	Receive an STK push result from Daraja.
+
+	Does as little as possible so bursts never time out: the raw body is
+	stored and processed in batches later (see callbacks.py). The callback
+	URL must carry MPESA_CALLBACK_TOKEN as ?token=; without a token set,
+	callbacks are only accepted with DEBUG on.
+	"""
+
+	token = settings.MPESA_CALLBACK_TOKEN
+	if not token:
+		if not settings.DEBUG:
+			logger.error('MPESA_CALLBACK_TOKEN is not set, STK callback refused')
+			return HttpResponseForbidden()
+	elif not hmac.compare_digest(request.GET.get('token', ''), token):
+		return HttpResponseForbidden()
+	StkCallback.objects.create(payload=request.body.decode('utf-8', 'replace'))
+	transaction.on_commit(schedule_processing)
+	return JsonResponse({'ResultCode': 0, 'ResultDesc': 'Accepted'})
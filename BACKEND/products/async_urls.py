@@ -0,0 +1,10 @@
+from django.urls import path
+
+from .async_views import buyer_orders, farmer_orders, marketplace, product_detail
+
+urlpatterns = [
+    path('<int:pk>/', product_detail, name='async-product-detail'),
+    path('marketplace/', marketplace, name='async-marketplace'),
+    path('orders/farmer/', farmer_orders, name='async-farmer-orders'),
+    path('orders/buyer/', buyer_orders, name='async-buyer-orders'),
+]
@@ -0,0 +1,61 @@
+"""
+Async twins of the hot catalog and order reads; see KUKUCONNECT/async_api.py.
+
+Each one builds its query with the matching DRF view and only evaluates it
+through the async ORM, so filtering, access control and output stay in step
+with the sync endpoint.
+"""
+from asgiref.sync import sync_to_async
+from django.utils.cache import get_conditional_response
+
+from KUKUCONNECT.async_api import async_endpoint, render_json
+from .cache import get_cached_page, marketplace_cache_key, set_cached_page
+from .filters import afacet_counts
+from .mixins import conditional_validators, set_validators, updated_at_query
+from .views import BuyerOrdersView, FarmerOrdersView, MarketplaceView, ProductDetailView
+
+
+@async_endpoint(MarketplaceView)
+async def marketplace(view, request):
+    cache_key = await sync_to_async(marketplace_cache_key)(request)
+    data = await sync_to_async(get_cached_page)(cache_key)
+    if data is not None:
+        response = render_json(data)
+        response['X-Cache'] = 'HIT'
+        return response
+
+    queryset = view.filter_queryset(view.get_queryset())
+    paginator = view.paginator
+    page = await paginator.apaginate_queryset(queryset, request, view=view)
+    data = paginator.get_paginated_response(view.get_serializer(page, many=True).data).data
+    if paginator.cursor_query_param not in request.query_params:
+        data['facets'] = await afacet_counts(queryset)
+    await sync_to_async(set_cached_page)(cache_key, data)
+    response = render_json(data)
+    response['X-Cache'] = 'MISS'
+    return response
+
+
+@async_endpoint(ProductDetailView)
+async def product_detail(view, request, pk):
+    queryset = view.get_queryset()
+    updated_at = await updated_at_query(queryset, {'pk': pk}).afirst()
+    etag, last_modified = conditional_validators(queryset.model, pk, updated_at)
+    if etag is not None:
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is not None:
+            return response
+
+    product = await queryset.aget(pk=pk)
+    response = render_json(view.get_serializer(product).data)
+    set_validators(response, etag, last_modified)
+    return response
+
+
+async def order_list(view, request):
+    orders = [order async for order in view.filter_queryset(view.get_queryset())]
+    return view.get_serializer(orders, many=True).data
+
+
+buyer_orders = async_endpoint(BuyerOrdersView)(order_list)
+farmer_orders = async_endpoint(FarmerOrdersView)(order_list)
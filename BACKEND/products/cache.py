@@ -0,0 +1,117 @@
+"""
+Response cache for the public marketplace.
+
+Entries are keyed by the catalog version, so invalidation is a single
+counter bump: every write to the catalog moves readers to fresh keys and the
+stale entries simply age out of the cache.
+
+The version is a row in the database (CatalogVersion), shared by every
+worker, so an edit reaches all of them; each process remembers it for
+``CATALOG_VERSION_TTL`` seconds to keep cache hits free of queries. Bumps
+are a single ``UPDATE ... RETURNING``, so concurrent ones are never lost.
+Only catalog edits bump it. Stock and sales counters change with
+every order and would otherwise empty the cache all day, so cached pages
+may show them up to ``MARKETPLACE_CACHE_TIMEOUT`` old; orders re-check
+stock when they are placed.
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+
+from .models import CatalogVersion
+
+CATALOG_VERSION_ID = 1
+HITS_KEY = 'marketplace:hits'
+MISSES_KEY = 'marketplace:misses'
+
+# (version, monotonic time it expires) as last seen by this process.
+_local_version = (None, 0)
+
+
+def _remember(version):
+    global _local_version
+    _local_version = (version, time.monotonic() + settings.CATALOG_VERSION_TTL)
+    return version
+
+
+def forget_catalog_version():
+    """
+    Drop this process' copy of the version, so the next read goes to the
+    shared cache.
+    """
+    global _local_version
+    _local_version = (None, 0)
+
+
+def get_catalog_version():
+    version, expires = _local_version
+    if version is not None and time.monotonic() < expires:
+        return version
+    version = CatalogVersion.objects.filter(pk=CATALOG_VERSION_ID).values_list('version', flat=True).first()
+    if version is None:
+        # Seeded by a migration; only a flushed database lacks the row.
+        # Seed from the clock so the counter never restarts at a number
+        # whose entries might still be cached.
+        version = CatalogVersion.objects.get_or_create(pk=CATALOG_VERSION_ID, defaults={'version': int(time.time() * 1000)})[0].version
+    return _remember(version)
+
+
+def _bump_catalog_version():
+    table = connection.ops.quote_name(CatalogVersion._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(f'UPDATE {table} SET version = version + 1 WHERE id = %s RETURNING version', [CATALOG_VERSION_ID])
+        row = cursor.fetchone()
+    if row is None:
+        forget_catalog_version()
+        get_catalog_version()
+    else:
+        _remember(row[0])
+
+
+def bump_catalog_version():
+    """
+    Invalidate every cached marketplace page once the current transaction
+    commits. Bumping earlier would let a concurrent reader cache the old rows
+    under the new version.
+    """
+    transaction.on_commit(_bump_catalog_version)
+
+
+def marketplace_cache_key(request):
+    # Pagination links are absolute, so the host is part of the key too.
+    url = f'{request.get_host()}{request.get_full_path()}'
+    digest = hashlib.sha1(url.encode('utf-8')).hexdigest()
+    return f'marketplace:{get_catalog_version()}:{digest}'
+
+
+def get_cached_page(key):
+    data = cache.get(key)
+    _increment(HITS_KEY if data is not None else MISSES_KEY)
+    return data
+
+
+def set_cached_page(key, data):
+    cache.set(key, data, timeout=settings.MARKETPLACE_CACHE_TIMEOUT)
+
+
+def _increment(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        if not cache.add(key, 1, timeout=None):
+            cache.incr(key)
+
+
+def cache_stats():
+    hits = cache.get(HITS_KEY, 0)
+    misses = cache.get(MISSES_KEY, 0)
+    lookups = hits + misses
+    return {
+        'version': get_catalog_version(),
+        'hits': hits,
+        'misses': misses,
+        'hit_ratio': round(hits / lookups, 4) if lookups else None,
+    }
@@ -0,0 +1,97 @@
+"""
+Streaming order exports.
+
+Orders are read with ``QuerySet.iterator(chunk_size=...)``, which on
+Postgres walks a server-side cursor and runs the queryset's
+``prefetch_related`` lookups once per chunk. Together with a generator
+body for ``StreamingHttpResponse`` this keeps a worker's memory bounded by
+one chunk of orders, however many the export covers.
+
+Django's ASGI handler buffers a sync streaming body whole (it consumes it
+with ``sync_to_async(list)``), so under ASGI the rows are handed over as
+an async iterator instead; see ``aiter_rows``.
+"""
+import csv
+import json
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+from rest_framework.utils.encoders import JSONEncoder
+
+CSV_HEADER = ['order_id', 'created_at', 'buyer_id', 'total_price', 'product_id', 'quantity', 'price']
+CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson',
+}
+
+
+class Echo:
+    """
+    File-like object whose ``write`` hands the value back, so ``csv.writer``
+    can format one row at a time for a streaming response.
+    """
+
+    def write(self, value):
+        return value
+
+
+def iter_orders(queryset, chunk_size):
+    return queryset.iterator(chunk_size=chunk_size)
+
+
+def order_total(order, subtotals):
+    return order.items_total() if subtotals else order.total_price
+
+
+def csv_rows(orders, subtotals=False):
+    """
+    Yield the CSV export: a header, then one line per order item. With
+    ``subtotals`` the total is that of the exported items only.
+    """
+    writer = csv.writer(Echo())
+    yield writer.writerow(CSV_HEADER)
+    for order in orders:
+        created_at = order.created_at.isoformat()
+        total = order_total(order, subtotals)
+        yield ''.join(
+            writer.writerow([order.id, created_at, order.buyer_id, total, item.product_id, item.quantity, item.price])
+            for item in order.items.all()
+        )
+
+
+def ndjson_rows(orders, subtotals=False):
+    """
+    Yield the NDJSON export: one JSON object per order, items nested. With
+    ``subtotals`` the total is that of the exported items only.
+    """
+    encoder = JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+    for order in orders:
+        yield encoder.encode({
+            'id': order.id,
+            'buyer': order.buyer_id,
+            'created_at': order.created_at,
+            'total_price': str(order_total(order, subtotals)),
+            'items': [
+                {'product': item.product_id, 'quantity': item.quantity, 'price': str(item.price)}
+                for item in order.items.all()
+            ],
+        }) + '\n'
+
+
+async def aiter_rows(rows, batch_size):
+    """
+    Async iterator over a sync row generator, ``batch_size`` rows at a time.
+
+    Each batch is produced by a thread-sensitive ``sync_to_async`` call, so
+    it runs in the request's worker thread, next to the connection that
+    holds the export's server-side cursor.
+    """
+    take = sync_to_async(lambda: list(islice(rows, batch_size)))
+    while batch := await take():
+        yield ''.join(batch)
+
+
+WRITERS = {
+    'csv': csv_rows,
+    'ndjson': ndjson_rows,
+}
@@ -0,0 +1,98 @@
+from django.db.models import Count, Q
+from rest_framework.filters import BaseFilterBackend
+
+from profiles.geo import covering_cells, distance_km
+from .models import Product
+from .serializers import MarketplaceFilterSerializer
+
+# Upper bounds are exclusive; None leaves the last bucket open-ended.
+PRICE_BUCKETS = [
+    (0, 500),
+    (500, 1000),
+    (1000, 5000),
+    (5000, None),
+]
+
+
+class MarketplaceFilterBackend(BaseFilterBackend):
+    """
+    Filter the catalog by category, price range, stock and farmer location.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        serializer = MarketplaceFilterSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        params = serializer.validated_data
+
+        if params.get('category'):
+            queryset = queryset.filter(category=params['category'])
+        if params.get('min_price') is not None:
+            queryset = queryset.filter(price__gte=params['min_price'])
+        if params.get('max_price') is not None:
+            queryset = queryset.filter(price__lte=params['max_price'])
+        if params.get('in_stock'):
+            queryset = queryset.filter(stock__gt=0)
+        if params.get('location'):
+            queryset = queryset.filter(farmer__farmer_profile__location__iexact=params['location'])
+        return queryset
+
+
+def price_bucket_filter(low, high):
+    if high is None:
+        return Q(price__gte=low)
+    return Q(price__gte=low, price__lt=high)
+
+
+def facet_counts(queryset):
+    """
+    Count products per category, price bucket and stock state.
+
+    Every facet is a filtered COUNT in a single aggregate, so the whole
+    facet block costs one scan of the filtered catalog.
+    """
+    return facets_from_counts(queryset.order_by().aggregate(**facet_aggregates()))
+
+
+async def afacet_counts(queryset):
+    return facets_from_counts(await queryset.order_by().aaggregate(**facet_aggregates()))
+
+
+def facet_aggregates():
+    aggregates = {
+        f'category_{key}': Count('id', filter=Q(category=key))
+        for key, _ in Product.FARMER_CHOICES
+    }
+    for index, (low, high) in enumerate(PRICE_BUCKETS):
+        aggregates[f'price_{index}'] = Count('id', filter=price_bucket_filter(low, high))
+    aggregates['in_stock'] = Count('id', filter=Q(stock__gt=0))
+    return aggregates
+
+
+def facets_from_counts(counts):
+    return {
+        'category': {key: counts[f'category_{key}'] for key, _ in Product.FARMER_CHOICES},
+        'price': [
+            {'min': low, 'max': high, 'count': counts[f'price_{index}']}
+            for index, (low, high) in enumerate(PRICE_BUCKETS)
+        ],
+        'in_stock': counts['in_stock'],
+    }
+
+
+def products_near(queryset, latitude, longitude, radius_km):
+    """
+    Narrow ``queryset`` to products whose farm lies within ``radius_km`` of
+    the point, annotated with ``distance_km``.
+
+    The geohash cells covering the circle are matched by prefix against the
+    farm profile's indexed geohash, so the exact distance is only computed
+    for farms in those few cells.
+    """
+    cells = Q()
+    for cell in covering_cells(latitude, longitude, radius_km):
+        cells |= Q(farmer__farmer_profile__geohash__startswith=cell)
+    distance = distance_km(
+        latitude, longitude,
+        'farmer__farmer_profile__latitude', 'farmer__farmer_profile__longitude',
+    )
+    return queryset.filter(cells).annotate(distance_km=distance).filter(distance_km__lte=radius_km)
@@ -0,0 +1,149 @@
+"""
+Product photos.
+
+Uploads are stored under the SHA-256 of their content, so the same photo
+uploaded for many listings (or many times) is kept once, and a stored file
+never changes under its name. That is what lets media be served with
+``Cache-Control: immutable``.
+
+Thumbnails are rendered by the shared background pool after the upload
+commits and are named after the original's hash and the thumbnail size, so
+they are deduplicated the same way. A failed render is not retried there;
+the ``regenerate_thumbnails`` command sweeps up photos left without any.
+Only thumbnails are ever exposed through the API; originals stay internal.
+"""
+import hashlib
+import logging
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from KUKUCONNECT.workers import submit_on_commit
+from .cache import bump_catalog_version
+from .models import Product
+
+logger = logging.getLogger(__name__)
+
+EXTENSIONS = {'JPEG': 'jpg', 'PNG': 'png', 'WEBP': 'webp', 'GIF': 'gif'}
+
+
+def content_name(prefix, digest, suffix):
+    # Fan out by the first two hex digits to keep directories small.
+    return f'{prefix}/{digest[:2]}/{digest}{suffix}'
+
+
+def store_original(upload):
+    """
+    Save an uploaded image under its content hash, unless that content is
+    already stored, and return the storage name.
+    """
+    sha256 = hashlib.sha256()
+    for chunk in upload.chunks():
+        sha256.update(chunk)
+    upload.seek(0)
+    with Image.open(upload) as image:
+        extension = EXTENSIONS.get(image.format, 'img')
+    upload.seek(0)
+
+    name = content_name('products/originals', sha256.hexdigest(), f'.{extension}')
+    if not default_storage.exists(name):
+        saved = default_storage.save(name, upload)
+        if saved != name:
+            # Another upload of the same bytes won the race; keep one copy.
+            default_storage.delete(saved)
+    return name
+
+
+def render_thumbnail(image, size):
+    thumbnail = ImageOps.exif_transpose(image)
+    if thumbnail.mode not in ('RGB', 'RGBA'):
+        thumbnail = thumbnail.convert('RGBA' if 'transparency' in image.info else 'RGB')
+    thumbnail.thumbnail((size, size))
+    buffer = BytesIO()
+    thumbnail.save(buffer, 'WEBP', quality=settings.THUMBNAIL_QUALITY)
+    return ContentFile(buffer.getvalue())
+
+
+def make_thumbnails(original):
+    """
+    Render every size in ``THUMBNAIL_SIZES`` for a stored original and
+    return ``{size label: storage name}``. Sizes that already exist, from an
+    earlier upload of the same photo, are reused.
+    """
+    digest = original.rsplit('/', 1)[-1].split('.', 1)[0]
+    thumbnails = {}
+    image = None
+    try:
+        for label, size in settings.THUMBNAIL_SIZES.items():
+            name = content_name('products/thumbnails', digest, f'-{size}.webp')
+            if not default_storage.exists(name):
+                if image is None:
+                    with default_storage.open(original) as handle:
+                        image = Image.open(handle)
+                        image.load()
+                default_storage.save(name, render_thumbnail(image, size))
+            thumbnails[label] = name
+    finally:
+        if image is not None:
+            image.close()
+    return thumbnails
+
+
+def generate_product_thumbnails(product_id, original):
+    """
+    Background task: render thumbnails for ``original`` and attach them to
+    the product, unless a newer photo replaced it in the meantime.
+    """
+    thumbnails = make_thumbnails(original)
+    updated = Product.objects.filter(pk=product_id, image=original).update(
+        thumbnails=thumbnails, updated_at=timezone.now(),
+    )
+    if updated:
+        # update() skips post_save, so invalidate cached listings here.
+        bump_catalog_version()
+
+
+def regenerate_missing_thumbnails(older_than, batch_size=500):
+    """
+    Render the thumbnails of every product whose photo, set before
+    ``older_than``, still has none. Returns ``(regenerated, failed)``.
+    """
+    missing = Product.objects.filter(thumbnails={}, updated_at__lt=older_than).exclude(image='').order_by('pk')
+    regenerated = failed = 0
+    last_id = 0
+    while batch := list(missing.filter(pk__gt=last_id).values_list('pk', 'image')[:batch_size]):
+        for product_id, original in batch:
+            try:
+                generate_product_thumbnails(product_id, original)
+            except Exception:
+                logger.exception('Could not render thumbnails of product %s from %s', product_id, original)
+                failed += 1
+            else:
+                regenerated += 1
+        last_id = batch[-1][0]
+    return regenerated, failed
+
+
+def set_product_image(product, upload):
+    """
+    Store ``upload`` as the product's photo and queue its thumbnails.
+
+    The old thumbnails are cleared straight away so listings never pair the
+    new photo's product with the previous photo's thumbnails.
+    """
+    product.image = store_original(upload)
+    product.thumbnails = {}
+    product.save(update_fields=['image', 'thumbnails', 'updated_at'])
+    submit_on_commit(generate_product_thumbnails, product.pk, product.image)
+    return product
+
+
+def thumbnail_urls(thumbnails):
+    return {
+        label: default_storage.url(thumbnails[label])
+        for label in settings.THUMBNAIL_SIZES if label in thumbnails
+    }
@@ -0,0 +1,145 @@
+"""
+Bulk product import from CSV or NDJSON streams.
+
+Records are read lazily from the source, validated in chunks with the same
+field rules as ``ProductSerializer`` and inserted with one ``bulk_create``
+per chunk, so memory stays flat however large the upload is. Invalid rows
+are reported with their row number and skipped; they never abort the rows
+around them. Only the first ``MAX_REPORTED_ERRORS`` are detailed, so a
+file of bad rows cannot grow the report without bound; the count of
+rejected rows is always exact.
+"""
+import codecs
+import csv
+import json
+from itertools import islice
+
+from django.db import transaction
+from rest_framework import serializers
+
+from KUKUCONNECT.workers import submit_on_commit
+from .cache import bump_catalog_version
+from .models import Product
+from .recommendations import index_products
+from .serializers import ProductSerializer
+
+CSV = 'csv'
+NDJSON = 'ndjson'
+FORMATS = (CSV, NDJSON)
+CONTENT_TYPES = {
+    'text/csv': CSV,
+    'application/x-ndjson': NDJSON,
+    'application/ndjson': NDJSON,
+}
+DEFAULT_CHUNK_SIZE = 500
+MAX_REPORTED_ERRORS = 1000
+INVALID_UTF8 = 'Not valid UTF-8 text.'
+
+
+def decode_lines(stream):
+    """
+    Iterate over the text lines of a binary file-like object.
+
+    Bytes that are not valid UTF-8 are kept as lone surrogates (see
+    ``is_undecodable``) so the row holding them can be reported on its own
+    instead of the whole upload failing part way through.
+    """
+    return codecs.iterdecode(stream, 'utf-8-sig', errors='surrogateescape')
+
+
+def is_undecodable(text):
+    return any('\udc80' <= character <= '\udcff' for character in text)
+
+
+def iter_csv_records(lines):
+    """
+    Yield ``(row_number, record)`` pairs from CSV text with a header row.
+    Row numbers count the header as row 1, as spreadsheets do. Rows that
+    are not valid UTF-8 or have more fields than the header yield an error
+    string instead of a record.
+    """
+    reader = csv.DictReader(lines)
+    for number, record in enumerate(reader, start=2):
+        if None in record:
+            yield number, f'Expected {len(reader.fieldnames)} columns, got {len(reader.fieldnames) + len(record[None])}.'
+        elif any(is_undecodable(value) for value in [*record, *record.values()] if value):
+            yield number, INVALID_UTF8
+        else:
+            yield number, record
+
+
+def iter_ndjson_records(lines):
+    """
+    Yield ``(line_number, record)`` pairs from newline-delimited JSON.
+    Blank lines are skipped; malformed lines yield an error string instead
+    of a record.
+    """
+    for number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        if is_undecodable(line):
+            yield number, INVALID_UTF8
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            yield number, 'Invalid JSON.'
+            continue
+        if not isinstance(record, dict):
+            yield number, 'Expected a JSON object.'
+            continue
+        yield number, record
+
+
+def iter_records(stream, fmt):
+    lines = decode_lines(stream)
+    if fmt == CSV:
+        return iter_csv_records(lines)
+    return iter_ndjson_records(lines)
+
+
+def import_products(farmer, records, chunk_size=DEFAULT_CHUNK_SIZE, max_errors=MAX_REPORTED_ERRORS):
+    """
+    Validate and insert ``(row_number, record)`` pairs for ``farmer``.
+
+    Returns ``{'created': int, 'failed': int, 'errors': [...]}`` where each
+    of the first ``max_errors`` rejected rows has an error
+    ``{'row': row_number, 'errors': {...}}``. Each chunk is inserted in its
+    own transaction, so rows already imported stay in place if a later
+    chunk hits a database error.
+    """
+    serializer = ProductSerializer()
+    created = failed = 0
+    errors = []
+
+    def reject(number, detail):
+        nonlocal failed
+        failed += 1
+        if len(errors) < max_errors:
+            errors.append({'row': number, 'errors': detail})
+
+    records = iter(records)
+    while True:
+        chunk = list(islice(records, chunk_size))
+        if not chunk:
+            break
+        products = []
+        for number, record in chunk:
+            if isinstance(record, str):
+                reject(number, {'non_field_errors': [record]})
+                continue
+            try:
+                validated = serializer.run_validation(record)
+            except serializers.ValidationError as exc:
+                reject(number, exc.detail)
+                continue
+            products.append(Product(farmer=farmer, **validated))
+        if products:
+            with transaction.atomic():
+                Product.objects.bulk_create(products)
+                # bulk_create skips post_save, so invalidate the cache and
+                # index the new products here.
+                bump_catalog_version()
+                submit_on_commit(index_products, [product.pk for product in products])
+            created += len(products)
+    return {'created': created, 'failed': failed, 'errors': errors}
@@ -0,0 +1,36 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from products.importers import CSV, DEFAULT_CHUNK_SIZE, FORMATS, import_products, iter_records
+
+
+class Command(BaseCommand):
+    help = "Bulk import products for a farmer from a CSV or NDJSON file."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File to import; the format is taken from its extension unless --format is given.')
+        parser.add_argument('--farmer', required=True, help='Username of the farmer who will own the products.')
+        parser.add_argument('--format', choices=FORMATS, dest='fmt')
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        try:
+            farmer = get_user_model().objects.get(username=options['farmer'])
+        except get_user_model().DoesNotExist:
+            raise CommandError(f"No user named {options['farmer']!r}.")
+
+        fmt = options['fmt']
+        if fmt is None:
+            extension = options['path'].rsplit('.', 1)[-1].lower()
+            fmt = extension if extension in FORMATS else CSV
+
+        with open(options['path'], 'rb') as stream:
+            result = import_products(farmer, iter_records(stream, fmt), chunk_size=options['chunk_size'])
+
+        for error in result['errors']:
+            self.stderr.write(f"Row {error['row']}: {error['errors']}")
+        if result['failed'] > len(result['errors']):
+            self.stderr.write(f"... and {result['failed'] - len(result['errors'])} more rejected row(s).")
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {result['created']} product(s); {result['failed']} row(s) rejected."
+        ))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from products.rollups import rebuild_sales_rollups
+
+
+class Command(BaseCommand):
+    help = "Recompute the farmer daily sales rollups from the order tables."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--farmer', type=int, action='append', dest='farmers', help='Only rebuild this farmer id (repeatable).')
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        written = rebuild_sales_rollups(farmer_ids=options['farmers'], batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Wrote {written} farmer/product/day rollup row(s)."))
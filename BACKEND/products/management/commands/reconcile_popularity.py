@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from products.rollups import reconcile_product_popularity
+
+
+class Command(BaseCommand):
+    help = "Recompute products' units_sold and order_count from the order items."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        fixed = reconcile_product_popularity(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Corrected the popularity counters of {fixed} product(s)."))
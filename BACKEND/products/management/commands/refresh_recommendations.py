@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from products.recommendations import rebuild_product_index, refresh_recommendations
+
+
+class Command(BaseCommand):
+    help = "Recompute buyers' stored product recommendations."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--buyer', type=int, action='append', dest='buyers', help='Only refresh this buyer user id (repeatable).')
+        parser.add_argument('--reindex', action='store_true', help='Index every product first, e.g. after deploying.')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        if options['reindex']:
+            indexed = rebuild_product_index()
+            self.stdout.write(f"Indexed {indexed} product(s).")
+        refreshed = refresh_recommendations(buyer_ids=options['buyers'], batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Refreshed the recommendations of {refreshed} buyer(s)."))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from products.trending import prune_trending, rebuild_trending
+
+
+class Command(BaseCommand):
+    help = "Drop trend scores of products that stopped selling, or rebuild them all from recent orders."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true', help='recompute every score from the orders in the window')
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            scored = rebuild_trending()
+            self.stdout.write(self.style.SUCCESS(f"Rebuilt the trend scores of {scored} product(s)."))
+        else:
+            pruned = prune_trending()
+            self.stdout.write(self.style.SUCCESS(f"Pruned the trend scores of {pruned} product(s)."))
@@ -0,0 +1,22 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from products.images import regenerate_missing_thumbnails
+
+
+class Command(BaseCommand):
+    help = "Render thumbnails for product photos whose background render failed."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--older-than', type=int, default=10,
+            help='minutes since the photo was set, leaving renders still queued alone',
+        )
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        older_than = timezone.now() - timedelta(minutes=options['older_than'])
+        regenerated, failed = regenerate_missing_thumbnails(older_than, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Rendered thumbnails for {regenerated} product(s), {failed} failed."))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from products.reservations import release_expired_reservations
+
+
+class Command(BaseCommand):
+    help = "Put stock held by expired, unpaid order reservations back on sale."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        total = 0
+        while True:
+            restocked = release_expired_reservations(limit=options['batch_size'])
+            if not restocked:
+                break
+            total += restocked
+        self.stdout.write(self.style.SUCCESS(f"Restocked {total} product(s) from expired reservations."))
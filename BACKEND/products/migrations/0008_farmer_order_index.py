@@ -0,0 +1,55 @@
+# Generated by Django 5.2.7 on 2026-10-18 15:13
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def backfill_farmer_orders(apps, schema_editor):
+    Product = apps.get_model('products', 'Product')
+    OrderItem = apps.get_model('products', 'OrderItem')
+    FarmerOrder = apps.get_model('products', 'FarmerOrder')
+
+    OrderItem.objects.update(farmer_id=Subquery(
+        Product.objects.filter(pk=OuterRef('product_id')).values('farmer_id')[:1]
+    ))
+    links = (
+        OrderItem.objects.values_list('farmer_id', 'order_id', 'order__created_at')
+        .distinct().iterator(chunk_size=2000)
+    )
+    FarmerOrder.objects.bulk_create(
+        (FarmerOrder(farmer_id=farmer_id, order_id=order_id, created_at=created_at)
+         for farmer_id, order_id, created_at in links),
+        batch_size=2000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0007_stockreservation'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='orderitem',
+            name='farmer',
+            field=models.ForeignKey(editable=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='sold_items', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.CreateModel(
+            name='FarmerOrder',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField()),
+                ('farmer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='order_links', to=settings.AUTH_USER_MODEL)),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='farmer_links', to='products.order')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['farmer', '-created_at', '-order'], name='farmerorder_farmer_created_idx')],
+                'constraints': [models.UniqueConstraint(fields=('farmer', 'order'), name='unique_farmer_order')],
+            },
+        ),
+        migrations.RunPython(backfill_farmer_orders, migrations.RunPython.noop),
+    ]
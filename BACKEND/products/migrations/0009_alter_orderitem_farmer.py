@@ -0,0 +1,23 @@
+# Generated by Django 5.2.7 on 2026-10-18 15:13
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # Separate from the backfill in 0008: Postgres refuses to alter a table
+    # with deferred FK checks still pending in the same transaction.
+
+    dependencies = [
+        ('products', '0008_farmer_order_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='orderitem',
+            name='farmer',
+            field=models.ForeignKey(editable=False, on_delete=django.db.models.deletion.CASCADE, related_name='sold_items', to=settings.AUTH_USER_MODEL),
+        ),
+    ]
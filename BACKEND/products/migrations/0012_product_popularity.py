@@ -0,0 +1,36 @@
+# Generated by Django 5.2.7 on 2026-10-18 15:40
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_popularity(apps, schema_editor):
+    # Raw SQL over the tables as they are at this point in history.
+    from products.rollups import reconcile_product_popularity
+    reconcile_product_popularity()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0011_product_image'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='order_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='units_sold',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['-units_sold', '-order_count', '-id'], name='product_popular_idx'),
+        ),
+        migrations.RunPython(backfill_popularity, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.7 on 2026-10-18 15:45
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill_trending(apps, schema_editor):
+    # Raw SQL over the tables as they are at this point in history.
+    from products.trending import rebuild_trending
+    rebuild_trending()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0012_product_popularity'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductTrend',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='trend', serialize=False, to='products.product')),
+                ('category', models.CharField(choices=[('weight', 'By Weight'), ('number', 'By Number')], max_length=10)),
+                ('log_score', models.FloatField()),
+                ('updated_at', models.DateTimeField()),
+            ],
+            options={
+                'indexes': [models.Index(fields=['category', '-log_score'], name='trend_category_score_idx'), models.Index(fields=['updated_at'], name='trend_updated_idx')],
+            },
+        ),
+        migrations.RunPython(backfill_trending, migrations.RunPython.noop),
+    ]
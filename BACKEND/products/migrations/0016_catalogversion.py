@@ -0,0 +1,28 @@
+import time
+
+from django.db import migrations, models
+
+
+def seed_version(apps, schema_editor):
+    # Seed from the clock so the new counter never restarts at a number whose
+    # marketplace pages might still be cached.
+    CatalogVersion = apps.get_model('products', 'CatalogVersion')
+    CatalogVersion.objects.using(schema_editor.connection.alias).create(pk=1, version=int(time.time() * 1000))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0015_order_paid_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.BigIntegerField()),
+            ],
+        ),
+        migrations.RunPython(seed_version, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,112 @@
+from django.core.handlers.asgi import ASGIRequest
+from django.http import StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from rest_framework.exceptions import NotFound
+
+from .exports import CONTENT_TYPES, WRITERS, aiter_rows, iter_orders
+from .serializers import ProductSerializer, ProductRowSerializer
+
+
+def updated_at_query(queryset, lookup):
+    """
+    The ``updated_at`` of the object matching ``lookup``, as a bare
+    ``values_list`` query (call ``first()``/``afirst()`` on it).
+    """
+    return (
+        queryset.filter(**lookup)
+        .select_related(None)
+        .prefetch_related(None)
+        .values_list('updated_at', flat=True)
+    )
+
+
+def conditional_validators(model, pk, updated_at):
+    """
+    Return the ``(ETag, Last-Modified timestamp)`` of an object, or
+    ``(None, None)`` when it does not exist.
+    """
+    if updated_at is None:
+        return None, None
+    etag = quote_etag(f'{model._meta.label_lower}-{pk}-{updated_at.timestamp()}')
+    return f'W/{etag}', int(updated_at.timestamp())
+
+
+def set_validators(response, etag, last_modified):
+    if etag is not None:
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+
+
+class ConditionalRetrieveMixin:
+    """
+    Answer ``If-None-Match`` / ``If-Modified-Since`` from ``updated_at``.
+
+    The validators come from a ``values_list('updated_at')`` lookup on the
+    view's own (access-controlled) queryset, so an unchanged object is
+    answered with a 304 without loading the model or running the serializer.
+    """
+
+    def get_validators(self):
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        lookup = {self.lookup_field: self.kwargs[lookup_url_kwarg]}
+        updated_at = updated_at_query(self.filter_queryset(self.get_queryset()), lookup).first()
+        return conditional_validators(self.get_queryset().model, self.kwargs[lookup_url_kwarg], updated_at)
+
+    def retrieve(self, request, *args, **kwargs):
+        etag, last_modified = self.get_validators()
+        if etag is not None:
+            response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+            if response is not None:
+                return response
+
+        # Unknown objects fall through so the usual 404 is raised.
+        response = super().retrieve(request, *args, **kwargs)
+        set_validators(response, etag, last_modified)
+        return response
+
+
+class ProductRowsMixin:
+    """
+    List products through the ProductRowSerializer fast path.
+
+    Filtering is the last step before pagination and serialization, so the
+    filtered queryset is turned into ``values()`` rows there.
+    """
+
+    def filter_queryset(self, queryset):
+        # The keyset paginator reads the cursor position from the rows.
+        ordering = [field.lstrip('-') for field in getattr(self, 'keyset_ordering', ())]
+        return ProductRowSerializer.rows(super().filter_queryset(queryset), *ordering)
+
+    def get_serializer_class(self):
+        if getattr(self, 'swagger_fake_view', False):
+            # The schema is documented from the equivalent ModelSerializer.
+            return ProductSerializer
+        return ProductRowSerializer
+
+
+class OrderExportMixin:
+    """
+    Turn an order list view into a streaming CSV/NDJSON download of its
+    whole queryset. The format comes from the ``fmt`` URL kwarg.
+
+    Served over ASGI the body is an async iterator, which the handler
+    streams; a sync one would be read into memory first.
+    """
+    export_chunk_size = 500
+    export_filename = 'orders'
+    # Export each order's total over the listed items only (see exports.py).
+    export_subtotals = False
+
+    def get(self, request, *args, **kwargs):
+        fmt = kwargs['fmt']
+        if fmt not in WRITERS:
+            raise NotFound(f'Unsupported export format {fmt!r}.')
+        orders = iter_orders(self.filter_queryset(self.get_queryset()), self.export_chunk_size)
+        rows = WRITERS[fmt](orders, subtotals=self.export_subtotals)
+        if isinstance(request._request, ASGIRequest):
+            rows = aiter_rows(rows, self.export_chunk_size)
+        response = StreamingHttpResponse(rows, content_type=CONTENT_TYPES[fmt])
+        response['Content-Disposition'] = f'attachment; filename="{self.export_filename}.{fmt}"'
+        return response
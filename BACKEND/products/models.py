@@ -1,5 +1,10 @@
+from decimal import Decimal
+
 from django.db import models
+from django.db.models import Q
 from django.conf import settings
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 
 class Product(models.Model):
     FARMER_CHOICES = [
@@ -18,6 +23,34 @@ class Product(models.Model):
     stock = models.PositiveIntegerField()  # e.g., weight in kg or count of chickens
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # Weighted title/description document, maintained by a database trigger
+    # (see migration 0005) so bulk inserts and updates keep it current too.
+    search_vector = SearchVectorField(null=True, editable=False)
+    # Content-addressed storage name of the uploaded photo (never exposed),
+    # and {size label: storage name} of its thumbnails once rendered.
+    image = models.CharField(max_length=255, blank=True, default='', editable=False)
+    thumbnails = models.JSONField(default=dict, blank=True, editable=False)
+    # Popularity counters, kept up to date by place_order (see rollups.py).
+    units_sold = models.PositiveIntegerField(default=0, editable=False)
+    order_count = models.PositiveIntegerField(default=0, editable=False)
+
+    class Meta:
+        indexes = [
+            # Backs the (created_at, id) keyset used to paginate the catalog.
+            models.Index(fields=['-created_at', '-id'], name='product_created_id_idx'),
+            # Marketplace filter combinations: category paging, category with
+            # a price range, and the in-stock-only listing.
+            models.Index(fields=['category', '-created_at', '-id'], name='product_category_created_idx'),
+            models.Index(fields=['category', 'price'], name='product_category_price_idx'),
+            models.Index(
+                fields=['-created_at', '-id'],
+                condition=Q(stock__gt=0),
+                name='product_in_stock_created_idx',
+            ),
+            GinIndex(fields=['search_vector'], name='product_search_vector_idx'),
+            # Keyset for the marketplace's ?ordering=popular.
+            models.Index(fields=['-units_sold', '-order_count', '-id'], name='product_popular_idx'),
+        ]
 
     def __str__(self):
         return self.title
@@ -27,16 +60,194 @@ class Order(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     total_price = models.DecimalField(max_digits=10, decimal_places=2,default=0.0)
+    # Set when an M-Pesa payment for the order succeeds (see payments/callbacks.py).
+    paid_at = models.DateTimeField(null=True, blank=True, editable=False)
+
+    class Meta:
+        indexes = [
+            # Reconciliation reads recently paid orders; unpaid ones stay out.
+            models.Index(fields=['paid_at'], name='order_paid_at_idx', condition=Q(paid_at__isnull=False)),
+        ]
 
     def __str__(self):
         return f"Order {self.id} by {self.buyer.username}"
 
+    def items_total(self):
+        """
+        Sum of the loaded items' prices. With items prefetched for a single
+        farmer, that farmer's share of the order.
+        """
+        return sum((item.price for item in self.items.all()), Decimal('0'))
+
 class OrderItem(models.Model):
     order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='items')
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    # Copy of product.farmer, so a farmer's line items can be read without
+    # joining through products.
+    farmer = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='sold_items', editable=False)
     quantity = models.PositiveIntegerField()
     price = models.DecimalField(max_digits=10, decimal_places=2)  # Ensure price field is included
 
     def save(self, *args, **kwargs):
         self.price = self.product.price * self.quantity  # Set the price based on product price and quantity
-        super().save(*args, **kwargs)
\ No newline at end of file
+        self.farmer_id = self.product.farmer_id
+        super().save(*args, **kwargs)
+        FarmerOrder.objects.get_or_create(
+            farmer_id=self.farmer_id, order_id=self.order_id,
+            defaults={'created_at': self.order.created_at},
+        )
+
+
+class FarmerOrder(models.Model):
+    """
+    Link from a farmer to every order containing one of their products.
+
+    Written alongside the order items, it turns a farmer's order history into
+    a range scan on (farmer, created_at) instead of a join through items and
+    products followed by DISTINCT.
+    """
+    farmer = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='order_links')
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='farmer_links')
+    created_at = models.DateTimeField()  # Copy of order.created_at
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['farmer', 'order'], name='unique_farmer_order'),
+        ]
+        indexes = [
+            models.Index(fields=['farmer', '-created_at', '-order'], name='farmerorder_farmer_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"Order {self.order_id} for farmer {self.farmer_id}"
+
+class StockReservation(models.Model):
+    """
+    Stock taken off a product for an order until it is paid for.
+
+    Held reservations that pass ``expires_at`` are released and their
+    quantity goes back on the shelf (see ``products.reservations``).
+    """
+    HELD = 'held'
+    COMMITTED = 'committed'
+    RELEASED = 'released'
+    STATUS_CHOICES = [
+        (HELD, 'Held'),
+        (COMMITTED, 'Committed'),
+        (RELEASED, 'Released'),
+    ]
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='reservations')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='reservations')
+    quantity = models.PositiveIntegerField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=HELD)
+    expires_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['expires_at'], condition=Q(status='held'), name='reservation_held_expiry_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.quantity} x {self.product_id} for order {self.order_id} ({self.status})"
+
+
+class FarmerDailySales(models.Model):
+    """
+    Per farmer, product and day sales totals, kept up to date as orders are
+    placed (see ``products.rollups``) so dashboards never aggregate orders.
+    """
+    farmer = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='daily_product_sales')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='daily_sales')
+    day = models.DateField()
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    units = models.PositiveIntegerField(default=0)
+    orders = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['farmer', 'product', 'day'], name='unique_farmer_product_day'),
+        ]
+        indexes = [
+            models.Index(fields=['farmer', 'day'], name='dailysales_farmer_day_idx'),
+        ]
+
+
+class FarmerDailyTotals(models.Model):
+    """
+    Per farmer and day totals. Kept apart from FarmerDailySales because an
+    order holding several of a farmer's products counts once here.
+    """
+    farmer = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='daily_sales_totals')
+    day = models.DateField()
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    units = models.PositiveIntegerField(default=0)
+    orders = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['farmer', 'day'], name='unique_farmer_day'),
+        ]
+
+
+class ProductTrend(models.Model):
+    """
+    Time-decayed sales score of a recently sold product (see trending.py).
+
+    ``log_score`` is ``ln(sum(quantity * e^(t / tau)))`` over the product's
+    sales, with ``t`` in seconds since the Unix epoch. Every product decays at
+    the same rate, so ordering by it ranks by the decayed score without
+    rewriting any rows as time passes. ``category`` is copied from the
+    product so a category's top products are one index range.
+    """
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name='trend')
+    category = models.CharField(max_length=10, choices=Product.FARMER_CHOICES)
+    log_score = models.FloatField()
+    updated_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['category', '-log_score'], name='trend_category_score_idx'),
+            models.Index(fields=['updated_at'], name='trend_updated_idx'),
+        ]
+
+
+class ProductTerm(models.Model):
+    """
+    Inverted index of product text for recommendations: how often a stemmed
+    term occurs in a product's title and description (see recommendations.py).
+    """
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='terms')
+    term = models.CharField(max_length=64)
+    count = models.PositiveIntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'term'], name='unique_product_term'),
+        ]
+        indexes = [
+            models.Index(fields=['term'], name='productterm_term_idx'),
+        ]
+
+
+class BuyerRecommendation(models.Model):
+    """
+    A buyer's precomputed top products, best first by ``rank``.
+    """
+    buyer = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='recommendations')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='recommendations')
+    rank = models.PositiveSmallIntegerField()
+    score = models.FloatField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['buyer', 'rank'], name='unique_buyer_rank'),
+        ]
+
+
+class CatalogVersion(models.Model):
+    """
+    The marketplace cache's version (see cache.py): a single row, bumped by
+    one atomic UPDATE so concurrent edits never lose an increment.
+    """
+    version = models.BigIntegerField()
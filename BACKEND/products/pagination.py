@@ -0,0 +1,171 @@
+import json
+from base64 import b64decode, b64encode
+from collections import namedtuple
+
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination, _reverse_ordering
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+Cursor = namedtuple('Cursor', ['reverse', 'position'])
+
+
+def keyset_filter(ordering, position, reverse=False):
+    """
+    Build the WHERE clause selecting rows strictly after ``position``.
+
+    For an ordering of ``('-created_at', '-id')`` this is the expanded form of
+    the row comparison ``(created_at, id) < (%s, %s)``. Postgres cannot turn
+    the expanded OR into an index bound by itself, so it is prefixed with an
+    inclusive bound on the leading column (``created_at <= %s``); that is the
+    Index Cond which makes each page a range scan on the matching composite
+    index. Unlike a literal row comparison this also works for orderings
+    that mix directions.
+    """
+    condition = Q()
+    equal = Q()
+    for field, value in zip(ordering, position):
+        descending = field.startswith('-')
+        name = field.lstrip('-')
+        lookup = 'lt' if descending != reverse else 'gt'
+        condition |= equal & Q(**{f'{name}__{lookup}': value})
+        equal &= Q(**{name: value})
+    if len(ordering) > 1:
+        field, value = ordering[0], position[0]
+        lookup = 'lte' if field.startswith('-') != reverse else 'gte'
+        condition = Q(**{f'{field.lstrip("-")}__{lookup}': value}) & condition
+    return condition
+
+
+class KeysetPagination(CursorPagination):
+    """
+    Cursor pagination over a unique composite ordering.
+
+    DRF's CursorPagination only encodes the first ordering field and falls
+    back to an OFFSET for rows that tie on it. Here the cursor carries the
+    value of every ordering field, so each page is a single index range scan
+    and costs the same however deep the client scrolls. No COUNT(*) is issued.
+
+    The last ordering field must be unique (normally ``id``).
+    """
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    ordering = ('-created_at', '-id')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return self.set_page(list(self.page_queryset(queryset, request, view)))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """
+        Async counterpart of ``paginate_queryset`` for async views.
+        """
+        return self.set_page([row async for row in self.page_queryset(queryset, request, view)])
+
+    def page_queryset(self, queryset, request, view=None):
+        """
+        Return the (unevaluated) query for the requested page.
+        """
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.cursor = self.decode_cursor(request)
+
+        self.reverse = self.cursor is not None and self.cursor.reverse
+        if self.cursor is not None:
+            position = self.to_python(queryset, self.cursor.position)
+            queryset = queryset.filter(keyset_filter(self.ordering, position, self.reverse))
+        if self.reverse:
+            queryset = queryset.order_by(*_reverse_ordering(self.ordering))
+        else:
+            queryset = queryset.order_by(*self.ordering)
+
+        # Fetch one extra row to find out whether there is a following page.
+        return queryset[:self.page_size + 1]
+
+    def set_page(self, results):
+        has_more = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        if self.reverse:
+            self.page.reverse()
+
+        if self.reverse:
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, self.cursor is not None
+        return self.page
+
+    def get_ordering(self, request, queryset, view):
+        return tuple(getattr(view, 'keyset_ordering', self.ordering))
+
+    def get_position(self, row):
+        """
+        Return the ordering values of a model instance or a ``values()`` row.
+        """
+        names = [field.lstrip('-') for field in self.ordering]
+        if isinstance(row, dict):
+            return [row[name] for name in names]
+        return [getattr(row, name) for name in names]
+
+    def to_python(self, queryset, position):
+        """
+        Convert cursor values back to Python using the ordering fields, which
+        may be model fields or annotations such as a search rank.
+        """
+        values = []
+        try:
+            for field, value in zip(self.ordering, position):
+                name = field.lstrip('-')
+                if name in queryset.query.annotations:
+                    output_field = queryset.query.annotations[name].output_field
+                else:
+                    output_field = queryset.model._meta.get_field(name)
+                values.append(output_field.to_python(value))
+        except (DjangoValidationError, TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if None in values:
+            # e.g. '' for a datetime; NULL cannot bound a keyset.
+            raise NotFound(self.invalid_cursor_message)
+        return values
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        if not self.page:
+            # Paging backwards past the first row: restart from the top.
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(Cursor(reverse=False, position=self.get_position(self.page[-1])))
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return None
+        return self.encode_cursor(Cursor(reverse=True, position=self.get_position(self.page[0])))
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            data = json.loads(b64decode(encoded.encode('ascii')).decode('ascii'))
+            reverse = bool(data['r'])
+            position = data['p']
+        except (TypeError, ValueError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(position, list) or len(position) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        # encode_cursor only writes ints and strings.
+        if any(isinstance(value, bool) or not isinstance(value, (int, str)) for value in position):
+            raise NotFound(self.invalid_cursor_message)
+        return Cursor(reverse=reverse, position=position)
+
+    def encode_cursor(self, cursor):
+        data = {
+            'r': int(cursor.reverse),
+            'p': [value if isinstance(value, int) else str(value) for value in cursor.position],
+        }
+        encoded = b64encode(json.dumps(data, separators=(',', ':')).encode('ascii')).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
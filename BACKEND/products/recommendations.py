@@ -0,0 +1,250 @@
+"""
+Product recommendations from buyers' ``preferred_products``.
+
+Product titles and descriptions are tokenized and stemmed with nltk into
+ProductTerm, an inverted index of (product, term, count). A product's rows
+are rewritten whenever the product is saved, so the index never needs a
+full rebuild.
+
+``refresh_recommendations`` runs offline (see the command of the same name)
+or in the background when a buyer profile changes. It loads the index into
+NumPy arrays, weighs it with TF-IDF, scores each batch of buyers against the
+in-stock products sharing a term with them, a block of products at a time,
+and stores each buyer's top ``RECOMMENDATIONS_PER_BUYER`` in
+BuyerRecommendation, which the endpoint reads in a single query.
+
+Background refreshes for single buyers reuse the index this process loaded
+last, for up to ``RECOMMENDATION_INDEX_TTL`` seconds or until
+``index_products`` rewrites part of it.
+"""
+import threading
+import time
+from collections import Counter
+from functools import lru_cache
+from itertools import islice
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from nltk.stem import PorterStemmer
+from nltk.tokenize import RegexpTokenizer
+
+from profiles.models import BuyerProfile
+from .models import BuyerRecommendation, Product, ProductTerm
+
+tokenizer = RegexpTokenizer(r'[a-z]+')
+stemmer = PorterStemmer()
+STOP_WORDS = frozenset(
+    'a an and are as at be but by for from has have in is it its of on or our per so that the their '
+    'this to was we were will with you your'.split()
+)
+
+
+# (index, monotonic time it expires) as last loaded by this process.
+_cached_index = (None, 0)
+_cached_index_lock = threading.Lock()
+
+
+@lru_cache(maxsize=50000)
+def stem(word):
+    return stemmer.stem(word)
+
+
+def tokenize(text):
+    """
+    Term counts of ``text``: lowercase words, stop words dropped, stemmed.
+    """
+    return Counter(
+        stem(word) for word in tokenizer.tokenize((text or '').lower())
+        if len(word) > 1 and word not in STOP_WORDS
+    )
+
+
+def product_terms(title, description):
+    # Titles count twice, as they weigh more in search too.
+    return tokenize(f'{title} {title} {description}')
+
+
+def index_products(product_ids):
+    """
+    Rewrite the index rows of ``product_ids``; deleted products are skipped.
+    """
+    product_ids = list(product_ids)
+    postings = [
+        ProductTerm(product_id=product_id, term=term[:ProductTerm._meta.get_field('term').max_length], count=count)
+        for product_id, title, description in Product.objects.filter(pk__in=product_ids).values_list('id', 'title', 'description')
+        for term, count in product_terms(title, description).items()
+    ]
+    with transaction.atomic():
+        ProductTerm.objects.filter(product_id__in=product_ids).delete()
+        ProductTerm.objects.bulk_create(postings, batch_size=1000, ignore_conflicts=True)
+        transaction.on_commit(forget_index)
+
+
+def rebuild_product_index(batch_size=1000):
+    """
+    Index every product, ``batch_size`` at a time. Returns the product count.
+    """
+    indexed = 0
+    product_ids = Product.objects.order_by('pk').values_list('pk', flat=True).iterator(chunk_size=batch_size)
+    while batch := list(islice(product_ids, batch_size)):
+        index_products(batch)
+        indexed += len(batch)
+    return indexed
+
+
+def load_index():
+    """
+    The TF-IDF weighted index of in-stock products as
+    ``(product_ids, terms, rows, columns, weights, idf)``: posting ``i`` puts
+    ``weights[i]`` on term ``columns[i]`` of product ``rows[i]``. Product
+    vectors are L2-normalized.
+    """
+    product_ids, terms = {}, {}
+    rows, columns, counts = [], [], []
+    postings = ProductTerm.objects.filter(product__stock__gt=0).values_list('product_id', 'term', 'count')
+    for product_id, term, count in postings.iterator(chunk_size=10000):
+        rows.append(product_ids.setdefault(product_id, len(product_ids)))
+        columns.append(terms.setdefault(term, len(terms)))
+        counts.append(count)
+    rows = np.array(rows, dtype=np.int64)
+    columns = np.array(columns, dtype=np.int64)
+    counts = np.array(counts, dtype=np.float64)
+
+    documents = np.bincount(columns, minlength=len(terms))
+    idf = np.log((1 + len(product_ids)) / (1 + documents)) + 1
+    weights = (1 + np.log(counts)) * idf[columns]
+    norms = np.sqrt(np.bincount(rows, weights ** 2, minlength=len(product_ids)))
+    if len(weights):
+        weights /= norms[rows]
+    return np.array(list(product_ids), dtype=np.int64), terms, rows, columns, weights, idf
+
+
+def cached_index():
+    """
+    ``load_index()``, reused by this process for ``RECOMMENDATION_INDEX_TTL``
+    seconds.
+    """
+    global _cached_index
+    index, expires = _cached_index
+    if index is None or time.monotonic() >= expires:
+        with _cached_index_lock:
+            index, expires = _cached_index
+            if index is None or time.monotonic() >= expires:
+                index = load_index()
+                _cached_index = (index, time.monotonic() + settings.RECOMMENDATION_INDEX_TTL)
+    return index
+
+
+def forget_index():
+    """
+    Drop this process' copy of the index, so the next refresh loads it again.
+    """
+    global _cached_index
+    _cached_index = (None, 0)
+
+
+def buyer_matrix(preferences, terms, idf):
+    """
+    L2-normalized TF-IDF vectors of the buyers' preferences, over only the
+    terms they use, and the index columns those terms map to.
+    """
+    vocabulary = {}
+    for counts in preferences:
+        for term in counts:
+            if term in terms:
+                vocabulary.setdefault(term, len(vocabulary))
+    matrix = np.zeros((len(preferences), len(vocabulary)))
+    for row, counts in enumerate(preferences):
+        for term, count in counts.items():
+            if term in vocabulary:
+                matrix[row, vocabulary[term]] = (1 + np.log(count)) * idf[terms[term]]
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    np.divide(matrix, norms, out=matrix, where=norms > 0)
+    return matrix, np.array([terms[term] for term in vocabulary], dtype=np.int64)
+
+
+def top_products(scores, top_n):
+    """
+    Per row of ``scores``, the column indexes of the ``top_n`` best positive
+    scores, best first, padded with -1.
+    """
+    top_n = min(top_n, scores.shape[1])
+    if top_n == 0:
+        return np.full((scores.shape[0], 0), -1)
+    best = np.argpartition(-scores, top_n - 1, axis=1)[:, :top_n]
+    order = np.argsort(-np.take_along_axis(scores, best, axis=1), axis=1, kind='stable')
+    best = np.take_along_axis(best, order, axis=1)
+    return np.where(np.take_along_axis(scores, best, axis=1) > 0, best, -1)
+
+
+def best_products(buyers, vocabulary, index, top_n, block_size):
+    """
+    Per buyer, the index rows of the ``top_n`` best scoring products, best
+    first and padded with -1, and their scores.
+
+    Only products sharing a term with the buyers can score above zero. They
+    are scored ``block_size`` at a time, each block a dense products x terms
+    matrix, so memory stays bounded by the block, not by the catalog.
+    """
+    _, terms, rows, columns, weights, _ = index
+    positions = np.full(len(terms), -1)
+    positions[vocabulary] = np.arange(len(vocabulary))
+    used = positions[columns] >= 0 if len(columns) else np.zeros(0, dtype=bool)
+    candidates, local = np.unique(rows[used], return_inverse=True)
+    order = np.argsort(local, kind='stable')
+    local, term_positions, used_weights = local[order], positions[columns[used]][order], weights[used][order]
+
+    best_rows = np.full((len(buyers), 0), -1)
+    best_scores = np.zeros((len(buyers), 0))
+    for start in range(0, len(candidates), block_size):
+        end = min(start + block_size, len(candidates))
+        first, last = np.searchsorted(local, [start, end])
+        products = np.zeros((end - start, len(vocabulary)))
+        products[local[first:last] - start, term_positions[first:last]] = used_weights[first:last]
+        scores = buyers @ products.T
+        block = top_products(scores, top_n)
+        block_scores = np.where(block >= 0, np.take_along_axis(scores, np.maximum(block, 0), axis=1), 0)
+        block_rows = np.where(block >= 0, candidates[start + np.maximum(block, 0)], -1)
+
+        # Merge with the best of the blocks before.
+        merged_rows = np.concatenate([best_rows, block_rows], axis=1)
+        merged_scores = np.concatenate([best_scores, block_scores], axis=1)
+        keep = top_products(merged_scores, top_n)
+        best_rows = np.where(keep >= 0, np.take_along_axis(merged_rows, np.maximum(keep, 0), axis=1), -1)
+        best_scores = np.where(keep >= 0, np.take_along_axis(merged_scores, np.maximum(keep, 0), axis=1), 0)
+    return best_rows, best_scores
+
+
+def refresh_recommendations(buyer_ids=None, top_n=None, batch_size=500, block_size=5000):
+    """
+    Recompute the stored recommendations of all buyers, or only of
+    ``buyer_ids`` (user ids). Returns the number of buyers processed.
+    """
+    top_n = top_n or settings.RECOMMENDATIONS_PER_BUYER
+    index = load_index() if buyer_ids is None else cached_index()
+    product_ids, terms, _, _, _, idf = index
+
+    profiles = BuyerProfile.objects.order_by('user_id').values_list('user_id', 'preferred_products')
+    if buyer_ids is not None:
+        profiles = profiles.filter(user_id__in=buyer_ids)
+    profiles = profiles.iterator(chunk_size=batch_size)
+
+    processed = 0
+    while batch := list(islice(profiles, batch_size)):
+        users = [user_id for user_id, _ in batch]
+        buyers, vocabulary = buyer_matrix([tokenize(text) for _, text in batch], terms, idf)
+        best, scores = best_products(buyers, vocabulary, index, top_n, block_size)
+        recommendations = [
+            BuyerRecommendation(buyer_id=user_id, product_id=int(product_ids[product]), rank=rank, score=float(score))
+            for row, user_id in enumerate(users)
+            for rank, (product, score) in enumerate(zip(best[row], scores[row]), start=1) if product >= 0
+        ]
+        # A reused index may still hold products deleted since it was loaded.
+        existing = set(Product.objects.filter(pk__in={r.product_id for r in recommendations}).values_list('pk', flat=True))
+        recommendations = [r for r in recommendations if r.product_id in existing]
+        with transaction.atomic():
+            BuyerRecommendation.objects.filter(buyer_id__in=users).delete()
+            BuyerRecommendation.objects.bulk_create(recommendations, batch_size=1000)
+        processed += len(batch)
+    return processed
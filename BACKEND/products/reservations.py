@@ -0,0 +1,178 @@
+"""
+Stock reservations without row-locking reads.
+
+Stock is taken with conditional decrements,
+
+    UPDATE products_product SET stock = stock - q WHERE id = p AND stock >= q
+
+batched into a single statement for every product of an order. Postgres
+re-checks the condition against the latest row version, so concurrent
+buyers of a popular product never oversell and never wait on a
+SELECT ... FOR UPDATE; they only queue on the row for the instant of
+their own update.
+"""
+import logging
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Product, StockReservation
+
+logger = logging.getLogger(__name__)
+
+
+class InsufficientStock(Exception):
+    """
+    Raised when one or more products cannot cover the requested quantity.
+    """
+
+    def __init__(self, product_ids):
+        self.product_ids = product_ids
+        super().__init__(f'Insufficient stock for product(s) {", ".join(map(str, product_ids))}')
+
+
+def reservation_expiry():
+    return timezone.now() + timedelta(minutes=settings.STOCK_RESERVATION_MINUTES)
+
+
+def _decrement_stock(quantities):
+    """
+    Take ``quantities`` ({product_id: quantity}) off stock in one statement
+    and return the ids of the products that had enough.
+    """
+    # Sorted so concurrent multi-item orders lock rows in the same order.
+    rows = sorted(quantities.items())
+    values = ', '.join(['(%s::bigint, %s::integer)'] * len(rows))
+    table = connection.ops.quote_name(Product._meta.db_table)
+    sql = f"""
+        UPDATE {table} AS p
+        SET stock = p.stock - v.quantity, updated_at = now()
+        FROM (VALUES {values}) AS v(id, quantity)
+        WHERE p.id = v.id AND p.stock >= v.quantity
+        RETURNING p.id
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [param for row in rows for param in row])
+        return {row[0] for row in cursor.fetchall()}
+
+
+def reserve_stock(quantities):
+    """
+    Take stock for every product in ``quantities`` or raise InsufficientStock.
+
+    Must run inside the order's transaction: when some products fall short
+    the decrements already made are undone by the rollback. Expired
+    reservations on the short products are released before giving up.
+    """
+    short = set(quantities) - _decrement_stock(quantities)
+    if short and release_expired_reservations(product_ids=short):
+        short -= _decrement_stock({product_id: quantities[product_id] for product_id in short})
+    if short:
+        raise InsufficientStock(sorted(short))
+
+
+def _release(condition, params, limit=None):
+    """
+    Mark held reservations matching ``condition`` released and put their
+    quantity back on stock, in one statement. Rows another worker is already
+    releasing are skipped. Returns the number of products restocked.
+    """
+    reservations = connection.ops.quote_name(StockReservation._meta.db_table)
+    products = connection.ops.quote_name(Product._meta.db_table)
+    sql = f"""
+        WITH due AS (
+            SELECT id FROM {reservations}
+            WHERE status = %s AND {condition}
+            ORDER BY id
+            {'LIMIT %s' if limit else ''}
+            FOR UPDATE SKIP LOCKED
+        ), released AS (
+            UPDATE {reservations} AS r SET status = %s
+            FROM due WHERE r.id = due.id
+            RETURNING r.product_id, r.quantity
+        ), totals AS (
+            SELECT product_id, SUM(quantity) AS quantity FROM released GROUP BY product_id
+        )
+        UPDATE {products} AS p
+        SET stock = p.stock + totals.quantity, updated_at = now()
+        FROM totals WHERE p.id = totals.product_id
+        RETURNING p.id
+    """
+    params = [StockReservation.HELD, *params, *([limit] if limit else []), StockReservation.RELEASED]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return len(cursor.fetchall())
+
+
+def release_expired_reservations(product_ids=None, limit=1000):
+    """
+    Release up to ``limit`` held reservations past their expiry, optionally
+    only those on ``product_ids``.
+    """
+    condition, params = 'expires_at <= %s', [timezone.now()]
+    if product_ids is not None:
+        condition += ' AND product_id = ANY(%s)'
+        params.append(list(product_ids))
+    return _release(condition, params, limit=limit)
+
+
+def release_order_reservations(order_ids):
+    """
+    Release every held reservation of the given orders, e.g. on cancellation.
+    """
+    return _release('order_id = ANY(%s)', [list(order_ids)])
+
+
+def renew_order_reservations(order_id):
+    """
+    Hold an order's reservations for another ``STOCK_RESERVATION_MINUTES``
+    while it is being paid for. Returns False when any of them has already
+    expired or been released, i.e. its stock may have been sold to someone
+    else; the caller's transaction should then be rolled back.
+    """
+    now = timezone.now()
+    reservations = StockReservation.objects.filter(order_id=order_id)
+    reservations.filter(status=StockReservation.HELD, expires_at__gt=now).update(expires_at=reservation_expiry())
+    return not reservations.filter(
+        Q(status=StockReservation.RELEASED) | Q(status=StockReservation.HELD, expires_at__lte=now)
+    ).exists()
+
+
+def commit_order_reservations(order_ids):
+    """
+    Make the stock taken for paid orders permanent.
+
+    Reservations released before the payment landed take their stock again
+    where there still is enough. Returns the ids of the orders for which
+    there was not; their payment has been taken for stock that is gone.
+    """
+    StockReservation.objects.filter(
+        order_id__in=order_ids, status=StockReservation.HELD,
+    ).update(status=StockReservation.COMMITTED)
+    released = list(
+        StockReservation.objects.filter(order_id__in=order_ids, status=StockReservation.RELEASED)
+        .values_list('pk', 'order_id', 'product_id', 'quantity')
+    )
+    if not released:
+        return []
+    by_order = defaultdict(list)
+    for row in released:
+        by_order[row[1]].append(row)
+    # Rare (a hold outlived by its payment), so one statement per order.
+    committed, oversold = [], []
+    for order_id, rows in sorted(by_order.items()):
+        quantities = defaultdict(int)
+        for _, _, product_id, quantity in rows:
+            quantities[product_id] += quantity
+        restocked = _decrement_stock(quantities)
+        committed += [pk for pk, _, product_id, _ in rows if product_id in restocked]
+        if len(restocked) < len(quantities):
+            oversold.append(order_id)
+    StockReservation.objects.filter(pk__in=committed).update(status=StockReservation.COMMITTED)
+    if oversold:
+        logger.error('Order(s) %s paid after their stock was released and resold', oversold)
+    return oversold
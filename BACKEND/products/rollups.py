@@ -0,0 +1,208 @@
+"""
+Incrementally maintained farmer sales rollups.
+
+Every placed order is folded into FarmerDailySales (farmer, product, day)
+and FarmerDailyTotals (farmer, day) with one ``INSERT ... ON CONFLICT DO
+UPDATE`` each, so reading a dashboard costs the same however long a
+farmer's history is. ``rebuild_sales_rollups`` recomputes both tables from
+the orders for backfill or repair.
+
+Product.units_sold and Product.order_count are kept the same way: bumped
+with ``F()`` expressions in the order's transaction and corrected from the
+order items by ``reconcile_product_popularity``.
+"""
+from collections import Counter, defaultdict
+from decimal import Decimal
+from itertools import islice
+
+from django.db import connection, transaction
+from django.db.models import Case, Count, F, Sum, Value, When
+from django.db.models.functions import Greatest, TruncDate
+from django.utils import timezone
+
+from .models import FarmerDailySales, FarmerDailyTotals, OrderItem, Product
+
+COLUMN_TYPES = {
+    'farmer_id': 'bigint',
+    'product_id': 'bigint',
+    'day': 'date',
+    'revenue': 'numeric',
+    'units': 'integer',
+    'orders': 'integer',
+}
+
+
+def _upsert(model, key_columns, rows):
+    """
+    Add ``rows`` of (*key, revenue, units, orders) onto ``model``'s counters.
+    """
+    if not rows:
+        return
+    table = connection.ops.quote_name(model._meta.db_table)
+    columns = [*key_columns, 'revenue', 'units', 'orders']
+    placeholders = ', '.join(['(' + ', '.join(['%s'] * len(columns)) + ')'] * len(rows))
+    keys = ', '.join(key_columns)
+    sql = f"""
+        INSERT INTO {table} ({', '.join(columns)}) VALUES {placeholders}
+        ON CONFLICT ({keys}) DO UPDATE SET
+            revenue = {table}.revenue + EXCLUDED.revenue,
+            units = {table}.units + EXCLUDED.units,
+            orders = {table}.orders + EXCLUDED.orders
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [value for row in rows for value in row])
+
+
+def _subtract(model, key_columns, rows):
+    if not rows:
+        return
+    table = connection.ops.quote_name(model._meta.db_table)
+    columns = [*key_columns, 'revenue', 'units', 'orders']
+    row = '(' + ', '.join(f'%s::{COLUMN_TYPES[column]}' for column in columns) + ')'
+    placeholders = ', '.join([row] * len(rows))
+    match = ' AND '.join(f't.{column} = v.{column}' for column in key_columns)
+    sql = f"""
+        UPDATE {table} AS t SET
+            revenue = GREATEST(t.revenue - v.revenue, 0),
+            units = GREATEST(t.units - v.units, 0),
+            orders = GREATEST(t.orders - v.orders, 0)
+        FROM (VALUES {placeholders}) AS v({', '.join(columns)})
+        WHERE {match}
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [value for row in rows for value in row])
+
+
+def _order_rows(order, items):
+    day = timezone.localdate(order.created_at)
+    per_product = defaultdict(lambda: [Decimal('0'), 0])
+    per_farmer = defaultdict(lambda: [Decimal('0'), 0])
+    for item in items:
+        for totals in (per_product[(item.farmer_id, item.product_id)], per_farmer[item.farmer_id]):
+            totals[0] += item.price
+            totals[1] += item.quantity
+    # Sorted by key so concurrent multi-farmer orders lock rows in the same order.
+    product_rows = [(farmer_id, product_id, day, revenue, units, 1) for (farmer_id, product_id), (revenue, units) in sorted(per_product.items())]
+    farmer_rows = [(farmer_id, day, revenue, units, 1) for farmer_id, (revenue, units) in sorted(per_farmer.items())]
+    return product_rows, farmer_rows
+
+
+def record_order_sales(order, items):
+    """
+    Add a newly placed order's items to the rollups. Every order of a farmer
+    on a day updates the same FarmerDailyTotals row, so call this last in
+    the order's transaction to hold that lock as briefly as possible.
+    """
+    product_rows, farmer_rows = _order_rows(order, items)
+    _upsert(FarmerDailySales, ['farmer_id', 'product_id', 'day'], product_rows)
+    _upsert(FarmerDailyTotals, ['farmer_id', 'day'], farmer_rows)
+
+
+def retract_order_sales(order):
+    """
+    Take a deleted order back out of the rollups.
+    """
+    product_rows, farmer_rows = _order_rows(order, list(order.items.all()))
+    _subtract(FarmerDailySales, ['farmer_id', 'product_id', 'day'], product_rows)
+    _subtract(FarmerDailyTotals, ['farmer_id', 'day'], farmer_rows)
+
+
+def rebuild_sales_rollups(farmer_ids=None, batch_size=2000):
+    """
+    Recompute the rollups from the order tables, for all farmers or only
+    ``farmer_ids``. Returns the number of (farmer, product, day) rows written.
+    """
+    items = OrderItem.objects.all()
+    if farmer_ids is not None:
+        items = items.filter(farmer_id__in=farmer_ids)
+    items = items.annotate(day=TruncDate('order__created_at')).order_by()
+
+    per_product = items.values('farmer_id', 'product_id', 'day').annotate(
+        revenue=Sum('price'), units=Sum('quantity'), orders=Count('order_id', distinct=True),
+    )
+    per_farmer = items.values('farmer_id', 'day').annotate(
+        revenue=Sum('price'), units=Sum('quantity'), orders=Count('order_id', distinct=True),
+    )
+
+    written = 0
+    with transaction.atomic():
+        for model, rows in ((FarmerDailySales, per_product), (FarmerDailyTotals, per_farmer)):
+            existing = model.objects.all()
+            if farmer_ids is not None:
+                existing = existing.filter(farmer_id__in=farmer_ids)
+            existing.delete()
+
+            rows = rows.iterator(chunk_size=batch_size)
+            while batch := [model(**row) for row in islice(rows, batch_size)]:
+                model.objects.bulk_create(batch)
+                if model is FarmerDailySales:
+                    written += len(batch)
+    return written
+
+
+def _per_product(quantities):
+    return Case(
+        *[When(pk=product_id, then=Value(quantity)) for product_id, quantity in quantities.items()],
+        default=Value(0),
+    )
+
+
+def record_product_popularity(quantities):
+    """
+    Add an order's ``{product_id: quantity}`` to the products' counters, in
+    one UPDATE. Call it after stock was reserved: the rows are then already
+    locked by the order's transaction, so this takes no new locks.
+    """
+    if not quantities:
+        return
+    Product.objects.filter(pk__in=quantities).update(
+        units_sold=F('units_sold') + _per_product(quantities),
+        order_count=F('order_count') + 1,
+    )
+
+
+def retract_product_popularity(order):
+    """
+    Take a deleted order back out of its products' counters.
+    """
+    quantities = Counter()
+    for item in order.items.all():
+        quantities[item.product_id] += item.quantity
+    if not quantities:
+        return
+    Product.objects.filter(pk__in=quantities).update(
+        units_sold=Greatest(F('units_sold') - _per_product(quantities), Value(0)),
+        order_count=Greatest(F('order_count') - 1, Value(0)),
+    )
+
+
+def reconcile_product_popularity(batch_size=5000):
+    """
+    Recompute units_sold and order_count from the order items, one range
+    of product ids per statement, and return how many products had drifted.
+    Only drifted rows are written.
+    """
+    product = connection.ops.quote_name(Product._meta.db_table)
+    item = connection.ops.quote_name(OrderItem._meta.db_table)
+    sql = f"""
+        UPDATE {product} AS p
+        SET units_sold = c.units, order_count = c.orders
+        FROM (
+            SELECT q.id, COALESCE(SUM(i.quantity), 0) AS units, COUNT(DISTINCT i.order_id) AS orders
+            FROM {product} AS q LEFT JOIN {item} AS i ON i.product_id = q.id
+            WHERE q.id > %s AND q.id <= %s
+            GROUP BY q.id
+        ) AS c
+        WHERE p.id = c.id AND (p.units_sold, p.order_count) IS DISTINCT FROM (c.units, c.orders)
+    """
+    fixed = 0
+    last_id = 0
+    while True:
+        ids = Product.objects.filter(pk__gt=last_id).order_by('pk').values_list('pk', flat=True)
+        upper = next(iter(ids[batch_size - 1:batch_size]), None) or ids.last()
+        if upper is None:
+            return fixed
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [last_id, upper])
+            fixed += cursor.rowcount
+        last_id = upper
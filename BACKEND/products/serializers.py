@@ -1,22 +1,232 @@
+from decimal import Decimal
+
+from django.conf import settings
+from django.db.models import F
 from rest_framework import serializers
+from profiles.geo import geocode
+from .images import thumbnail_urls
 from .models import Product, OrderItem, Order
+from .services import place_order
+from .trending import current_score
+from .reservations import InsufficientStock
 
 class ProductSerializer(serializers.ModelSerializer):
     farmer_name = serializers.CharField(source="farmer.username", read_only=True)
+    # Thumbnail URLs only; the original upload is never exposed.
+    thumbnails = serializers.SerializerMethodField()
 
     class Meta:
         model = Product
         fields = [
             "id", "title", "description", "category", "price", 
-            "stock", "created_at", "updated_at", "farmer_name"
+            "stock", "created_at", "updated_at", "farmer_name", "thumbnails"
         ]
         read_only_fields = ["id", "created_at", "updated_at", "farmer_name"]
 
+    def get_thumbnails(self, product):
+        return thumbnail_urls(product.thumbnails)
+
     def create(self, validated_data):
         request = self.context.get('request')
         validated_data['farmer'] = request.user
         return super().create(validated_data)
+
+
+class ProductRowSerializer(serializers.BaseSerializer):
+    """
+    Read-only fast path for catalog listings.
+
+    Takes ``values()`` rows from :meth:`rows` (with the farmer's username
+    joined in) and produces exactly what ProductSerializer would, without
+    building model instances or walking DRF's per-field machinery. Decimal
+    and datetime formatting reuse ProductSerializer's own fields so the JSON
+    stays byte-identical.
+    """
+    columns = [name for name in ProductSerializer.Meta.fields if name != "farmer_name"]
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        fields = ProductSerializer().fields
+        self.price_to_representation = fields["price"].to_representation
+        self.created_at_to_representation = fields["created_at"].to_representation
+        self.updated_at_to_representation = fields["updated_at"].to_representation
+
+    @classmethod
+    def rows(cls, queryset, *extra):
+        """
+        ``values()`` rows for this serializer, plus any ``extra`` columns
+        (such as keyset pagination fields) it does not output.
+        """
+        extra = [name for name in extra if name not in cls.columns]
+        return queryset.values(*cls.columns, *extra, farmer_name=F("farmer__username"))
+
+    def to_representation(self, row):
+        return {
+            "id": row["id"],
+            "title": row["title"],
+            "description": row["description"],
+            "category": row["category"],
+            "price": self.price_to_representation(row["price"]),
+            "stock": row["stock"],
+            "created_at": self.created_at_to_representation(row["created_at"]),
+            "updated_at": self.updated_at_to_representation(row["updated_at"]),
+            "farmer_name": row["farmer_name"],
+            "thumbnails": thumbnail_urls(row["thumbnails"]),
+        }
+
+
+class NearbyProductSerializer(ProductRowSerializer):
+    """
+    Catalog rows plus the farm's location and its distance from the buyer.
+    """
+
+    @classmethod
+    def rows(cls, queryset):
+        return queryset.values(
+            *cls.columns, 'distance_km',
+            farmer_name=F("farmer__username"), location=F("farmer__farmer_profile__location"),
+        )
+
+    def to_representation(self, row):
+        representation = super().to_representation(row)
+        representation["location"] = row["location"]
+        representation["distance_km"] = round(row["distance_km"], 2)
+        return representation
+
+
+class TrendingProductSerializer(ProductRowSerializer):
+    """
+    Catalog rows plus the product's decayed sales score at ``context['now']``.
+    """
+
+    @classmethod
+    def rows(cls, queryset):
+        return queryset.values(*cls.columns, farmer_name=F("farmer__username"), log_score=F("trend__log_score"))
+
+    def to_representation(self, row):
+        representation = super().to_representation(row)
+        representation["score"] = round(current_score(row["log_score"], self.context["now"]), 3)
+        return representation
+
+
+class RecommendedProductSerializer(ProductRowSerializer):
+    """
+    Catalog rows plus how well the product matches the buyer's preferences.
+    """
+
+    @classmethod
+    def rows(cls, queryset):
+        return queryset.values(*cls.columns, farmer_name=F("farmer__username"), score=F("recommendations__score"))
+
+    def to_representation(self, row):
+        representation = super().to_representation(row)
+        representation["score"] = round(row["score"], 4)
+        return representation
+
+
+class ProductImageSerializer(serializers.Serializer):
+    image = serializers.ImageField()
+
+    def validate_image(self, image):
+        if image.size > settings.PRODUCT_IMAGE_MAX_SIZE:
+            raise serializers.ValidationError(f'Images may be at most {settings.PRODUCT_IMAGE_MAX_SIZE // (1024 * 1024)} MB.')
+        return image
+
+
+class ProductSearchSerializer(ProductSerializer):
+    rank = serializers.FloatField(read_only=True)
+
+    class Meta(ProductSerializer.Meta):
+        fields = ProductSerializer.Meta.fields + ["rank"]
+
+
+class MarketplaceFilterSerializer(serializers.Serializer):
+    category = serializers.ChoiceField(choices=Product.FARMER_CHOICES, required=False)
+    min_price = serializers.DecimalField(max_digits=10, decimal_places=2, min_value=Decimal('0'), required=False)
+    max_price = serializers.DecimalField(max_digits=10, decimal_places=2, min_value=Decimal('0'), required=False)
+    in_stock = serializers.BooleanField(required=False, default=False)
+    location = serializers.CharField(max_length=255, required=False, allow_blank=True)
+    ordering = serializers.ChoiceField(choices=['newest', 'popular'], required=False, default='newest')
+
+    def validate(self, attrs):
+        min_price, max_price = attrs.get('min_price'), attrs.get('max_price')
+        if min_price is not None and max_price is not None and min_price > max_price:
+            raise serializers.ValidationError({'max_price': 'Must not be lower than min_price.'})
+        return attrs
+
+
+class NearbyQuerySerializer(serializers.Serializer):
+    lat = serializers.FloatField(min_value=-90, max_value=90, required=False)
+    lon = serializers.FloatField(min_value=-180, max_value=180, required=False)
+    town = serializers.CharField(max_length=255, required=False)
+    radius = serializers.FloatField(min_value=0.1, max_value=500, required=False)
+    limit = serializers.IntegerField(min_value=1, max_value=100, default=20)
+
+    def validate(self, attrs):
+        if attrs.get('town'):
+            coordinates = geocode(attrs['town'])
+            if coordinates is None:
+                raise serializers.ValidationError({'town': 'Unknown town.'})
+            attrs['lat'], attrs['lon'] = coordinates
+        elif attrs.get('lat') is None or attrs.get('lon') is None:
+            raise serializers.ValidationError('Provide lat and lon, or a town.')
+        return attrs
+
+
+class TrendingQuerySerializer(serializers.Serializer):
+    category = serializers.ChoiceField(choices=Product.FARMER_CHOICES, required=False)
+    limit = serializers.IntegerField(min_value=1, max_value=settings.TRENDING_TOP_K, default=10)
+
+
+class SalesDashboardQuerySerializer(serializers.Serializer):
+    days = serializers.IntegerField(min_value=1, max_value=366, default=30)
+
+
+class SalesTotalsSerializer(serializers.Serializer):
+    revenue = serializers.DecimalField(max_digits=14, decimal_places=2)
+    units = serializers.IntegerField()
+    orders = serializers.IntegerField()
+
+
+class DailySalesSerializer(SalesTotalsSerializer):
+    day = serializers.DateField()
+
+
+class ProductSalesSerializer(serializers.Serializer):
+    product = serializers.IntegerField(source='product_id')
+    title = serializers.CharField(source='product__title')
+    revenue = serializers.DecimalField(max_digits=14, decimal_places=2, source='total_revenue')
+    units = serializers.IntegerField(source='total_units')
+    orders = serializers.IntegerField(source='total_orders')
+
+
+class ProductChangeSerializer(serializers.Serializer):
+    id = serializers.IntegerField()
+    price = serializers.DecimalField(max_digits=10, decimal_places=2, min_value=Decimal('0'), required=False)
+    stock = serializers.IntegerField(min_value=0, max_value=2147483647, required=False)
+
+    def validate(self, attrs):
+        if 'price' not in attrs and 'stock' not in attrs:
+            raise serializers.ValidationError('Provide a price, a stock level or both.')
+        return attrs
+
+
+class ProductBatchUpdateSerializer(serializers.Serializer):
+    items = ProductChangeSerializer(many=True, allow_empty=False, max_length=5000)
+
+    def validate_items(self, items):
+        seen = set()
+        duplicates = sorted({item['id'] for item in items if item['id'] in seen or seen.add(item['id'])})
+        if duplicates:
+            raise serializers.ValidationError(f'Duplicate product id(s): {", ".join(map(str, duplicates))}.')
+        return items
+
+
 class OrderItemSerializer(serializers.ModelSerializer):
+    # Accepted as a plain id and resolved for all items at once in
+    # OrderSerializer.validate_items, instead of one lookup per item.
+    product = serializers.IntegerField(source='product_id')
+
     class Meta:
         model = OrderItem
         fields = ['product', 'quantity', 'price']
@@ -34,19 +244,35 @@ class OrderSerializer(serializers.ModelSerializer):
         representation = super().to_representation(instance)
         representation['total_price'] = float(instance.total_price)
         return representation
-    
+
+    def validate_items(self, items):
+        product_ids = {item['product_id'] for item in items}
+        products = Product.objects.only('id', 'price', 'farmer_id', 'category').in_bulk(product_ids)
+        missing = sorted(product_ids - products.keys())
+        if missing:
+            raise serializers.ValidationError(f'Invalid product id(s): {", ".join(map(str, missing))}.')
+        return [
+            {'product': products[item['product_id']], 'quantity': item['quantity']}
+            for item in items
+        ]
+
     def create(self, validated_data):
-        items_data = validated_data.pop('items')
-        order = Order.objects.create(**validated_data)  # `total_price` starts with a default value (e.g., 0.0).
-        total_price = 0
-        for item_data in items_data:
-            item_data['price'] = item_data['product'].price * item_data['quantity']
-            total_price += item_data['price']
-            OrderItem.objects.create(order=order, **item_data)
-        order.total_price = total_price
-        order.save()  # Update the total_price after creating the items.
-        return order
+        try:
+            return place_order(validated_data['buyer'], validated_data['items'])
+        except InsufficientStock as exc:
+            raise serializers.ValidationError({'items': [str(exc)]})
+
+
+class FarmerOrderSerializer(OrderSerializer):
+    """
+    An order as one of its farmers sees it: with only their items prefetched,
+    ``total_price`` is their subtotal, not what the buyer spent overall.
+    """
 
+    def to_representation(self, instance):
+        representation = super().to_representation(instance)
+        representation['total_price'] = float(instance.items_total())
+        return representation
 
     
 class OrderDetailSerializer(serializers.ModelSerializer):
@@ -0,0 +1,106 @@
+from collections import Counter
+from decimal import Decimal
+
+from django.db import connection, transaction
+
+from .cache import bump_catalog_version
+from .models import FarmerOrder, Order, OrderItem, Product, StockReservation
+from .reservations import reservation_expiry, reserve_stock
+from .rollups import record_order_sales, record_product_popularity
+from .trending import record_trending
+
+
+def place_order(buyer, items):
+    """
+    Create an order and its line items in one transaction.
+
+    ``items`` is a list of ``{'product': Product, 'quantity': int}`` whose
+    products were resolved up front (see ``OrderSerializer.validate_items``).
+    Items are priced in memory, the order is written once with its final
+    total and the items go in with a single ``bulk_create``, so the number
+    of queries does not grow with the number of items.
+
+    Contended rows are written at the tail of the transaction so their locks
+    are held briefly: stock is reserved after the plain inserts, and the
+    farmer/day rollups, which every order of a farmer shares, come last of
+    all. Raises ``InsufficientStock`` (and writes nothing) when any product
+    cannot cover its quantity.
+    """
+    order_items = []
+    quantities = Counter()
+    total_price = Decimal('0')
+    for item in items:
+        product, quantity = item['product'], item['quantity']
+        price = product.price * quantity
+        total_price += price
+        quantities[product.id] += quantity
+        order_items.append(OrderItem(product=product, farmer_id=product.farmer_id, quantity=quantity, price=price))
+
+    with transaction.atomic():
+        order = Order.objects.create(buyer=buyer, total_price=total_price)
+        for order_item in order_items:
+            order_item.order = order
+        OrderItem.objects.bulk_create(order_items)
+        FarmerOrder.objects.bulk_create(
+            FarmerOrder(farmer_id=farmer_id, order=order, created_at=order.created_at)
+            for farmer_id in {order_item.farmer_id for order_item in order_items}
+        )
+        if quantities:
+            reserve_stock(quantities)
+            expires_at = reservation_expiry()
+            StockReservation.objects.bulk_create(
+                StockReservation(order=order, product_id=product_id, quantity=quantity, expires_at=expires_at)
+                for product_id, quantity in quantities.items()
+            )
+            record_product_popularity(quantities)
+            record_trending(order, order_items)
+        record_order_sales(order, order_items)
+    return order
+
+
+class ProductsNotOwned(Exception):
+    """
+    Raised when a batch update names products the farmer does not own.
+    """
+
+    def __init__(self, product_ids):
+        self.product_ids = product_ids
+        super().__init__(f'Invalid product id(s): {", ".join(map(str, product_ids))}.')
+
+
+def update_inventory(farmer, changes):
+    """
+    Apply ``changes`` (``{'id', 'price', 'stock'}`` dicts, where a missing
+    price or stock leaves it as it is) to ``farmer``'s products.
+
+    Everything goes out as one ``UPDATE ... FROM (VALUES ...)`` that is
+    limited to the farmer's own rows, so the statement doubles as the
+    ownership check: if it touched fewer rows than requested the
+    transaction is rolled back and ProductsNotOwned names the others.
+    Returns the number of products updated.
+    """
+    if not changes:
+        return 0
+    # Sorted so overlapping batches and orders lock rows in the same order.
+    rows = sorted((change['id'], change.get('price'), change.get('stock')) for change in changes)
+    values = ', '.join(['(%s::bigint, %s::numeric, %s::integer)'] * len(rows))
+    table = connection.ops.quote_name(Product._meta.db_table)
+    sql = f"""
+        UPDATE {table} AS p
+        SET price = COALESCE(v.price, p.price),
+            stock = COALESCE(v.stock, p.stock),
+            updated_at = now()
+        FROM (VALUES {values}) AS v(id, price, stock)
+        WHERE p.id = v.id AND p.farmer_id = %s
+        RETURNING p.id
+    """
+    params = [param for row in rows for param in row] + [farmer.pk]
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            updated = {row[0] for row in cursor.fetchall()}
+        missing = sorted({row[0] for row in rows} - updated)
+        if missing:
+            raise ProductsNotOwned(missing)
+        bump_catalog_version()
+    return len(updated)
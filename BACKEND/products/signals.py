@@ -0,0 +1,34 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from KUKUCONNECT.workers import submit_on_commit
+from profiles.models import BuyerProfile, FarmerProfile
+from .cache import bump_catalog_version
+from .models import Product
+from .recommendations import index_products, refresh_recommendations
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_marketplace_cache(sender, **kwargs):
+    bump_catalog_version()
+
+
+@receiver(post_save, sender=FarmerProfile)
+@receiver(post_delete, sender=FarmerProfile)
+def invalidate_marketplace_cache_for_location(sender, update_fields=None, **kwargs):
+    # The marketplace filters and counts products by their farmer's location.
+    if update_fields is None or 'location' in update_fields:
+        bump_catalog_version()
+
+
+@receiver(post_save, sender=Product)
+def reindex_product(sender, instance, update_fields=None, **kwargs):
+    # Saves limited to other fields (stock, photo, ...) leave the text as is.
+    if update_fields is None or {'title', 'description'} & set(update_fields):
+        submit_on_commit(index_products, [instance.pk])
+
+
+@receiver(post_save, sender=BuyerProfile)
+def refresh_buyer_recommendations(sender, instance, **kwargs):
+    submit_on_commit(refresh_recommendations, [instance.user_id])
@@ -0,0 +1,106 @@
+import pytest
+from django.contrib.auth import get_user_model
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from products.models import Product
+from profiles.models import FarmerProfile
+
+User = get_user_model()
+
+
+@pytest.fixture
+def api_client():
+    return APIClient()
+
+
+@pytest.fixture
+def catalog(db, api_client):
+    farmer = User.objects.create_user(username='farmer1', email='farmer1@example.com', password='password123', user_type='farmer')
+    buyer = User.objects.create_user(username='buyer1', email='buyer1@example.com', password='password123', user_type='buyer')
+    FarmerProfile.objects.create(user=farmer, location='Nakuru')
+    products = [
+        Product.objects.create(farmer=farmer, title=f'Flock {i}', description='Layers', category='number', price=400 + i, stock=10)
+        for i in range(25)
+    ]
+    api_client.force_authenticate(buyer)
+    data = {'buyer': buyer.id, 'items': [{'product': products[0].id, 'quantity': 2}, {'product': products[1].id, 'quantity': 1}]}
+    assert api_client.post('/api/products/orders/', data, format='json').status_code == status.HTTP_201_CREATED
+    api_client.force_authenticate(None)
+    return {'farmer': farmer, 'buyer': buyer, 'products': products}
+
+
+def bearer(api_client, username):
+    response = api_client.post(reverse('token_obtain_pair'), {'username': username, 'password': 'password123'})
+    return {'HTTP_AUTHORIZATION': f"Bearer {response.data['access']}"}
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('path, username', [
+    ('products/marketplace/', None),
+    ('products/marketplace/?category=number&min_price=410&page_size=5', None),
+    ('products/{product}/', 'buyer1'),
+    ('products/orders/buyer/', 'buyer1'),
+    ('products/orders/farmer/', 'farmer1'),
+    ('users/me/', 'farmer1'),
+])
+def test_async_endpoints_match_sync(api_client, catalog, settings, path, username):
+    settings.SERVER_TIMING = True
+    path = path.format(product=catalog['products'][3].id)
+    headers = bearer(api_client, username) if username else {}
+    sync = api_client.get(f'/api/{path}', HTTP_ACCEPT='application/json', **headers)
+    # Separate cache entries: the async response must not be the sync one replayed.
+    from django.core.cache import cache
+    cache.clear()
+    asynchronous = api_client.get(f'/api/async/{path}', **headers)
+    assert asynchronous.status_code == sync.status_code == status.HTTP_200_OK
+    assert asynchronous.content.replace(b'/api/async/', b'/api/') == sync.content
+    assert 'queries' in asynchronous['Server-Timing']
+
+
+@pytest.mark.django_db
+def test_async_marketplace_pages_and_caches(api_client, catalog):
+    response = api_client.get('/api/async/products/marketplace/?page_size=10')
+    assert response['X-Cache'] == 'MISS'
+    data = response.json()
+    assert len(data['results']) == 10 and 'facets' in data
+    following = api_client.get(data['next']).json()
+    assert [row['id'] for row in following['results']] == [p.id for p in reversed(catalog['products'])][10:20]
+    assert api_client.get('/api/async/products/marketplace/?page_size=10')['X-Cache'] == 'HIT'
+
+
+@pytest.mark.django_db
+def test_async_product_detail_conditional_and_auth(api_client, catalog):
+    product = catalog['products'][0]
+    headers = bearer(api_client, 'buyer1')
+    response = api_client.get(f'/api/async/products/{product.id}/', **headers)
+    assert response.status_code == status.HTTP_200_OK
+    response = api_client.get(f'/api/async/products/{product.id}/', HTTP_IF_NONE_MATCH=response['ETag'], **headers)
+    assert response.status_code == status.HTTP_304_NOT_MODIFIED
+
+    assert api_client.get('/api/async/products/999999/', **headers).status_code == status.HTTP_404_NOT_FOUND
+    response = api_client.get(f'/api/async/products/{product.id}/')
+    assert response.status_code == status.HTTP_401_UNAUTHORIZED
+    assert response['WWW-Authenticate'].startswith('Bearer')
+    response = api_client.get('/api/async/users/me/', HTTP_AUTHORIZATION='Bearer not-a-token')
+    assert response.status_code == status.HTTP_401_UNAUTHORIZED
+
+
+@pytest.mark.django_db
+def test_async_auth_applies_simplejwt_user_checks(api_client, catalog):
+    import json
+    from unittest import mock
+    from rest_framework_simplejwt.authentication import api_settings
+    # simplejwt's modules keep the settings object they imported, so
+    # override_settings(SIMPLE_JWT=...) would not reach them.
+    with mock.patch.object(api_settings, 'CHECK_REVOKE_TOKEN', True):
+        headers = bearer(api_client, 'buyer1')
+        assert api_client.get('/api/async/users/me/', **headers).status_code == status.HTTP_200_OK
+        buyer = catalog['buyer']
+        buyer.set_password('changed-password')
+        buyer.save()
+        for path in ('/api/users/me/', '/api/async/users/me/'):
+            response = api_client.get(path, **headers)
+            assert response.status_code == status.HTTP_401_UNAUTHORIZED
+            assert json.loads(response.content)['code'] == 'password_changed'
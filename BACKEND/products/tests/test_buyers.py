@@ -2,7 +2,7 @@ import pytest
 from rest_framework import status
 from django.urls import reverse
 from django.contrib.auth import get_user_model
-from products.models import Product, Order, OrderItem
+from products.models import Product, Order, OrderItem, StockReservation
 from django.utils.crypto import get_random_string
 
 User = get_user_model()
@@ -37,8 +37,184 @@ def test_marketplace_view(api_client, create_user):
     
     response = api_client.get('/api/products/marketplace/')
     assert response.status_code == status.HTTP_200_OK
-    assert len(response.data) == 1
-    assert response.data[0]['title'] == 'Organic Chicken'
+    assert len(response.data['results']) == 1
+    assert response.data['results'][0]['title'] == 'Organic Chicken'
+
+@pytest.mark.django_db
+def test_marketplace_keyset_pagination(api_client, create_user):
+    user = create_user(username='farmer1', password='password123')
+    for i in range(5):
+        Product.objects.create(farmer=user, title=f'Chicken {i}', description='Layers', category='number', price=200.00, stock=10)
+
+    response = api_client.get('/api/products/marketplace/', {'page_size': 2})
+    assert response.status_code == status.HTTP_200_OK
+    assert 'count' not in response.data
+    assert [p['title'] for p in response.data['results']] == ['Chicken 4', 'Chicken 3']
+    assert response.data['previous'] is None
+
+    seen = []
+    url = '/api/products/marketplace/?page_size=2'
+    while url:
+        response = api_client.get(url)
+        seen += [p['title'] for p in response.data['results']]
+        url = response.data['next']
+    assert seen == ['Chicken 4', 'Chicken 3', 'Chicken 2', 'Chicken 1', 'Chicken 0']
+
+    # Walking back from the last page returns the previous page in order.
+    response = api_client.get(response.data['previous'])
+    assert [p['title'] for p in response.data['results']] == ['Chicken 2', 'Chicken 1']
+
+@pytest.mark.django_db
+def test_keyset_filter_bounds_leading_column(create_user):
+    from django.db import connection
+    from django.utils import timezone
+    from products.pagination import keyset_filter
+    user = create_user(username='farmer1', password='password123')
+    for i in range(3):
+        Product.objects.create(farmer=user, title=f'Chicken {i}', description='Layers', category='number', price=200.00, stock=10)
+
+    now = timezone.now()
+    condition = keyset_filter(('-created_at', '-id'), [now, 2])
+    assert condition.connector == 'AND' and condition.children[0] == ('created_at__lte', now)
+    assert keyset_filter(('-created_at', '-id'), [now, 2], reverse=True).children[0] == ('created_at__gte', now)
+
+    # The cursor must become an index bound, not a filter over every
+    # row before it (which would make deep pages cost O(offset)).
+    with connection.cursor() as cursor:
+        cursor.execute('SET LOCAL enable_seqscan = off')
+    plan = Product.objects.filter(condition).order_by('-created_at', '-id')[:20].explain()
+    assert 'product_created_id_idx' in plan
+    assert 'Index Cond: (created_at <=' in plan
+
+@pytest.mark.django_db
+def test_marketplace_filters_and_facets(api_client, create_user):
+    from profiles.models import FarmerProfile
+    nakuru = create_user(username='farmer1', password='password123')
+    kisumu = create_user(username='farmer2', password='password123')
+    FarmerProfile.objects.create(user=nakuru, location='Nakuru')
+    FarmerProfile.objects.create(user=kisumu, location='Kisumu')
+    Product.objects.create(farmer=nakuru, title='Broilers', description='Live birds', category='number', price=450.00, stock=10)
+    Product.objects.create(farmer=nakuru, title='Dressed chicken', description='Per kg', category='weight', price=600.00, stock=0)
+    Product.objects.create(farmer=kisumu, title='Layers', description='Point of lay', category='number', price=900.00, stock=3)
+
+    response = api_client.get('/api/products/marketplace/', {'location': 'nakuru'})
+    assert response.status_code == status.HTTP_200_OK
+    assert {p['title'] for p in response.data['results']} == {'Broilers', 'Dressed chicken'}
+    facets = response.data['facets']
+    assert facets['category'] == {'weight': 1, 'number': 1}
+    assert [b['count'] for b in facets['price']] == [1, 1, 0, 0]
+    assert facets['in_stock'] == 1
+
+    response = api_client.get('/api/products/marketplace/', {'category': 'number', 'min_price': 500, 'in_stock': 'true'})
+    assert [p['title'] for p in response.data['results']] == ['Layers']
+    assert response.data['facets']['category'] == {'weight': 0, 'number': 1}
+
+    response = api_client.get('/api/products/marketplace/', {'min_price': 800, 'max_price': 100})
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+@pytest.mark.django_db
+def test_marketplace_cache_invalidated_by_product_writes(api_client, create_user, django_capture_on_commit_callbacks):
+    from django.db.models import F
+    from products.cache import forget_catalog_version
+    from products.models import CatalogVersion
+    from profiles.models import FarmerProfile
+    farmer = create_user(username='farmer1', password='password123')
+    with django_capture_on_commit_callbacks(execute=True):
+        product = Product.objects.create(farmer=farmer, title='Broilers', description='Live birds', category='number', price=450.00, stock=10)
+
+    response = api_client.get('/api/products/marketplace/')
+    assert response['X-Cache'] == 'MISS'
+    response = api_client.get('/api/products/marketplace/')
+    assert response['X-Cache'] == 'HIT'
+    assert response.data['results'][0]['price'] == '450.00'
+
+    with django_capture_on_commit_callbacks(execute=True):
+        product.price = 500.00
+        product.save()
+    response = api_client.get('/api/products/marketplace/')
+    assert response['X-Cache'] == 'MISS'
+    assert response.data['results'][0]['price'] == '500.00'
+
+    # Orders only move stock and sales counters, which do not invalidate.
+    buyer = create_user(username='buyer1', password='password123')
+    api_client.force_authenticate(buyer)
+    with django_capture_on_commit_callbacks(execute=True):
+        data = {'buyer': buyer.id, 'items': [{'product': product.id, 'quantity': 1}]}
+        assert api_client.post('/api/products/orders/', data, format='json').status_code == status.HTTP_201_CREATED
+    api_client.force_authenticate(None)
+    assert api_client.get('/api/products/marketplace/')['X-Cache'] == 'HIT'
+
+    # An edit made by another worker is seen once this one's copy of the
+    # shared version expires.
+    CatalogVersion.objects.update(version=F('version') + 1)
+    forget_catalog_version()
+    assert api_client.get('/api/products/marketplace/')['X-Cache'] == 'MISS'
+
+    # The location filter and facets read the farmer's profile.
+    with django_capture_on_commit_callbacks(execute=True):
+        profile = FarmerProfile.objects.create(user=farmer, location='Nakuru')
+    assert api_client.get('/api/products/marketplace/')['X-Cache'] == 'MISS'
+    assert api_client.get('/api/products/marketplace/')['X-Cache'] == 'HIT'
+    with django_capture_on_commit_callbacks(execute=True):
+        profile.location = 'Kiambu'
+        profile.save()
+    assert api_client.get('/api/products/marketplace/')['X-Cache'] == 'MISS'
+
+    with django_capture_on_commit_callbacks(execute=True):
+        product.delete()
+    response = api_client.get('/api/products/marketplace/')
+    assert response.data['results'] == []
+
+    admin = User.objects.create_superuser(username='admin', email='admin@example.com', password='password123')
+    api_client.force_authenticate(admin)
+    response = api_client.get('/api/products/marketplace/cache-stats/')
+    assert response.status_code == status.HTTP_200_OK
+    assert response.data['hits'] == 3
+    assert response.data['misses'] == 6
+
+@pytest.mark.django_db(transaction=True)
+def test_catalog_version_bumps_are_atomic():
+    import threading
+    from django.db import connection
+    from products.cache import _bump_catalog_version, forget_catalog_version, get_catalog_version
+    start = get_catalog_version()
+    barrier = threading.Barrier(8)
+
+    def bump():
+        barrier.wait()
+        for _ in range(25):
+            _bump_catalog_version()
+        connection.close()
+
+    threads = [threading.Thread(target=bump) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    forget_catalog_version()
+    assert get_catalog_version() == start + 8 * 25
+
+@pytest.mark.django_db
+def test_marketplace_invalid_cursor(api_client):
+    response = api_client.get('/api/products/marketplace/', {'cursor': 'not-a-cursor'})
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('position', [
+    [None, 1],
+    ['2024-01-01T00:00:00Z', None],
+    [{}, 1],
+    [True, 1],
+    ['', 1],
+    ['2024-01-01T00:00:00Z', 'one'],
+    ['2024-01-01T00:00:00Z', 1.5],
+])
+def test_marketplace_crafted_cursor(api_client, position):
+    import json
+    from base64 import b64encode
+    cursor = b64encode(json.dumps({'r': 0, 'p': position}).encode('ascii')).decode('ascii')
+    response = api_client.get('/api/products/marketplace/', {'cursor': cursor})
+    assert response.status_code == status.HTTP_404_NOT_FOUND
 
 @pytest.mark.django_db
 def test_create_order(api_client, create_user, get_token):
@@ -62,6 +238,42 @@ def test_create_order(api_client, create_user, get_token):
     assert response.data['total_price'] == 400.00  # 200.00 * 2 (quantity)
 
 
+@pytest.mark.django_db
+def test_create_order_query_count_is_constant(api_client, create_user):
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+    farmer = create_user(username='farmer1', password='password123')
+    buyer = create_user(username='buyer1', password='password123')
+    products = [
+        Product.objects.create(farmer=farmer, title=f'Chicken {i}', description='Layers', category='number', price=100 + i, stock=10)
+        for i in range(5)
+    ]
+    api_client.force_authenticate(buyer)
+
+    def place(count):
+        data = {'buyer': buyer.id, 'items': [{'product': p.id, 'quantity': 2} for p in products[:count]]}
+        with CaptureQueriesContext(connection) as queries:
+            response = api_client.post('/api/products/orders/', data, format='json')
+        assert response.status_code == status.HTTP_201_CREATED
+        return response, len(queries)
+
+    response, one_item_queries = place(1)
+    response, five_item_queries = place(5)
+    assert five_item_queries == one_item_queries
+    assert response.data['total_price'] == 2 * sum(100 + i for i in range(5))
+    order = Order.objects.get(id=response.data['id'])
+    assert [item.price for item in order.items.order_by('id')] == [2 * (100 + i) for i in range(5)]
+
+@pytest.mark.django_db
+def test_create_order_unknown_product(api_client, create_user):
+    buyer = create_user(username='buyer1', password='password123')
+    api_client.force_authenticate(buyer)
+
+    response = api_client.post('/api/products/orders/', {'buyer': buyer.id, 'items': [{'product': 999999, 'quantity': 1}]}, format='json')
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert 'items' in response.data
+    assert not Order.objects.exists()
+
 @pytest.mark.django_db
 def test_get_order_detail(api_client, create_user, get_token):
     farmer = create_user(username='farmer1', password='password123')
@@ -77,6 +289,45 @@ def test_get_order_detail(api_client, create_user, get_token):
     assert response.status_code == status.HTTP_200_OK
     assert response.data['id'] == order.id
 
+@pytest.mark.django_db
+def test_order_detail_conditional_get(api_client, create_user, django_assert_num_queries):
+    buyer = create_user(username='buyer1', password='password123')
+    other = create_user(username='buyer2', password='password123')
+    order = Order.objects.create(buyer=buyer, total_price=400.00)
+    api_client.force_authenticate(buyer)
+
+    response = api_client.get(f'/api/products/orders/{order.id}/')
+    assert response.status_code == status.HTTP_200_OK
+    etag, last_modified = response['ETag'], response['Last-Modified']
+
+    with django_assert_num_queries(1):
+        response = api_client.get(f'/api/products/orders/{order.id}/', HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == status.HTTP_304_NOT_MODIFIED
+    response = api_client.get(f'/api/products/orders/{order.id}/', HTTP_IF_MODIFIED_SINCE=last_modified)
+    assert response.status_code == status.HTTP_304_NOT_MODIFIED
+
+    order.total_price = 500.00
+    order.save()
+    response = api_client.get(f'/api/products/orders/{order.id}/', HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == status.HTTP_200_OK
+    assert response['ETag'] != etag
+
+    # Validators are looked up through the buyer-scoped queryset.
+    api_client.force_authenticate(other)
+    response = api_client.get(f'/api/products/orders/{order.id}/', HTTP_IF_NONE_MATCH=response['ETag'])
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
+@pytest.mark.django_db
+def test_product_detail_conditional_get(api_client, create_user):
+    farmer = create_user(username='farmer1', password='password123')
+    product = Product.objects.create(farmer=farmer, title='Broilers', description='Live birds', category='number', price=450.00, stock=10)
+    api_client.force_authenticate(farmer)
+
+    response = api_client.get(f'/api/products/{product.id}/')
+    assert response.status_code == status.HTTP_200_OK
+    response = api_client.get(f'/api/products/{product.id}/', HTTP_IF_NONE_MATCH=response['ETag'])
+    assert response.status_code == status.HTTP_304_NOT_MODIFIED
+
 @pytest.mark.django_db
 def test_delete_order(api_client, create_user, get_token):
     buyer = create_user(username='buyer1', password='password123', email='buyer1@example.com')
@@ -109,3 +360,367 @@ def test_buyer_orders(api_client, create_user, get_token):
     assert len(response.data) == 1
     assert float(response.data[0]['total_price']) == 400.00  
 
+
+@pytest.mark.django_db
+def test_product_search_ranks_title_matches_first(api_client, create_user):
+    farmer = create_user(username='farmer1', password='password123')
+    feed = Product.objects.create(farmer=farmer, title='Layers mash', description='Feed for kienyeji chicken.', category='weight', price=50.00, stock=100)
+    chicken = Product.objects.create(farmer=farmer, title='Kienyeji chicken', description='Free range birds.', category='number', price=800.00, stock=10)
+    Product.objects.create(farmer=farmer, title='Turkey', description='Whole turkey.', category='number', price=3000.00, stock=2)
+
+    response = api_client.get('/api/products/search/', {'q': 'chicken'})
+    assert response.status_code == status.HTTP_200_OK
+    assert [p['id'] for p in response.data['results']] == [chicken.id, feed.id]
+    assert response.data['results'][0]['rank'] > response.data['results'][1]['rank']
+
+    # The trigger keeps the document current when a title changes.
+    chicken.title = 'Kienyeji hen'
+    chicken.description = 'Free range birds.'
+    chicken.save()
+    response = api_client.get('/api/products/search/', {'q': 'hen'})
+    assert [p['id'] for p in response.data['results']] == [chicken.id]
+
+@pytest.mark.django_db
+def test_product_search_pages_by_rank(api_client, create_user):
+    farmer = create_user(username='farmer1', password='password123')
+    for i in range(3):
+        Product.objects.create(farmer=farmer, title=f'Broiler {i}', description='Broiler chicken.', category='number', price=500.00, stock=5)
+
+    response = api_client.get('/api/products/search/', {'q': 'broiler', 'page_size': 2})
+    first_page = [p['id'] for p in response.data['results']]
+    response = api_client.get(response.data['next'])
+    assert len(first_page) == 2
+    assert len(response.data['results']) == 1
+    assert response.data['results'][0]['id'] not in first_page
+    assert response.data['next'] is None
+
+@pytest.mark.django_db
+def test_product_search_ranks_newest_candidates(api_client, create_user, settings):
+    settings.SEARCH_CANDIDATE_LIMIT = 2
+    farmer = create_user(username='farmer1', password='password123')
+    oldest = Product.objects.create(farmer=farmer, title='Broiler broiler', description='Broiler chicken.', category='number', price=500.00, stock=5)
+    newer = [Product.objects.create(farmer=farmer, title=f'Layers {i}', description='Not broiler fed.', category='number', price=500.00, stock=5) for i in range(2)]
+
+    # The best match is past the cap, so only the two newest are ranked.
+    response = api_client.get('/api/products/search/', {'q': 'broiler'})
+    assert {p['id'] for p in response.data['results']} == {p.id for p in newer}
+    settings.SEARCH_CANDIDATE_LIMIT = 10
+    response = api_client.get('/api/products/search/', {'q': 'broiler'})
+    assert response.data['results'][0]['id'] == oldest.id
+
+@pytest.mark.django_db
+def test_product_search_requires_query(api_client):
+    response = api_client.get('/api/products/search/')
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+@pytest.mark.django_db
+def test_order_reserves_stock(api_client, create_user):
+    farmer = create_user(username='farmer1', password='password123')
+    buyer = create_user(username='buyer1', password='password123')
+    broilers = Product.objects.create(farmer=farmer, title='Broilers', description='Live birds', category='number', price=450.00, stock=5)
+    layers = Product.objects.create(farmer=farmer, title='Layers', description='Point of lay', category='number', price=900.00, stock=1)
+    api_client.force_authenticate(buyer)
+
+    items = [{'product': broilers.id, 'quantity': 2}, {'product': broilers.id, 'quantity': 1}, {'product': layers.id, 'quantity': 1}]
+    response = api_client.post('/api/products/orders/', {'buyer': buyer.id, 'items': items}, format='json')
+    assert response.status_code == status.HTTP_201_CREATED
+    broilers.refresh_from_db()
+    layers.refresh_from_db()
+    assert (broilers.stock, layers.stock) == (2, 0)
+    assert StockReservation.objects.get(order_id=response.data['id'], product=broilers).quantity == 3
+
+    # Layers are sold out: nothing is written and broiler stock is untouched.
+    items = [{'product': broilers.id, 'quantity': 1}, {'product': layers.id, 'quantity': 1}]
+    response = api_client.post('/api/products/orders/', {'buyer': buyer.id, 'items': items}, format='json')
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    broilers.refresh_from_db()
+    assert broilers.stock == 2
+    assert Order.objects.count() == 1
+
+@pytest.mark.django_db
+def test_expired_reservations_release_stock(api_client, create_user):
+    from datetime import timedelta
+    from django.core.management import call_command
+    from django.utils import timezone
+    from products.reservations import commit_order_reservations
+    farmer = create_user(username='farmer1', password='password123')
+    buyer = create_user(username='buyer1', password='password123')
+    layers = Product.objects.create(farmer=farmer, title='Layers', description='Point of lay', category='number', price=900.00, stock=1)
+    api_client.force_authenticate(buyer)
+
+    order = {'buyer': buyer.id, 'items': [{'product': layers.id, 'quantity': 1}]}
+    assert api_client.post('/api/products/orders/', order, format='json').status_code == status.HTTP_201_CREATED
+    assert api_client.post('/api/products/orders/', order, format='json').status_code == status.HTTP_400_BAD_REQUEST
+
+    # Once the first hold expires, the next order takes the released stock.
+    StockReservation.objects.update(expires_at=timezone.now() - timedelta(minutes=1))
+    assert api_client.post('/api/products/orders/', order, format='json').status_code == status.HTTP_201_CREATED
+    assert list(StockReservation.objects.order_by('id').values_list('status', flat=True)) == ['released', 'held']
+
+    StockReservation.objects.update(expires_at=timezone.now() - timedelta(minutes=1))
+    call_command('release_expired_reservations')
+    layers.refresh_from_db()
+    assert layers.stock == 1
+    assert not StockReservation.objects.filter(status=StockReservation.HELD).exists()
+
+    # Payments landing after expiry take the stock again while it lasts;
+    # the order that finds it gone is returned to be flagged.
+    first, second = Order.objects.order_by('id')
+    assert commit_order_reservations([first.id, second.id]) == [second.id]
+    layers.refresh_from_db()
+    assert layers.stock == 0
+    assert list(StockReservation.objects.order_by('id').values_list('status', flat=True)) == ['committed', 'released']
+
+@pytest.mark.django_db
+def test_delete_order_releases_stock(api_client, create_user):
+    farmer = create_user(username='farmer1', password='password123')
+    buyer = create_user(username='buyer1', password='password123')
+    layers = Product.objects.create(farmer=farmer, title='Layers', description='Point of lay', category='number', price=900.00, stock=3)
+    api_client.force_authenticate(buyer)
+
+    response = api_client.post('/api/products/orders/', {'buyer': buyer.id, 'items': [{'product': layers.id, 'quantity': 2}]}, format='json')
+    response = api_client.delete(f"/api/products/orders/{response.data['id']}/")
+    assert response.status_code == status.HTTP_204_NO_CONTENT
+    layers.refresh_from_db()
+    assert layers.stock == 3
+
+@pytest.mark.django_db
+def test_buyer_orders_export_streams_every_order(api_client, create_user, django_assert_num_queries):
+    import csv, io, json
+    from products.views import BuyerOrdersExportView
+    farmer = create_user(username='farmer1', password='password123')
+    buyer = create_user(username='buyer1', password='password123')
+    broilers = Product.objects.create(farmer=farmer, title='Broilers', description='Live birds', category='number', price=450.00, stock=100)
+    eggs = Product.objects.create(farmer=farmer, title='Eggs', description='Tray of 30', category='number', price=420.00, stock=100)
+    api_client.force_authenticate(buyer)
+    for _ in range(3):
+        data = {'buyer': buyer.id, 'items': [{'product': broilers.id, 'quantity': 1}, {'product': eggs.id, 'quantity': 2}]}
+        api_client.post('/api/products/orders/', data, format='json')
+
+    # Small chunks: one server-side cursor, then an items prefetch for each
+    # of the three one-order chunks.
+    BuyerOrdersExportView.export_chunk_size = 1
+    try:
+        response = api_client.get('/api/products/orders/buyer/export.ndjson')
+        assert response.status_code == status.HTTP_200_OK
+        assert response['Content-Type'] == 'application/x-ndjson'
+        with django_assert_num_queries(1 + 3):
+            body = b''.join(response.streaming_content).decode()
+    finally:
+        del BuyerOrdersExportView.export_chunk_size
+    orders = [json.loads(line) for line in body.splitlines()]
+    assert len(orders) == 3
+    assert orders[0]['total_price'] == '1290.00'
+    assert orders[0]['items'] == [
+        {'product': broilers.id, 'quantity': 1, 'price': '450.00'},
+        {'product': eggs.id, 'quantity': 2, 'price': '840.00'},
+    ]
+
+    response = api_client.get('/api/products/orders/buyer/export.csv')
+    assert response['Content-Disposition'] == 'attachment; filename="buyer-orders.csv"'
+    rows = list(csv.DictReader(io.StringIO(b''.join(response.streaming_content).decode())))
+    assert len(rows) == 6
+    assert {row['product_id'] for row in rows} == {str(broilers.id), str(eggs.id)}
+
+    assert api_client.get('/api/products/orders/buyer/export.xml').status_code == status.HTTP_404_NOT_FOUND
+
+@pytest.mark.django_db(transaction=True)
+def test_buyer_orders_export_streams_async_under_asgi(api_client, create_user, get_token):
+    import json
+    from asgiref.sync import async_to_sync
+    from django.test import AsyncClient
+    farmer = create_user(username='farmer1', password='password123')
+    buyer = create_user(username='buyer1', password='password123')
+    broilers = Product.objects.create(farmer=farmer, title='Broilers', description='Live birds', category='number', price=450.00, stock=100)
+    api_client.force_authenticate(buyer)
+    for _ in range(3):
+        api_client.post('/api/products/orders/', {'buyer': buyer.id, 'items': [{'product': broilers.id, 'quantity': 1}]}, format='json')
+    headers = {'Authorization': f"Bearer {get_token('buyer1', 'password123')}"}
+
+    async def export():
+        response = await AsyncClient().get('/api/products/orders/buyer/export.ndjson', headers=headers)
+        assert response.status_code == status.HTTP_200_OK
+        assert response.is_async
+        return b''.join([chunk async for chunk in response.streaming_content]).decode()
+
+    orders = [json.loads(line) for line in async_to_sync(export)().splitlines()]
+    assert len(orders) == 3
+    assert {order['items'][0]['product'] for order in orders} == {broilers.id}
+
+@pytest.mark.django_db
+def test_nearby_products_nearest_first(api_client, create_user):
+    from profiles.models import FarmerProfile
+    farms = {}
+    for town in ['Kiambu', 'Thika', 'Nakuru', 'Mombasa']:
+        farmer = create_user(username=f'farmer_{town.lower()}', password='password123')
+        FarmerProfile.objects.create(user=farmer, location=town)
+        farms[town] = Product.objects.create(farmer=farmer, title=f'{town} broilers', description='Live birds', category='number', price=450.00, stock=5)
+
+    response = api_client.get('/api/products/nearby/', {'town': 'Nairobi', 'limit': 3})
+    assert response.status_code == status.HTTP_200_OK
+    assert [row['id'] for row in response.data['results']] == [farms['Kiambu'].id, farms['Thika'].id, farms['Nakuru'].id]
+    assert response.data['results'][0]['location'] == 'Kiambu'
+    assert 10 < response.data['results'][0]['distance_km'] < 15
+    # Nakuru is ~120 km out, so the search had to widen past 100 km.
+    assert response.data['radius_km'] == 250
+
+    response = api_client.get('/api/products/nearby/', {'lat': -1.2864, 'lon': 36.8172, 'radius': 50})
+    assert [row['id'] for row in response.data['results']] == [farms['Kiambu'].id, farms['Thika'].id]
+
+    assert api_client.get('/api/products/nearby/', {'town': 'Atlantis'}).status_code == status.HTTP_400_BAD_REQUEST
+    assert api_client.get('/api/products/nearby/').status_code == status.HTTP_400_BAD_REQUEST
+
+@pytest.mark.django_db
+def test_popularity_counters_and_popular_ordering(api_client, create_user):
+    from django.core.management import call_command
+    farmer = create_user(username='farmer1', password='password123')
+    buyer = create_user(username='buyer1', password='password123')
+    quiet, steady, hot = [
+        Product.objects.create(farmer=farmer, title=title, description='Birds', category='number', price=450.00, stock=100)
+        for title in ['Quiet', 'Steady', 'Hot']
+    ]
+    api_client.force_authenticate(buyer)
+    order_ids = []
+    for items in ([(hot, 5), (steady, 1)], [(hot, 2), (hot, 1)], [(steady, 3)]):
+        data = {'buyer': buyer.id, 'items': [{'product': p.id, 'quantity': q} for p, q in items]}
+        order_ids.append(api_client.post('/api/products/orders/', data, format='json').data['id'])
+
+    counters = lambda: dict(Product.objects.values_list('title', 'units_sold'))
+    assert counters() == {'Quiet': 0, 'Steady': 4, 'Hot': 8}
+    assert Product.objects.get(pk=hot.pk).order_count == 2
+
+    response = api_client.get('/api/products/marketplace/', {'ordering': 'popular', 'page_size': 2})
+    assert [row['id'] for row in response.data['results']] == [hot.id, steady.id]
+    response = api_client.get(response.data['next'])
+    assert [row['id'] for row in response.data['results']] == [quiet.id]
+    assert api_client.get('/api/products/marketplace/', {'ordering': 'price'}).status_code == status.HTTP_400_BAD_REQUEST
+
+    api_client.delete(f'/api/products/orders/{order_ids[1]}/')
+    assert counters() == {'Quiet': 0, 'Steady': 4, 'Hot': 5}
+
+    Product.objects.filter(pk=quiet.pk).update(units_sold=7, order_count=3)
+    call_command('reconcile_popularity', batch_size=2)
+    assert counters() == {'Quiet': 0, 'Steady': 4, 'Hot': 5}
+    assert Product.objects.get(pk=quiet.pk).order_count == 0
+
+@pytest.mark.django_db
+def test_trending_products(api_client, create_user):
+    from datetime import timedelta
+    from django.core.cache import cache
+    from django.core.management import call_command
+    from django.utils import timezone
+    from products.models import ProductTrend
+    from products.trending import current_score, rebuild_trending
+    cache.clear()
+    farmer = create_user(username='farmer1', password='password123')
+    buyer = create_user(username='buyer1', password='password123')
+    broilers, layers, feed = [
+        Product.objects.create(farmer=farmer, title=title, description='Stock', category=category, price=300.00, stock=100)
+        for title, category in [('Broilers', 'number'), ('Layers', 'number'), ('Feed', 'weight')]
+    ]
+    api_client.force_authenticate(buyer)
+    for items in ([(layers, 3), (feed, 2)], [(broilers, 2), (broilers, 2)]):
+        data = {'buyer': buyer.id, 'items': [{'product': p.id, 'quantity': q} for p, q in items]}
+        assert api_client.post('/api/products/orders/', data, format='json').status_code == status.HTTP_201_CREATED
+
+    response = api_client.get('/api/products/trending/')
+    assert response.status_code == status.HTTP_200_OK
+    assert [row['id'] for row in response.data['results']['number']] == [broilers.id, layers.id]
+    assert [row['id'] for row in response.data['results']['weight']] == [feed.id]
+    assert response.data['results']['number'][0]['score'] == pytest.approx(4, abs=0.01)
+    response = api_client.get('/api/products/trending/', {'category': 'number', 'limit': 1})
+    assert list(response.data['results']) == ['number']
+    assert [row['id'] for row in response.data['results']['number']] == [broilers.id]
+    assert api_client.get('/api/products/trending/', {'limit': 0}).status_code == status.HTTP_400_BAD_REQUEST
+
+    # Zero-quantity items are still accepted and leave the scores alone.
+    data = {'buyer': buyer.id, 'items': [{'product': feed.id, 'quantity': 0}]}
+    assert api_client.post('/api/products/orders/', data, format='json').status_code == status.HTTP_201_CREATED
+    data = {'buyer': buyer.id, 'items': [{'product': feed.id, 'quantity': 0}, {'product': layers.id, 'quantity': 0}]}
+    assert api_client.post('/api/products/orders/', data, format='json').status_code == status.HTTP_201_CREATED
+
+    # A sale loses half its weight per half-life; the rebuild from the
+    # orders agrees with the incremental scores.
+    scores = dict(ProductTrend.objects.values_list('product_id', 'log_score'))
+    later = timezone.now() + timedelta(hours=48)
+    assert current_score(scores[layers.id], later) == pytest.approx(1.5, abs=0.01)
+    assert rebuild_trending() == 3
+    assert dict(ProductTrend.objects.values_list('product_id', 'log_score')) == pytest.approx(scores)
+
+    # Products that stop selling drop out of the feed and the table.
+    Order.objects.filter(items__product=broilers).update(created_at=timezone.now() - timedelta(days=8))
+    ProductTrend.objects.filter(product=broilers).update(updated_at=timezone.now() - timedelta(days=8))
+    cache.clear()
+    response = api_client.get('/api/products/trending/', {'category': 'number'})
+    assert [row['id'] for row in response.data['results']['number']] == [layers.id]
+    call_command('refresh_trending')
+    assert not ProductTrend.objects.filter(product=broilers).exists()
+    call_command('refresh_trending', rebuild=True)
+    assert set(ProductTrend.objects.values_list('product_id', flat=True)) == {layers.id, feed.id}
+
+@pytest.mark.django_db
+def test_recommendations(api_client, create_user, django_capture_on_commit_callbacks):
+    from django.core.management import call_command
+    from products.models import BuyerRecommendation, ProductTerm
+    from profiles.models import BuyerProfile
+    farmer = create_user(username='farmer1', password='password123')
+    buyer = create_user(username='buyer1', password='password123')
+    with django_capture_on_commit_callbacks(execute=True):
+        layers, broilers, feed, sold_out = [
+            Product.objects.create(farmer=farmer, title=title, description=description, category='number', price=300.00, stock=stock)
+            for title, description, stock in [
+                ('Kienyeji layers', 'Laying hens, vaccinated.', 10),
+                ('Broiler chicks', 'Day old chicks for broiler farming.', 10),
+                ('Layers mash', 'Feed for laying hens.', 10),
+                ('Old layers', 'Hens past laying.', 0),
+            ]
+        ]
+    assert set(ProductTerm.objects.filter(product=layers).values_list('term', flat=True)) == {'kienyeji', 'layer', 'lay', 'hen', 'vaccin'}
+
+    with django_capture_on_commit_callbacks(execute=True):
+        BuyerProfile.objects.create(user=buyer, preferred_products='Laying hens and layer feed')
+    api_client.force_authenticate(buyer)
+    response = api_client.get('/api/products/recommended/')
+    assert response.status_code == status.HTTP_200_OK
+    assert [row['id'] for row in response.data['results']] == [feed.id, layers.id]
+    assert response.data['results'][0]['score'] > response.data['results'][1]['score'] > 0
+
+    # Editing a product reindexes just that product.
+    with django_capture_on_commit_callbacks(execute=True):
+        broilers.title = 'Broiler layers cross'
+        broilers.save()
+    assert ProductTerm.objects.filter(product=broilers, term='layer').exists()
+    call_command('refresh_recommendations', buyers=[buyer.id])
+    assert list(BuyerRecommendation.objects.filter(buyer=buyer).order_by('rank').values_list('product_id', flat=True)) == [feed.id, layers.id, broilers.id]
+
+    api_client.force_authenticate(farmer)
+    assert api_client.get('/api/products/recommended/').data['results'] == []
+
+@pytest.mark.django_db
+def test_recommendations_scored_in_blocks_with_cached_index(create_user, django_capture_on_commit_callbacks, django_assert_num_queries):
+    from products.models import BuyerRecommendation
+    from products.recommendations import refresh_recommendations
+    from profiles.models import BuyerProfile
+    farmer = create_user(username='farmer1', password='password123')
+    buyer = create_user(username='buyer1', password='password123')
+    with django_capture_on_commit_callbacks(execute=True):
+        products = [
+            Product.objects.create(farmer=farmer, title=f'Layers batch {i}', description='Laying hens ' * (i + 1), category='number', price=300.00, stock=10)
+            for i in range(7)
+        ] + [Product.objects.create(farmer=farmer, title='Broiler chicks', description='Day old chicks.', category='number', price=300.00, stock=10)]
+        BuyerProfile.objects.create(user=buyer, preferred_products='Laying hens')
+
+    def ranking():
+        return list(BuyerRecommendation.objects.filter(buyer=buyer).order_by('rank').values_list('product_id', flat=True))
+    expected = ranking()
+    assert len(expected) == 7 and products[-1].id not in expected
+    refresh_recommendations([buyer.id], top_n=3, block_size=2)
+    assert ranking() == expected[:3]
+
+    # Later single-buyer refreshes reuse the loaded index: profile, existing
+    # products, then delete + insert in a transaction.
+    deleted = products[0].id
+    products[0].delete()
+    with django_assert_num_queries(6):
+        refresh_recommendations([buyer.id])
+    assert ranking() == [product for product in expected if product != deleted]
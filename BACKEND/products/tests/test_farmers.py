@@ -121,3 +121,292 @@ def test_farmer_orders(api_client, create_user, get_token):
 #  test for a farmer to be able to edit a product
 #api endpoint /api/products/edit/<int:pk>/
 
+@pytest.mark.django_db
+def test_farmer_orders_only_show_own_items(api_client, create_user):
+    farmer = create_user(username='farmer1', password='password123')
+    neighbour = create_user(username='farmer2', password='password123')
+    buyer = create_user(username='buyer1', password='password123')
+    broilers = Product.objects.create(farmer=farmer, title='Broilers', description='Live birds', category='number', price=450.00, stock=10)
+    feed = Product.objects.create(farmer=neighbour, title='Layers mash', description='Feed', category='weight', price=50.00, stock=100)
+    api_client.force_authenticate(buyer)
+    for items in ([broilers, feed], [feed], [broilers]):
+        response = api_client.post('/api/products/orders/', {'buyer': buyer.id, 'items': [{'product': p.id, 'quantity': 1} for p in items]}, format='json')
+        assert response.status_code == status.HTTP_201_CREATED
+
+    api_client.force_authenticate(farmer)
+    response = api_client.get('/api/products/orders/farmer/')
+    assert response.status_code == status.HTTP_200_OK
+    assert len(response.data) == 2
+    assert response.data[0]['id'] > response.data[1]['id']
+    assert all(item['product'] == broilers.id for order in response.data for item in order['items'])
+
+@pytest.mark.django_db
+def test_farmer_sales_dashboard(api_client, create_user):
+    from django.core.management import call_command
+    from products.models import FarmerDailySales
+    farmer = create_user(username='farmer1', password='password123')
+    buyer = create_user(username='buyer1', password='password123')
+    broilers = Product.objects.create(farmer=farmer, title='Broilers', description='Live birds', category='number', price=450.00, stock=10)
+    layers = Product.objects.create(farmer=farmer, title='Layers', description='Point of lay', category='number', price=900.00, stock=10)
+    api_client.force_authenticate(buyer)
+    for items in ([(broilers, 2), (layers, 1)], [(broilers, 1)]):
+        data = {'buyer': buyer.id, 'items': [{'product': p.id, 'quantity': q} for p, q in items]}
+        assert api_client.post('/api/products/orders/', data, format='json').status_code == status.HTTP_201_CREATED
+
+    api_client.force_authenticate(farmer)
+    response = api_client.get('/api/products/my-products/dashboard/', {'days': 7})
+    assert response.status_code == status.HTTP_200_OK
+    assert response.data['totals'] == {'revenue': '2250.00', 'units': 4, 'orders': 2}
+    assert len(response.data['daily']) == 1
+    assert [(p['title'], p['revenue'], p['units'], p['orders']) for p in response.data['products']] == [
+        ('Broilers', '1350.00', 3, 2),
+        ('Layers', '900.00', 1, 1),
+    ]
+
+    # A rebuild from the order tables lands on the same numbers.
+    FarmerDailySales.objects.update(units=0)
+    call_command('rebuild_sales_rollups')
+    response = api_client.get('/api/products/my-products/dashboard/')
+    assert [p['units'] for p in response.data['products']] == [3, 1]
+    assert response.data['totals']['orders'] == 2
+
+@pytest.mark.django_db
+def test_rollups_written_last_in_key_order(create_user):
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+    from products.models import FarmerDailyTotals
+    from products.services import place_order
+    first = create_user(username='farmer1', password='password123')
+    second = create_user(username='farmer2', password='password123')
+    buyer = create_user(username='buyer1', password='password123')
+    layers = Product.objects.create(farmer=second, title='Layers', description='Point of lay', category='number', price=900.00, stock=10)
+    broilers = Product.objects.create(farmer=first, title='Broilers', description='Live birds', category='number', price=450.00, stock=10)
+
+    layers.refresh_from_db()
+    broilers.refresh_from_db()
+    with CaptureQueriesContext(connection) as queries:
+        place_order(buyer, [{'product': layers, 'quantity': 1}, {'product': broilers, 'quantity': 1}])
+    # The shared farmer/day row is locked at the very end of the transaction,
+    # after the stock, and rows are visited in key order whatever the item order.
+    totals = connection.ops.quote_name(FarmerDailyTotals._meta.db_table)
+    statements = [query['sql'].strip() for query in queries.captured_queries if 'SAVEPOINT' not in query['sql']]
+    assert statements[-1].startswith(f'INSERT INTO {totals}')
+    assert statements[-1].index(f"({first.id}, ") < statements[-1].index(f"({second.id}, ")
+    assert any('stock' in statement and statement.startswith('UPDATE') for statement in statements[:-2])
+
+@pytest.mark.django_db
+def test_bulk_import_csv_reports_bad_rows(api_client, create_user):
+    farmer = create_user(username='farmer1', password='password123')
+    api_client.force_authenticate(farmer)
+    body = (
+        "title,description,category,price,stock\n"
+        "Broilers,Live birds,number,450.00,10\n"
+        "Layers,Point of lay,dozen,900.00,5\n"
+        "Kienyeji,Free range,weight,-,3\n"
+        "Eggs,Tray of 30,number,420.00,50\n"
+    )
+    response = api_client.generic('POST', '/api/products/import/', body, content_type='text/csv')
+    assert response.status_code == status.HTTP_200_OK
+    assert response.data['created'] == 2
+    assert [error['row'] for error in response.data['errors']] == [3, 4]
+    assert 'category' in response.data['errors'][0]['errors']
+    assert 'price' in response.data['errors'][1]['errors']
+    assert sorted(farmer.products.values_list('title', flat=True)) == ['Broilers', 'Eggs']
+
+    # Undecodable bytes and surplus columns fail their own row only.
+    body = (
+        "title,description,category,price,stock\n"
+        "Broilers,Live birds,number,450.00,10\n"
+        "Layers,Point of lay,number,900.00,5,extra\n"
+    ).encode() + b"Kienyeji,Free \xff range,weight,600.00,3\n" + b"Eggs,Tray of 30,number,420.00,50\n"
+    response = api_client.generic('POST', '/api/products/import/', body, content_type='text/csv')
+    assert response.status_code == status.HTTP_200_OK
+    assert response.data['created'] == 2
+    assert [(error['row'], error['errors']['non_field_errors']) for error in response.data['errors']] == [
+        (3, ['Expected 5 columns, got 6.']),
+        (4, ['Not valid UTF-8 text.']),
+    ]
+
+@pytest.mark.django_db
+def test_bulk_import_ndjson_chunks(api_client, create_user, django_assert_max_num_queries):
+    from products.importers import import_products, iter_records
+    import io, json
+    farmer = create_user(username='farmer1', password='password123')
+    lines = [json.dumps({'title': f'Batch {i}', 'description': 'Layers', 'category': 'number', 'price': '100.00', 'stock': i}) for i in range(25)]
+    lines.insert(3, '{not json')
+    stream = io.BytesIO('\n'.join(lines).encode() + b'\n{"title": "Bad \xff"}\n')
+    # One INSERT per chunk plus the savepoint queries around it.
+    with django_assert_max_num_queries(3 * 3):
+        result = import_products(farmer, iter_records(stream, 'ndjson'), chunk_size=10)
+    assert result['created'] == 25
+    assert result['errors'] == [
+        {'row': 4, 'errors': {'non_field_errors': ['Invalid JSON.']}},
+        {'row': 27, 'errors': {'non_field_errors': ['Not valid UTF-8 text.']}},
+    ]
+    assert Product.objects.filter(farmer=farmer).count() == 25
+
+@pytest.mark.django_db
+def test_bulk_import_caps_reported_errors(create_user):
+    from products.importers import import_products
+    farmer = create_user(username='farmer1', password='password123')
+    records = ((number, 'Invalid JSON.') for number in range(1, 5001))
+    result = import_products(farmer, records, max_errors=100)
+    assert result['created'] == 0
+    assert result['failed'] == 5000
+    assert [error['row'] for error in result['errors']] == list(range(1, 101))
+
+@pytest.mark.django_db
+def test_bulk_import_rejects_unknown_content_type(api_client, create_user):
+    api_client.force_authenticate(create_user(username='farmer1', password='password123'))
+    response = api_client.generic('POST', '/api/products/import/', 'a,b', content_type='text/plain')
+    assert response.status_code == status.HTTP_415_UNSUPPORTED_MEDIA_TYPE
+
+@pytest.mark.django_db
+def test_batch_update_prices_and_stock(api_client, create_user, django_assert_num_queries):
+    farmer = create_user(username='farmer1', password='password123')
+    products = [
+        Product.objects.create(farmer=farmer, title=f'Tray {i}', description='Eggs', category='number', price=400.00, stock=10)
+        for i in range(3)
+    ]
+    api_client.force_authenticate(farmer)
+    data = {'items': [
+        {'id': products[0].id, 'price': '420.00', 'stock': 8},
+        {'id': products[1].id, 'price': '410.50'},
+        {'id': products[2].id, 'stock': 0},
+    ]}
+    # Session/auth lookups aside, the update itself is a single statement.
+    with django_assert_num_queries(3):
+        response = api_client.patch('/api/products/edit/batch/', data, format='json')
+    assert response.status_code == status.HTTP_200_OK
+    assert response.data == {'updated': 3}
+    assert [(str(p.price), p.stock) for p in Product.objects.order_by('id')] == [
+        ('420.00', 8), ('410.50', 10), ('400.00', 0),
+    ]
+
+@pytest.mark.django_db
+def test_batch_update_rejects_other_farmers_products(api_client, create_user):
+    farmer = create_user(username='farmer1', password='password123')
+    other = create_user(username='farmer2', password='password123')
+    mine = Product.objects.create(farmer=farmer, title='Broilers', description='Live birds', category='number', price=450.00, stock=10)
+    theirs = Product.objects.create(farmer=other, title='Layers', description='Point of lay', category='number', price=900.00, stock=5)
+    api_client.force_authenticate(farmer)
+    data = {'items': [{'id': mine.id, 'stock': 1}, {'id': theirs.id, 'stock': 0}]}
+    response = api_client.patch('/api/products/edit/batch/', data, format='json')
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert response.data['items'] == [f'Invalid product id(s): {theirs.id}.']
+    # Nothing was applied, not even the farmer's own change.
+    mine.refresh_from_db()
+    theirs.refresh_from_db()
+    assert (mine.stock, theirs.stock) == (10, 5)
+
+    response = api_client.patch('/api/products/edit/batch/', {'items': [{'id': mine.id}]}, format='json')
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+@pytest.mark.django_db
+def test_farmer_orders_export_has_only_own_items(api_client, create_user):
+    import json
+    farmer = create_user(username='farmer1', password='password123')
+    other = create_user(username='farmer2', password='password123')
+    buyer = create_user(username='buyer1', password='password123')
+    mine = Product.objects.create(farmer=farmer, title='Broilers', description='Live birds', category='number', price=450.00, stock=10)
+    theirs = Product.objects.create(farmer=other, title='Layers', description='Point of lay', category='number', price=900.00, stock=10)
+    api_client.force_authenticate(buyer)
+    data = {'buyer': buyer.id, 'items': [{'product': mine.id, 'quantity': 1}, {'product': theirs.id, 'quantity': 1}]}
+    api_client.post('/api/products/orders/', data, format='json')
+
+    api_client.force_authenticate(farmer)
+    response = api_client.get('/api/products/orders/farmer/export.ndjson')
+    orders = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+    assert [item['product'] for order in orders for item in order['items']] == [mine.id]
+    # The farmer's share only, not what the buyer spent with others.
+    assert [order['total_price'] for order in orders] == ['450.00']
+    response = api_client.get('/api/products/orders/farmer/export.csv')
+    assert b''.join(response.streaming_content).decode().splitlines()[1].split(',')[3] == '450.00'
+    assert [order['total_price'] for order in api_client.get('/api/products/orders/farmer/').data] == [450.0]
+
+def make_image(color, size=(1200, 800), fmt='JPEG'):
+    from io import BytesIO
+    from django.core.files.uploadedfile import SimpleUploadedFile
+    from PIL import Image
+    buffer = BytesIO()
+    Image.new('RGB', size, color).save(buffer, fmt)
+    return SimpleUploadedFile('photo.jpg', buffer.getvalue(), content_type='image/jpeg')
+
+@pytest.mark.django_db
+def test_product_image_upload_thumbnails_and_dedup(api_client, create_user, settings, tmp_path, django_capture_on_commit_callbacks):
+    from PIL import Image
+    settings.MEDIA_ROOT = str(tmp_path)
+    settings.SERVE_MEDIA = True
+    farmer = create_user(username='farmer1', password='password123')
+    first = Product.objects.create(farmer=farmer, title='Broilers', description='Live birds', category='number', price=450.00, stock=10)
+    second = Product.objects.create(farmer=farmer, title='More broilers', description='Live birds', category='number', price=450.00, stock=10)
+    api_client.force_authenticate(farmer)
+
+    with django_capture_on_commit_callbacks(execute=True):
+        response = api_client.put(f'/api/products/edit/{first.id}/image/', {'image': make_image('red')}, format='multipart')
+    assert response.status_code == status.HTTP_202_ACCEPTED
+    with django_capture_on_commit_callbacks(execute=True):
+        api_client.put(f'/api/products/edit/{second.id}/image/', {'image': make_image('red')}, format='multipart')
+
+    first.refresh_from_db()
+    second.refresh_from_db()
+    # Same bytes, same stored files.
+    assert first.image == second.image and first.thumbnails == second.thumbnails
+    assert len(list((tmp_path / 'products' / 'originals').rglob('*.jpg'))) == 1
+    assert set(first.thumbnails) == set(settings.THUMBNAIL_SIZES)
+    with Image.open(tmp_path / first.thumbnails['small']) as thumbnail:
+        assert thumbnail.size == (160, 107)
+
+    # Listings only ever carry thumbnail URLs.
+    response = api_client.get('/api/products/marketplace/')
+    listed = {row['id']: row for row in response.data['results']}[first.id]
+    assert list(listed['thumbnails']) == list(settings.THUMBNAIL_SIZES)
+    assert all(url.endswith('.webp') for url in listed['thumbnails'].values())
+    assert first.image not in str(response.data)
+
+    media = api_client.get(listed['thumbnails']['small'])
+    assert media.status_code == status.HTTP_200_OK
+    assert 'immutable' in media['Cache-Control']
+    assert api_client.get('/media/../manage.py').status_code == status.HTTP_404_NOT_FOUND
+
+@pytest.mark.django_db
+def test_failed_thumbnails_regenerated_by_command(api_client, create_user, settings, tmp_path, django_capture_on_commit_callbacks):
+    from datetime import timedelta
+    from unittest import mock
+    from django.core.management import call_command
+    settings.MEDIA_ROOT = str(tmp_path)
+    farmer = create_user(username='farmer1', password='password123')
+    product = Product.objects.create(farmer=farmer, title='Broilers', description='Live birds', category='number', price=450.00, stock=10)
+    api_client.force_authenticate(farmer)
+    with mock.patch('products.images.make_thumbnails', side_effect=OSError('disk full')):
+        with django_capture_on_commit_callbacks(execute=True):
+            api_client.put(f'/api/products/edit/{product.id}/image/', {'image': make_image('red')}, format='multipart')
+    product.refresh_from_db()
+    assert product.image and product.thumbnails == {}
+
+    # Left alone while a render may still be queued.
+    call_command('regenerate_thumbnails')
+    product.refresh_from_db()
+    assert product.thumbnails == {}
+    Product.objects.filter(pk=product.pk).update(updated_at=product.updated_at - timedelta(minutes=15))
+    call_command('regenerate_thumbnails')
+    product.refresh_from_db()
+    assert set(product.thumbnails) == set(settings.THUMBNAIL_SIZES)
+    assert all((tmp_path / name).exists() for name in product.thumbnails.values())
+
+@pytest.mark.django_db
+def test_product_image_upload_rejects_non_images_and_other_farmers(api_client, create_user, settings, tmp_path):
+    from django.core.files.uploadedfile import SimpleUploadedFile
+    settings.MEDIA_ROOT = str(tmp_path)
+    farmer = create_user(username='farmer1', password='password123')
+    other = create_user(username='farmer2', password='password123')
+    product = Product.objects.create(farmer=farmer, title='Broilers', description='Live birds', category='number', price=450.00, stock=10)
+
+    api_client.force_authenticate(farmer)
+    bogus = SimpleUploadedFile('photo.jpg', b'not an image', content_type='image/jpeg')
+    response = api_client.put(f'/api/products/edit/{product.id}/image/', {'image': bogus}, format='multipart')
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    api_client.force_authenticate(other)
+    response = api_client.put(f'/api/products/edit/{product.id}/image/', {'image': make_image('red')}, format='multipart')
+    assert response.status_code == status.HTTP_404_NOT_FOUND
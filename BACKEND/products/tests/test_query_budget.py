@@ -0,0 +1,69 @@
+"""
+Query budgets for the product and order list endpoints.
+
+Each endpoint is exercised with enough rows, farmers and order items that
+an N+1 pattern would blow its budget, so a regression fails loudly here.
+"""
+import pytest
+from django.contrib.auth import get_user_model
+from rest_framework.test import APIClient
+
+from products.cache import forget_catalog_version, get_catalog_version
+from products.models import Product, Order, OrderItem
+
+User = get_user_model()
+
+ROWS = 8
+
+
+@pytest.fixture
+def api_client():
+    return APIClient()
+
+
+@pytest.fixture
+def catalog(db):
+    farmers = [
+        User.objects.create_user(username=f'farmer{i}', email=f'farmer{i}@example.com', password=None, user_type='farmer')
+        for i in range(ROWS)
+    ]
+    buyer = User.objects.create_user(username='buyer1', email='buyer1@example.com', password=None, user_type='buyer')
+    products = [
+        Product.objects.create(farmer=farmer, title=f'Broilers {i}', description='Broiler chicken', category='number', price=450, stock=10)
+        for i, farmer in enumerate(farmers)
+    ]
+    for i in range(ROWS):
+        order = Order.objects.create(buyer=buyer, total_price=900)
+        OrderItem.objects.create(order=order, product=products[0], quantity=1)
+        OrderItem.objects.create(order=order, product=products[i], quantity=1)
+    for i in range(ROWS):
+        Product.objects.create(farmer=farmers[0], title=f'Layers {i}', description='Layers', category='number', price=900, stock=4)
+    # Seed the shared catalog version, but leave this process to read it
+    # again as a worker does once its copy expires.
+    get_catalog_version()
+    forget_catalog_version()
+    return {'farmer': farmers[0], 'buyer': buyer}
+
+
+@pytest.mark.parametrize('url, user, budget', [
+    ('/api/products/marketplace/', None, 3),  # catalog version + page + facets
+    ('/api/products/', 'buyer', 1),
+    ('/api/products/search/?q=chicken', None, 1),
+    ('/api/products/my-products/', 'farmer', 1),
+    ('/api/products/orders/farmer/', 'farmer', 2),  # orders + items
+    ('/api/products/orders/buyer/', 'buyer', 2),
+])
+def test_list_endpoint_query_budget(api_client, catalog, django_assert_max_num_queries, url, user, budget):
+    if user:
+        api_client.force_authenticate(catalog[user])
+    with django_assert_max_num_queries(budget):
+        response = api_client.get(url)
+    assert response.status_code == 200
+
+
+def test_server_timing_header(api_client, catalog, settings):
+    settings.SERVER_TIMING = True
+    response = api_client.get('/api/products/marketplace/')
+    assert 'desc="3 queries"' in response['Server-Timing']
+    settings.SERVER_TIMING = False
+    assert not api_client.get('/api/products/marketplace/').has_header('Server-Timing')
@@ -0,0 +1,26 @@
+import pytest
+from django.contrib.auth import get_user_model
+from rest_framework.renderers import JSONRenderer
+
+from products.models import Product
+from products.serializers import ProductSerializer, ProductRowSerializer
+
+User = get_user_model()
+
+
+@pytest.mark.django_db
+def test_product_row_serializer_matches_model_serializer():
+    farmer = User.objects.create_user(username='farmer1', email='farmer1@example.com', password=None)
+    Product.objects.create(farmer=farmer, title='Kienyeji "hen"', description='Free range\nbirds', category='number', price=850.5, stock=3)
+    Product.objects.create(farmer=farmer, title='Dressed chicken', description='', category='weight', price=0, stock=0)
+    Product.objects.create(
+        farmer=farmer, title='Eggs', description='Tray', category='number', price=420, stock=9,
+        image='products/originals/ab/ab.jpg',
+        thumbnails={'large': 'products/thumbnails/ab/ab-960.webp', 'small': 'products/thumbnails/ab/ab-160.webp'},
+    )
+    queryset = Product.objects.order_by('id')
+
+    slow = ProductSerializer(queryset.select_related('farmer'), many=True).data
+    fast = ProductRowSerializer(ProductRowSerializer.rows(queryset), many=True).data
+
+    assert JSONRenderer().render(fast) == JSONRenderer().render(slow)
@@ -0,0 +1,141 @@
+"""
+"Trending this week": products ranked by exponentially decayed sales.
+
+A sale of ``q`` units at time ``t`` is worth ``q * e^(-(now - t) / tau)``
+now, where ``tau`` follows from ``TRENDING_HALF_LIFE_HOURS``. Because every
+score decays by the same factor, ProductTrend stores the sum in growing
+form, ``ln(sum(q * e^(t / tau)))``: ranking by it equals ranking by the
+decayed score, a new sale is one log-add-exp onto its product's row, and
+nothing has to be rewritten as time passes. Keeping the log avoids the
+overflow the plain exponential would hit after a few years.
+
+Orders update the table in their own transaction with one ``INSERT ... ON
+CONFLICT`` (see ``place_order``), so reads never touch the order tables.
+Products that have not sold within ``TRENDING_WINDOW_DAYS`` drop out of the
+feed and are deleted by ``prune_trending``. Each category's top
+``TRENDING_TOP_K`` is cached for ``TRENDING_CACHE_TIMEOUT`` seconds.
+"""
+import math
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import Order, OrderItem, Product, ProductTrend
+
+
+def decay_rate():
+    """
+    ``1 / tau`` in 1/seconds.
+    """
+    return math.log(2) / (settings.TRENDING_HALF_LIFE_HOURS * 3600)
+
+
+def log_weight(quantity, when):
+    return math.log(quantity) + when.timestamp() * decay_rate()
+
+
+def current_score(log_score, now):
+    """
+    The decayed number of units a stored ``log_score`` is worth at ``now``.
+    """
+    return math.exp(log_score - now.timestamp() * decay_rate())
+
+
+def record_trending(order, items):
+    """
+    Add a newly placed order's items to their products' trend scores.
+    Zero-quantity items, which orders accept, add nothing (as in
+    ``rebuild_trending``).
+    """
+    quantities = defaultdict(int)
+    categories = {}
+    for item in items:
+        if item.quantity < 1:
+            continue
+        quantities[item.product_id] += item.quantity
+        categories[item.product_id] = item.product.category
+    if not quantities:
+        return
+    table = connection.ops.quote_name(ProductTrend._meta.db_table)
+    # Sorted so concurrent orders lock shared rows in the same order.
+    rows = [
+        (product_id, categories[product_id], log_weight(quantity, order.created_at), order.created_at)
+        for product_id, quantity in sorted(quantities.items())
+    ]
+    placeholders = ', '.join(['(%s, %s, %s, %s)'] * len(rows))
+    # ln(e^a + e^b) computed as max(a, b) + ln(1 + e^-|a - b|).
+    sql = f"""
+        INSERT INTO {table} (product_id, category, log_score, updated_at) VALUES {placeholders}
+        ON CONFLICT (product_id) DO UPDATE SET
+            category = EXCLUDED.category,
+            log_score = GREATEST({table}.log_score, EXCLUDED.log_score)
+                + LN(1 + EXP(-ABS({table}.log_score - EXCLUDED.log_score))),
+            updated_at = GREATEST({table}.updated_at, EXCLUDED.updated_at)
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [value for row in rows for value in row])
+
+
+def window_start(now):
+    return now - timedelta(days=settings.TRENDING_WINDOW_DAYS)
+
+
+def trending_products(category, now=None):
+    """
+    Products trending in ``category``, best first. Slice it for the top K:
+    the (category, -log_score) index makes that a short range scan.
+    """
+    now = now or timezone.now()
+    # The product's own category is checked too: a product moved to another
+    # category keeps its old one here until it sells again.
+    return Product.objects.filter(
+        trend__category=category, category=category, trend__updated_at__gte=window_start(now),
+    ).order_by('-trend__log_score', 'id')
+
+
+def trending_cache_key(category):
+    return f'trending:{category}'
+
+
+def prune_trending(now=None):
+    """
+    Delete the scores of products that have not sold within the window and
+    return how many were removed.
+    """
+    deleted, _ = ProductTrend.objects.filter(updated_at__lt=window_start(now or timezone.now())).delete()
+    return deleted
+
+
+def rebuild_trending(now=None):
+    """
+    Recompute every score from the orders placed within the window, for
+    backfill or repair, and return the number of products scored. This is
+    the only code path that reads the order tables.
+    """
+    now = now or timezone.now()
+    rate = decay_rate()
+    # Weights are taken relative to now so EXP() stays in range.
+    offset = now.timestamp() * rate
+    trend = connection.ops.quote_name(ProductTrend._meta.db_table)
+    item = connection.ops.quote_name(OrderItem._meta.db_table)
+    order = connection.ops.quote_name(Order._meta.db_table)
+    product = connection.ops.quote_name(Product._meta.db_table)
+    sql = f"""
+        INSERT INTO {trend} (product_id, category, log_score, updated_at)
+        SELECT i.product_id, p.category,
+               %s + LN(SUM(i.quantity * EXP(EXTRACT(EPOCH FROM o.created_at) * %s - %s))),
+               MAX(o.created_at)
+        FROM {item} AS i
+        JOIN {order} AS o ON o.id = i.order_id
+        JOIN {product} AS p ON p.id = i.product_id
+        WHERE o.created_at >= %s AND i.quantity > 0
+        GROUP BY i.product_id, p.category
+    """
+    with transaction.atomic():
+        ProductTrend.objects.all().delete()
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [offset, rate, offset, window_start(now)])
+            return cursor.rowcount
@@ -1,14 +1,25 @@
 from django.urls import path
-from .views import ProductListView, ProductDetailView, ProductCreateView, OrderCreateView, OrderDetailView, MarketplaceView, FarmerProductListView, FarmerOrdersView, BuyerOrdersView, ProductEditView
+from .views import ProductListView, ProductDetailView, ProductCreateView, OrderCreateView, OrderDetailView, MarketplaceView, FarmerProductListView, FarmerOrdersView, BuyerOrdersView, ProductEditView, ProductSearchView, MarketplaceCacheStatsView, FarmerSalesDashboardView, ProductImportView, ProductBatchUpdateView, FarmerOrdersExportView, BuyerOrdersExportView, NearbyProductsView, TrendingProductsView, RecommendedProductsView, ProductImageView
 urlpatterns = [
     path('', ProductListView.as_view(), name='product-list'),
     path('<int:pk>/', ProductDetailView.as_view(), name='product-detail'),
     path('new/', ProductCreateView.as_view(), name='product-create'),
+    path('import/', ProductImportView.as_view(), name='product-import'),
     path('orders/', OrderCreateView.as_view(), name='order-create'),
     path('orders/<int:pk>/', OrderDetailView.as_view(), name='order-detail'),
     path('marketplace/', MarketplaceView.as_view(), name='marketplace'),
+    path('marketplace/cache-stats/', MarketplaceCacheStatsView.as_view(), name='marketplace-cache-stats'),
+    path('nearby/', NearbyProductsView.as_view(), name='product-nearby'),
+    path('trending/', TrendingProductsView.as_view(), name='product-trending'),
+    path('recommended/', RecommendedProductsView.as_view(), name='product-recommended'),
+    path('search/', ProductSearchView.as_view(), name='product-search'),
     path('my-products/', FarmerProductListView.as_view(), name='farmer-products'),
+    path('my-products/dashboard/', FarmerSalesDashboardView.as_view(), name='farmer-sales-dashboard'),
     path('orders/farmer/', FarmerOrdersView.as_view(), name='farmer-orders'),
     path('orders/buyer/', BuyerOrdersView.as_view(), name='buyer-orders'),
+    path('orders/farmer/export.<str:fmt>', FarmerOrdersExportView.as_view(), name='farmer-orders-export'),
+    path('orders/buyer/export.<str:fmt>', BuyerOrdersExportView.as_view(), name='buyer-orders-export'),
+    path('edit/<int:pk>/image/', ProductImageView.as_view(), name='product-image'),
+    path('edit/batch/', ProductBatchUpdateView.as_view(), name='product-batch-update'),
     path('edit/<int:pk>/', ProductEditView.as_view(), name='product-edit'),
 ]
\ No newline at end of file
@@ -1,16 +1,44 @@
-from rest_framework import generics, permissions
-from .models import Product, Order
-from .serializers import ProductSerializer, OrderSerializer
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F, FloatField, Prefetch, Sum
+from django.utils import timezone
+from django.db.models.functions import Cast
+from rest_framework import generics, permissions, status
+from rest_framework.parsers import FormParser, MultiPartParser
+from rest_framework.exceptions import UnsupportedMediaType, ValidationError
+from rest_framework.response import Response
+from rest_framework.views import APIView
+from .models import Product, Order, OrderItem, FarmerDailySales, FarmerDailyTotals
+from .reservations import release_order_reservations
+from .rollups import retract_order_sales, retract_product_popularity
+from .services import ProductsNotOwned, update_inventory
+from .serializers import (
+    ProductSerializer, ProductRowSerializer, ProductSearchSerializer, OrderSerializer, FarmerOrderSerializer,
+    NearbyProductSerializer, NearbyQuerySerializer, TrendingProductSerializer, TrendingQuerySerializer, RecommendedProductSerializer, ProductBatchUpdateSerializer, ProductImageSerializer, SalesDashboardQuerySerializer, SalesTotalsSerializer, DailySalesSerializer, ProductSalesSerializer,
+)
+from .pagination import KeysetPagination
+from .mixins import ConditionalRetrieveMixin, OrderExportMixin, ProductRowsMixin
+from .filters import MarketplaceFilterBackend, facet_counts, products_near
+from .importers import CONTENT_TYPES, import_products, iter_records
+from .images import set_product_image
+from .trending import trending_cache_key, trending_products
+from .cache import marketplace_cache_key, get_cached_page, set_cached_page, cache_stats
 from drf_yasg.utils import swagger_auto_schema
 
-class ProductListView(generics.ListAPIView):
+class ProductListView(ProductRowsMixin, generics.ListAPIView):
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = KeysetPagination
     
 
-class ProductDetailView(generics.RetrieveAPIView):
-    queryset = Product.objects.all()
+class ProductDetailView(ConditionalRetrieveMixin, generics.RetrieveAPIView):
+    queryset = Product.objects.select_related('farmer')
     serializer_class = ProductSerializer
 
 class ProductCreateView(generics.CreateAPIView):
@@ -23,6 +51,28 @@ class ProductCreateView(generics.CreateAPIView):
         serializer.save(farmer=self.request.user)
 
 
+class ProductImportView(APIView):
+    """
+    Bulk-create products for the logged-in farmer from a CSV (``text/csv``,
+    with a header row) or NDJSON (``application/x-ndjson``) request body.
+
+    The body is read as a stream and imported in chunks; rows that fail
+    validation are reported by row number and the rest are still created.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    @swagger_auto_schema(operation_description="Bulk import products from CSV or NDJSON")
+    def post(self, request):
+        content_type = request.content_type.split(';')[0].strip().lower()
+        fmt = CONTENT_TYPES.get(content_type)
+        if fmt is None:
+            raise UnsupportedMediaType(content_type)
+        if request.stream is None:
+            raise ValidationError({'detail': 'The request body is empty.'})
+        result = import_products(request.user, iter_records(request.stream, fmt))
+        return Response(result)
+
+
 # a view to be able to edit a particular product accordding to its id
 class ProductEditView(generics.RetrieveUpdateDestroyAPIView):
     queryset = Product.objects.all()
@@ -45,6 +95,51 @@ class ProductEditView(generics.RetrieveUpdateDestroyAPIView):
         return Product.objects.none()
 
 
+class ProductImageView(generics.GenericAPIView):
+    """
+    Upload the photo of one of the logged-in farmer's products.
+
+    The original is stored at once; thumbnails are rendered in the
+    background, so the response (202) may still show the old or no
+    thumbnails for a moment.
+    """
+    queryset = Product.objects.all()
+    serializer_class = ProductImageSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    parser_classes = [MultiPartParser, FormParser]
+
+    def get_queryset(self):
+        return self.queryset.filter(farmer=self.request.user)
+
+    @swagger_auto_schema(operation_description="Upload a product photo")
+    def put(self, request, pk):
+        product = self.get_object()
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        with transaction.atomic():
+            set_product_image(product, serializer.validated_data['image'])
+        return Response(ProductSerializer(product).data, status=status.HTTP_202_ACCEPTED)
+
+
+class ProductBatchUpdateView(APIView):
+    """
+    Change the price and/or stock of many of the logged-in farmer's products
+    in one request and one transaction. Either every change applies or, if
+    any id is not one of the farmer's products, none do.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    @swagger_auto_schema(request_body=ProductBatchUpdateSerializer, operation_description="Batch update product prices and stock")
+    def patch(self, request):
+        serializer = ProductBatchUpdateSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        try:
+            updated = update_inventory(request.user, serializer.validated_data['items'])
+        except ProductsNotOwned as exc:
+            raise ValidationError({'items': [str(exc)]})
+        return Response({'updated': updated})
+
+
 class OrderCreateView(generics.CreateAPIView):
     queryset = Order.objects.all()
     serializer_class = OrderSerializer
@@ -55,8 +150,8 @@ class OrderCreateView(generics.CreateAPIView):
         serializer.save(buyer=self.request.user)
 
 
-class OrderDetailView(generics.RetrieveDestroyAPIView):
-    queryset = Order.objects.all()
+class OrderDetailView(ConditionalRetrieveMixin, generics.RetrieveDestroyAPIView):
+    queryset = Order.objects.prefetch_related('items')
     serializer_class = OrderSerializer
     permission_classes = [permissions.IsAuthenticated]
 
@@ -71,12 +166,189 @@ class OrderDetailView(generics.RetrieveDestroyAPIView):
         
         return self.queryset.filter(buyer=self.request.user)
 
-class MarketplaceView(generics.ListAPIView):
-    # This is a public view, so no permission classes are needed.
+    def perform_destroy(self, instance):
+        # Deleting the order would cascade its reservations away; put any
+        # stock still held for it back on the shelf first.
+        with transaction.atomic():
+            release_order_reservations([instance.id])
+            retract_order_sales(instance)
+            retract_product_popularity(instance)
+            instance.delete()
+
+class MarketplaceView(ProductRowsMixin, generics.ListAPIView):
+    # This is a public view, so it must opt out of the default IsAuthenticated.
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
+    permission_classes = [permissions.AllowAny]
+    pagination_class = KeysetPagination
+    filter_backends = [MarketplaceFilterBackend]
+    # ?ordering= values; each one is served by a matching composite index.
+    orderings = {
+        'newest': ('-created_at', '-id'),
+        'popular': ('-units_sold', '-order_count', '-id'),
+    }
+
+    @property
+    def keyset_ordering(self):
+        # Unknown values are rejected by MarketplaceFilterBackend first.
+        return self.orderings.get(self.request.query_params.get('ordering'), self.orderings['newest'])
+
+    def list(self, request, *args, **kwargs):
+        cache_key = marketplace_cache_key(request)
+        data = get_cached_page(cache_key)
+        if data is not None:
+            return Response(data, headers={'X-Cache': 'HIT'})
+
+        response = super().list(request, *args, **kwargs)
+        # Facets describe the whole filtered result, so they only ride along
+        # with the first page rather than being recounted on every scroll.
+        if self.paginator.cursor_query_param not in request.query_params:
+            response.data['facets'] = facet_counts(self.filter_queryset(self.get_queryset()))
+        set_cached_page(cache_key, response.data)
+        response['X-Cache'] = 'MISS'
+        return response
 
-class FarmerProductListView(generics.ListAPIView):
+class MarketplaceCacheStatsView(APIView):
+    """
+    Hit/miss counters of the marketplace response cache, for tuning.
+    """
+    permission_classes = [permissions.IsAdminUser]
+
+    @swagger_auto_schema(operation_description="Marketplace response cache statistics")
+    def get(self, request):
+        return Response(cache_stats())
+
+class ProductSearchView(generics.ListAPIView):
+    """
+    Ranked full-text search over product titles and descriptions.
+
+    Matches come from the GIN-indexed ``search_vector`` column; titles weigh
+    more than descriptions. Accepts web-search syntax in ``q``
+    (``"broiler chicks" -turkey``).
+
+    Only the ``SEARCH_CANDIDATE_LIMIT`` newest matches are ranked, so a
+    common term costs a bounded index scan plus ranking that many rows,
+    instead of ranking and sorting every match before the page is cut.
+    Rarer terms, with fewer matches than that, are ranked in full.
+    """
+    serializer_class = ProductSearchSerializer
+    permission_classes = [permissions.AllowAny]
+    pagination_class = KeysetPagination
+    keyset_ordering = ('-rank', '-id')
+
+    def get_queryset(self):
+        if getattr(self, 'swagger_fake_view', False):
+            return Product.objects.none()
+
+        terms = self.request.query_params.get('q', '').strip()
+        if not terms:
+            raise ValidationError({'q': 'A search query is required.'})
+
+        query = SearchQuery(terms, search_type='websearch', config='english')
+        # ts_rank() returns a real; widen it so the rank in the cursor
+        # round-trips exactly when the next page filters on it.
+        rank = Cast(SearchRank(F('search_vector'), query), FloatField())
+        candidates = (
+            Product.objects.filter(search_vector=query)
+            .order_by('-created_at', '-id')
+            .values('pk')[:settings.SEARCH_CANDIDATE_LIMIT]
+        )
+        return (
+            Product.objects.filter(pk__in=candidates)
+            .annotate(rank=rank)
+            .select_related('farmer')
+            .defer('search_vector')
+        )
+
+class NearbyProductsView(generics.GenericAPIView):
+    """
+    Products from the farms nearest to ``lat``/``lon`` (or a known ``town``),
+    nearest first.
+
+    With ``radius`` (km) only farms inside it are considered. Without it the
+    search widens step by step until ``limit`` products are found, so sparse
+    regions still get results while dense ones stay cheap.
+    """
+    queryset = Product.objects.all()
+    serializer_class = NearbyProductSerializer
+    permission_classes = [permissions.AllowAny]
+    search_radii_km = (10, 25, 50, 100, 250, 500)
+
+    @swagger_auto_schema(query_serializer=NearbyQuerySerializer, operation_description="Products from nearby farms")
+    def get(self, request):
+        params = NearbyQuerySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        latitude, longitude, limit = params.validated_data['lat'], params.validated_data['lon'], params.validated_data['limit']
+        radii = [params.validated_data['radius']] if 'radius' in params.validated_data else self.search_radii_km
+
+        for radius in radii:
+            rows = list(
+                NearbyProductSerializer.rows(products_near(self.get_queryset(), latitude, longitude, radius))
+                .order_by('distance_km', 'id')[:limit]
+            )
+            if len(rows) == limit:
+                break
+        return Response({
+            'lat': latitude,
+            'lon': longitude,
+            'radius_km': radius,
+            'results': self.get_serializer(rows, many=True).data,
+        })
+
+class TrendingProductsView(generics.GenericAPIView):
+    """
+    Products selling fastest lately, per category, ranked by exponentially
+    decayed sales (see trending.py). ``score`` is the decayed number of
+    units sold.
+
+    Each category's top ``TRENDING_TOP_K`` comes from the trend table's
+    index and is cached briefly; the order tables are never read.
+    """
+    queryset = Product.objects.all()
+    serializer_class = TrendingProductSerializer
+    permission_classes = [permissions.AllowAny]
+
+    def top_products(self, category):
+        key = trending_cache_key(category)
+        data = cache.get(key)
+        if data is None:
+            now = timezone.now()
+            rows = TrendingProductSerializer.rows(trending_products(category, now)[:settings.TRENDING_TOP_K])
+            data = self.get_serializer(rows, many=True, context={'now': now}).data
+            cache.set(key, data, timeout=settings.TRENDING_CACHE_TIMEOUT)
+        return data
+
+    @swagger_auto_schema(query_serializer=TrendingQuerySerializer, operation_description="Trending products per category")
+    def get(self, request):
+        params = TrendingQuerySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        categories = [params.validated_data['category']] if 'category' in params.validated_data else [value for value, _ in Product.FARMER_CHOICES]
+        limit = params.validated_data['limit']
+        return Response({
+            'window_days': settings.TRENDING_WINDOW_DAYS,
+            'results': {category: self.top_products(category)[:limit] for category in categories},
+        })
+
+class RecommendedProductsView(generics.GenericAPIView):
+    """
+    The signed-in buyer's recommended products, best match first.
+
+    Recommendations are precomputed from the buyer's ``preferred_products``
+    (see recommendations.py), so this is a single query. Products that sold
+    out since are left out.
+    """
+    serializer_class = RecommendedProductSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        return Product.objects.filter(recommendations__buyer=self.request.user, stock__gt=0).order_by('recommendations__rank')
+
+    @swagger_auto_schema(operation_description="Products recommended for the signed-in buyer")
+    def get(self, request):
+        rows = RecommendedProductSerializer.rows(self.get_queryset())
+        return Response({'results': self.get_serializer(rows, many=True).data})
+
+class FarmerProductListView(ProductRowsMixin, generics.ListAPIView):
     serializer_class = ProductSerializer
     permission_classes = [permissions.IsAuthenticated]
 
@@ -86,15 +358,63 @@ class FarmerProductListView(generics.ListAPIView):
         if user.is_authenticated:
             return Product.objects.filter(farmer=user)
         return Product.objects.none()
+
+class FarmerSalesDashboardView(APIView):
+    """
+    Revenue, units sold and order counts for the logged-in farmer over the
+    last ``days`` days, per day and per product.
+
+    Reads only the daily rollup tables, so it stays flat as order history grows.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    @swagger_auto_schema(operation_description="Sales dashboard for the logged-in farmer", query_serializer=SalesDashboardQuerySerializer)
+    def get(self, request):
+        params = SalesDashboardQuerySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        end = timezone.localdate()
+        start = end - timedelta(days=params.validated_data['days'] - 1)
+        window = {'farmer': request.user, 'day__range': (start, end)}
+
+        daily = list(
+            FarmerDailyTotals.objects.filter(**window)
+            .order_by('day').values('day', 'revenue', 'units', 'orders')
+        )
+        products = (
+            FarmerDailySales.objects.filter(**window)
+            .values('product_id', 'product__title')
+            .annotate(total_revenue=Sum('revenue'), total_units=Sum('units'), total_orders=Sum('orders'))
+            .order_by('-total_revenue', 'product_id')
+        )
+        totals = {
+            'revenue': sum((row['revenue'] for row in daily), Decimal('0')),
+            'units': sum(row['units'] for row in daily),
+            'orders': sum(row['orders'] for row in daily),
+        }
+        return Response({
+            'start': start,
+            'end': end,
+            'totals': SalesTotalsSerializer(totals).data,
+            'daily': DailySalesSerializer(daily, many=True).data,
+            'products': ProductSalesSerializer(products, many=True).data,
+        })
     
 class FarmerOrdersView(generics.ListAPIView):
-    serializer_class = OrderSerializer
+    serializer_class = FarmerOrderSerializer
     permission_classes = [permissions.IsAuthenticated]
 
     def get_queryset(self):
-        # This view correctly implements access control. No changes needed.
+        """
+        Orders containing the farmer's products, newest first, with only the
+        farmer's own line items (and so their subtotal, see
+        FarmerOrderSerializer). Read through the FarmerOrder link table.
+        """
         farmer = self.request.user
-        return Order.objects.filter(items__product__farmer=farmer).distinct()
+        return (
+            Order.objects.filter(farmer_links__farmer=farmer)
+            .order_by('-farmer_links__created_at', '-id')
+            .prefetch_related(Prefetch('items', queryset=OrderItem.objects.filter(farmer=farmer)))
+        )
 
 class BuyerOrdersView(generics.ListAPIView):
     serializer_class = OrderSerializer
@@ -103,4 +423,11 @@ class BuyerOrdersView(generics.ListAPIView):
     def get_queryset(self):
         # This view correctly implements access control. No changes needed.
         buyer = self.request.user
-        return Order.objects.filter(buyer=buyer)
\ No newline at end of file
+        return Order.objects.filter(buyer=buyer).order_by('-created_at', '-id').prefetch_related('items')
+
+class FarmerOrdersExportView(OrderExportMixin, FarmerOrdersView):
+    export_filename = 'farmer-orders'
+    export_subtotals = True
+
+class BuyerOrdersExportView(OrderExportMixin, BuyerOrdersView):
+    export_filename = 'buyer-orders'
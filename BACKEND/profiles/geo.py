@@ -0,0 +1,161 @@
+"""
+Geocoding and proximity helpers that work on plain Postgres.
+
+Farm coordinates come from a gazetteer of Kenyan towns shipped with the app
+(``profiles/data/kenya_towns.csv``), so geocoding needs no network access.
+Each profile also stores the geohash of its coordinates. Nearby points share
+geohash prefixes, so a radius search becomes a handful of indexed prefix
+scans over the cells covering the circle, with the exact great-circle
+distance only computed for the farms in those cells.
+"""
+import csv
+import math
+from functools import lru_cache
+from pathlib import Path
+
+from django.db.models import F, FloatField, Value
+from django.db.models.functions import ASin, Cos, Least, Power, Radians, Sin, Sqrt
+
+GAZETTEER_PATH = Path(__file__).resolve().parent / 'data' / 'kenya_towns.csv'
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+GEOHASH_PRECISION = 9
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+
+def normalize_place(name):
+    return ' '.join(name.replace('’', "'").split()).casefold()
+
+
+@lru_cache(maxsize=None)
+def load_gazetteer():
+    """
+    Return ``{normalized town name: (latitude, longitude)}``.
+    """
+    with open(GAZETTEER_PATH, newline='', encoding='utf-8') as handle:
+        return {
+            normalize_place(row['name']): (float(row['latitude']), float(row['longitude']))
+            for row in csv.DictReader(handle)
+        }
+
+
+def geocode(location):
+    """
+    Resolve a free-text location to ``(latitude, longitude)``, or None.
+
+    The whole string is tried first, then each comma-separated part, so
+    "Kiambu Road, Thika" and "Nakuru, Kenya" both resolve.
+    """
+    if not location:
+        return None
+    gazetteer = load_gazetteer()
+    for candidate in [location, *location.split(',')]:
+        coordinates = gazetteer.get(normalize_place(candidate))
+        if coordinates is not None:
+            return coordinates
+    return None
+
+
+def locate(location, latitude=None, longitude=None):
+    """
+    Return ``(latitude, longitude, geohash)`` for a farm, geocoding
+    ``location`` when the coordinates are not known. Unresolvable places
+    come back as ``(None, None, '')``.
+    """
+    if latitude is None or longitude is None:
+        latitude, longitude = geocode(location) or (None, None)
+    if latitude is None or longitude is None:
+        return None, None, ''
+    return latitude, longitude, geohash_encode(latitude, longitude)
+
+
+def locate_profiles(queryset, batch_size=500, relocate=False):
+    """
+    Geocode the farmer profiles in ``queryset`` in batches and return how
+    many got coordinates. Profiles with coordinates keep them unless
+    ``relocate`` is set. Works with historical models in migrations.
+    """
+    located = 0
+    batch = []
+    for profile in queryset.only('id', 'location', 'latitude', 'longitude', 'geohash').iterator(chunk_size=batch_size):
+        if relocate:
+            profile.latitude = profile.longitude = None
+        profile.latitude, profile.longitude, profile.geohash = locate(profile.location, profile.latitude, profile.longitude)
+        located += bool(profile.geohash)
+        batch.append(profile)
+        if len(batch) >= batch_size:
+            queryset.model.objects.bulk_update(batch, ['latitude', 'longitude', 'geohash'])
+            batch = []
+    if batch:
+        queryset.model.objects.bulk_update(batch, ['latitude', 'longitude', 'geohash'])
+    return located
+
+
+def geohash_encode(latitude, longitude, precision=GEOHASH_PRECISION):
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars = []
+    bits, bit_count, even = 0, 0, True
+    while len(chars) < precision:
+        value, interval = (longitude, lon_range) if even else (latitude, lat_range)
+        middle = (interval[0] + interval[1]) / 2
+        if value >= middle:
+            bits = bits * 2 + 1
+            interval[0] = middle
+        else:
+            bits = bits * 2
+            interval[1] = middle
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(BASE32[bits])
+            bits, bit_count = 0, 0
+    return ''.join(chars)
+
+
+def cell_size(precision):
+    """
+    Return the ``(height, width)`` in degrees of a geohash cell.
+    """
+    bits = 5 * precision
+    return 180.0 / 2 ** (bits // 2), 360.0 / 2 ** ((bits + 1) // 2)
+
+
+def covering_cells(latitude, longitude, radius_km):
+    """
+    Geohash prefixes whose cells together contain every point within
+    ``radius_km`` of the given point.
+
+    Uses the finest precision whose cells are at least ``radius_km`` tall and
+    wide; the circle then fits in the 3x3 block of cells around its centre.
+    """
+    cos_lat = max(math.cos(math.radians(latitude)), 0.01)
+    precision = 1
+    for candidate in range(GEOHASH_PRECISION, 0, -1):
+        height, width = cell_size(candidate)
+        if height * KM_PER_DEGREE >= radius_km and width * KM_PER_DEGREE * cos_lat >= radius_km:
+            precision = candidate
+            break
+    height, width = cell_size(precision)
+    cells = set()
+    for dlat in (-height, 0, height):
+        for dlon in (-width, 0, width):
+            lat = min(max(latitude + dlat, -90.0), 90.0)
+            lon = (longitude + dlon + 180.0) % 360.0 - 180.0
+            cells.add(geohash_encode(lat, lon, precision))
+    return sorted(cells)
+
+
+def distance_km(latitude, longitude, lat_field, lon_field):
+    """
+    Haversine distance in km from a point to the coordinates in
+    ``lat_field``/``lon_field``, as a query expression.
+    """
+    lat1 = Radians(Value(latitude, output_field=FloatField()))
+    lon1 = Radians(Value(longitude, output_field=FloatField()))
+    lat2, lon2 = Radians(F(lat_field)), Radians(F(lon_field))
+    a = (
+        Power(Sin((lat2 - lat1) / 2), 2)
+        + Cos(lat1) * Cos(lat2) * Power(Sin((lon2 - lon1) / 2), 2)
+    )
+    # LEAST guards ASIN against rounding just above 1.
+    return 2 * EARTH_RADIUS_KM * ASin(Least(Sqrt(a), Value(1.0, output_field=FloatField())))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from profiles.geo import locate_profiles
+from profiles.models import FarmerProfile
+
+
+class Command(BaseCommand):
+    help = "Geocode farmer profiles from their location using the bundled gazetteer."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--relocate', action='store_true', help='Re-geocode profiles that already have coordinates.')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        profiles = FarmerProfile.objects.all()
+        if not options['relocate']:
+            profiles = profiles.filter(geohash='')
+        located = locate_profiles(profiles, batch_size=options['batch_size'], relocate=options['relocate'])
+        unresolved = FarmerProfile.objects.filter(geohash='').count()
+        self.stdout.write(self.style.SUCCESS(f"Located {located} farm(s); {unresolved} still without coordinates."))
@@ -0,0 +1,20 @@
+# Generated by Django 5.2.7 on 2026-10-18 15:00
+
+import django.db.models.functions.text
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('profiles', '0002_remove_buyerprofile_bio_remove_buyerprofile_location_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='farmerprofile',
+            index=models.Index(django.db.models.functions.text.Upper('location'), name='farmerprofile_location_idx'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.7 on 2026-10-18 15:23
+
+import django.core.validators
+from django.conf import settings
+from django.db import migrations, models
+
+from profiles.geo import locate_profiles
+
+
+def geocode_farmer_profiles(apps, schema_editor):
+    FarmerProfile = apps.get_model('profiles', 'FarmerProfile')
+    locate_profiles(FarmerProfile.objects.all())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('profiles', '0003_farmerprofile_farmerprofile_location_idx'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='farmerprofile',
+            name='geohash',
+            field=models.CharField(blank=True, default='', editable=False, max_length=12),
+        ),
+        migrations.AddField(
+            model_name='farmerprofile',
+            name='latitude',
+            field=models.FloatField(blank=True, null=True, validators=[django.core.validators.MinValueValidator(-90), django.core.validators.MaxValueValidator(90)]),
+        ),
+        migrations.AddField(
+            model_name='farmerprofile',
+            name='longitude',
+            field=models.FloatField(blank=True, null=True, validators=[django.core.validators.MinValueValidator(-180), django.core.validators.MaxValueValidator(180)]),
+        ),
+        migrations.AddIndex(
+            model_name='farmerprofile',
+            index=models.Index(fields=['geohash'], name='farmerprofile_geohash_idx', opclasses=['varchar_pattern_ops']),
+        ),
+        migrations.RunPython(geocode_farmer_profiles, migrations.RunPython.noop),
+    ]
@@ -1,7 +1,11 @@
 from django.db import models
+from django.db.models.functions import Upper
 from django.contrib.auth import get_user_model
+from django.core.validators import MaxValueValidator, MinValueValidator
 from django.utils import timezone
 
+from .geo import locate
+
 User = get_user_model()
 
 class FarmerProfile(models.Model):
@@ -10,12 +14,30 @@ class FarmerProfile(models.Model):
     location = models.CharField(max_length=255, default='Location')
     phone_number = models.CharField(max_length=15, default='Phone Number')
     farm_size = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)  # Farm size in acres/hectares
+    # Geocoded from ``location`` via the bundled gazetteer unless given.
+    latitude = models.FloatField(null=True, blank=True, validators=[MinValueValidator(-90), MaxValueValidator(90)])
+    longitude = models.FloatField(null=True, blank=True, validators=[MinValueValidator(-180), MaxValueValidator(180)])
+    # Geohash of (latitude, longitude); empty while the farm is not located.
+    geohash = models.CharField(max_length=12, blank=True, default='', editable=False)
     created_at = models.DateTimeField(default=timezone.now)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # Serves the marketplace's case-insensitive location filter.
+            models.Index(Upper('location'), name='farmerprofile_location_idx'),
+            # Prefix (LIKE 'abc%') scans for the nearby-products search.
+            models.Index(fields=['geohash'], opclasses=['varchar_pattern_ops'], name='farmerprofile_geohash_idx'),
+        ]
+
     def __str__(self):
         return f"{self.user.username}'s Farmer Profile"
 
+    def save(self, *args, **kwargs):
+        # Fill in missing coordinates from the location, refresh the geohash.
+        self.latitude, self.longitude, self.geohash = locate(self.location, self.latitude, self.longitude)
+        super().save(*args, **kwargs)
+
 class BuyerProfile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name="buyer_profile")
     business_name = models.CharField(max_length=255, null=True, blank=True)
@@ -4,9 +4,16 @@ from .models import FarmerProfile, BuyerProfile
 class FarmerProfileSerializer(serializers.ModelSerializer):
     class Meta:
         model = FarmerProfile
-        fields = ['id', 'user', 'farm_name', 'location', 'phone_number', 'farm_size', 'created_at', 'updated_at']
+        fields = ['id', 'user', 'farm_name', 'location', 'phone_number', 'farm_size', 'latitude', 'longitude', 'created_at', 'updated_at']
         read_only_fields = ['id', 'user', 'created_at', 'updated_at']
 
+    def update(self, instance, validated_data):
+        # A new location without new coordinates is geocoded afresh on save.
+        moved = 'location' in validated_data and validated_data['location'] != instance.location
+        if moved and 'latitude' not in validated_data and 'longitude' not in validated_data:
+            validated_data['latitude'] = validated_data['longitude'] = None
+        return super().update(instance, validated_data)
+
 class BuyerProfileSerializer(serializers.ModelSerializer):
     class Meta:
         model = BuyerProfile
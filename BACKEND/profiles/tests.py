@@ -58,3 +58,38 @@ def test_create_buyer_profile(api_client, create_user, get_token):
     assert response.data['business_name'] == 'Fresh Produce Ltd'
 
 #test for updating a particular farmer profile and buyer profile
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('url', ['/api/profiles/farmers/{id}/', '/api/profiles/buyers/{id}/'])
+def test_profile_detail_query_budget(api_client, create_user, django_assert_max_num_queries, url):
+    from profiles.models import FarmerProfile, BuyerProfile
+    user = create_user(username='member1', email='member1@example.com', password='password123')
+    FarmerProfile.objects.create(user=user, farm_name='Green Acres', location='Nairobi')
+    BuyerProfile.objects.create(user=user, business_name='Fresh Produce Ltd')
+    api_client.force_authenticate(user)
+
+    with django_assert_max_num_queries(1):
+        response = api_client.get(url.format(id=user.id))
+    assert response.status_code == status.HTTP_200_OK
+
+@pytest.mark.django_db
+def test_farmer_profile_is_geocoded_from_location(api_client, create_user):
+    from profiles.geo import geohash_encode
+    from profiles.models import FarmerProfile
+    user = create_user(username='farmer1', password='password123')
+    api_client.force_authenticate(user)
+    api_client.post('/api/profiles/farmers/', {'farm_name': 'Green Acres', 'location': 'Nakuru, Kenya', 'phone_number': '123456789'})
+    profile = FarmerProfile.objects.get(user=user)
+    assert (profile.latitude, profile.longitude) == (-0.3031, 36.08)
+    assert profile.geohash == geohash_encode(-0.3031, 36.08)
+
+    # Moving the farm re-geocodes it unless coordinates come along.
+    response = api_client.patch(f'/api/profiles/farmers/{user.id}/', {'location': 'Eldoret'})
+    assert response.data['latitude'] == 0.5143
+    response = api_client.patch(f'/api/profiles/farmers/{user.id}/', {'location': 'Somewhere new', 'latitude': 0.1, 'longitude': 35.0})
+    profile.refresh_from_db()
+    assert (profile.latitude, profile.longitude) == (0.1, 35.0)
+
+    response = api_client.patch(f'/api/profiles/farmers/{user.id}/', {'location': 'Unknown village'})
+    profile.refresh_from_db()
+    assert (profile.latitude, profile.geohash) == (None, '')
@@ -0,0 +1,7 @@
+from django.urls import path
+
+from .async_views import user_detail
+
+urlpatterns = [
+    path('me/', user_detail, name='async-user-detail'),
+]
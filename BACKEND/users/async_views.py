@@ -0,0 +1,16 @@
+from KUKUCONNECT.async_api import async_endpoint
+from .views import UserDetailView
+
+
+@async_endpoint(UserDetailView)
+async def user_detail(view, request):
+    """
+    Async twin of UserDetailView; the user is already loaded by the
+    authentication step, so this needs no further queries.
+    """
+    user = request.user
+    return {
+        "id": user.id,
+        "username": user.username,
+        "userType": user.user_type,
+    }
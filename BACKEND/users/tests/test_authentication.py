@@ -148,4 +148,16 @@ def test_user_logout(api_client, create_user, get_token):
     response = api_client.post(logout_url, {"refresh_token": refresh_token})
 
     # Assert the response status
-    assert response.status_code == status.HTTP_205_RESET_CONTENT
\ No newline at end of file
+    assert response.status_code == status.HTTP_205_RESET_CONTENT
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('url_name', ['user-detail', 'protected-view'])
+def test_user_endpoint_query_budget(api_client, create_user, get_token, django_assert_max_num_queries, url_name):
+    """Authenticated user endpoints cost one query: the JWT user lookup."""
+    create_user(username='farmer1', password='TestPass123', email='farmer1@example.com')
+    tokens = get_token('farmer1', 'TestPass123')
+    api_client.credentials(HTTP_AUTHORIZATION=f"Bearer {tokens['access']}")
+
+    with django_assert_max_num_queries(1):
+        response = api_client.get(reverse(url_name))
+    assert response.status_code == status.HTTP_200_OK